@@ -0,0 +1,414 @@
+from ChatServer import *
+import asyncio
+
+##############################################################################################################
+
+class AsyncIODevice():
+    """ AsyncIODevice plays the role a SelectorKey plays for the selector based CRCServer: it is what gets
+    passed to the message handlers as io_device. fileobj refers to the CRCServerProtocol of the connection
+    (instead of a socket) and data to the connection data object currently associated with it.
+    """
+    def __init__(self, protocol, data):
+        self.fileobj = protocol
+        self.data = data
+
+class CRCServerProtocol(asyncio.Protocol):
+    """ CRCServerProtocol connects an asyncio transport to an AsyncCRCServer. Received data is handed to the
+    server's handle_messages() exactly like the selector engine does, so every message handler is shared
+    between both engines.
+    """
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.writing_paused = False
+        self.io_device = AsyncIODevice(self, BaseConnectionData())
+        self.io_device.data.sock = self
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.protocols.add(self)
+        if self.server.tcp_nodelay:
+            sock = transport.get_extra_info('socket')
+            if sock is not None:
+                sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+    def data_received(self, data):
+        self.server.handle_messages(self.io_device, data)
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self.server.schedule_flush(self.io_device.data)
+
+    def connection_lost(self, exc):
+        self.server.protocols.discard(self)
+        self.server.forget_connection(self.io_device.data)
+
+##############################################################################################################
+
+class AsyncCRCServer(CRCServer):
+    def __init__(self, options, run_on_localhost=False):
+        """ AsyncCRCServer is an alternative engine for CRCServer built on asyncio protocols and transports
+        instead of a hand-rolled selector loop. It keeps all of CRCServer's state (hosts_db, adjacent_*_ids,
+        message_handlers, ...) and reuses its handle_*_message methods unchanged; only the parts dealing with
+        sockets are replaced. Outgoing messages are still queued on the connection data objects and are
+        handed to the transports once per event loop iteration with transport.writelines(). While a transport's
+        own buffer is above its high-water mark messages stay in the connection's write queue instead, so
+        CRCServer's backpressure handling (watermarks, paused reading and slow consumer policies) applies to
+        this engine as well. Received messages are dispatched with the same per-connection budgets, one round of
+        turns per event loop iteration, and the transport of a connection with carried over messages stops
+        reading until they have been dispatched.
+
+        Setting options.uvloop runs the server on a uvloop event loop if uvloop is installed. The loop is
+        created up front, so call_soon_threadsafe() and submit() can be used from other threads right away;
+        setting request_terminate stops the server without polling.
+
+        Args:
+            options (Options): an object containing various properties used to configure the server
+            run_on_localhost (bool): a boolean indiciating whether this server should connected to
+                applications via localhost or an actual IP address
+        Returns:
+            None
+        """
+        super(AsyncCRCServer, self).__init__(options, run_on_localhost)
+        self.use_uvloop = getattr(options, 'uvloop', False)
+        self.loop = self.new_event_loop()
+        self.stopped = None
+        self.listener = None
+        self.protocols = set()
+        self.dispatch_pending = False
+
+##############################################################################################################
+
+    def run(self):
+        """ This method is called to start the server. It runs an asyncio event loop in the calling thread
+        until self.request_terminate is set.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        self.print_info("Launching server %s..." % self.server_name)
+        try:
+            self.loop.run_until_complete(self.serve())
+        finally:
+            self.loop.close()
+
+    def new_event_loop(self):
+        """ This function creates the event loop the server runs on, using uvloop if it was requested and is
+        available.
+
+        Args:
+            None
+        Returns:
+            AbstractEventLoop: a new event loop
+        """
+        if self.use_uvloop:
+            try:
+                import uvloop
+                return uvloop.new_event_loop()
+            except ImportError:
+                self.print_info("uvloop is not installed, falling back to the default event loop")
+        return asyncio.new_event_loop()
+
+    async def serve(self):
+        """ This coroutine sets up the listening socket, connects to the configured remote server (if any)
+        and then keeps the server running until it is asked to terminate.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        self.stopped = self.loop.create_future()
+
+        self.print_info("Configuring the server socket...")
+        self.listener = await self.loop.create_server(lambda: CRCServerProtocol(self), '', self.port,
+                                                      reuse_address=True)
+
+        if self.connect_to_host and self.connect_to_port:
+            await self.connect_to_server()
+
+        self.print_info("Listening for new connections on port " + str(self.port))
+        if not self.request_terminate:
+            await self.stopped
+
+        self.cleanup()
+
+    def wake_up(self):
+        """ This function stops serve() once request_terminate is set. It may be called from any thread.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        if not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stop_serving)
+
+    def stop_serving(self):
+        if self.stopped and not self.stopped.done():
+            self.stopped.set_result(None)
+
+    def call_soon_threadsafe(self, callback, *args):
+        """ This function schedules callback(*args) to be called by the event loop. It may be called from any
+        thread.
+
+        Args:
+            callback (callable): the function to call
+            args: the arguments to call it with
+        Returns:
+            None
+        """
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    async def connect_to_server(self):
+        """ This coroutine connects to the remote CRC server this server registers with on start up and sends
+        it this server's registration message, and then does the same with the server's mesh peers, if it is
+        a mesh server (see CRCServer.connect_to_mesh_peer).
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        self.print_info("Connecting to remote server %s:%i..." % (self.connect_to_host, self.connect_to_port))
+        transport, protocol = await self.loop.create_connection(lambda: CRCServerProtocol(self),
+                                                                self.connect_to_host_addr, self.connect_to_port)
+
+        self.send_registration(protocol.io_device.data, announce=self.announce_on_connect)
+
+        self.print_info("Connected to another server")
+
+        if self.mesh:
+            for host, port in self.mesh_peers:
+                self.print_info("Connecting to mesh peer %s:%i..." % (host, port))
+                try:
+                    transport, protocol = await self.loop.create_connection(lambda: CRCServerProtocol(self), 
+                                                                            host, port)
+                except OSError as error:
+                    self.print_info("Could not reach mesh peer %s:%i: %s" % (host, port, error))
+                    continue
+                self.send_registration(protocol.io_device.data, announce=self.announce_on_connect)
+
+    def connect_to_replacement(self, departed_id, address):
+        """ This function connects to the server that replaces a departed adjacent server in the background,
+        since opening a connection is a coroutine with this engine (see CRCServer.connect_to_replacement).
+
+        Args:
+            departed_id (int): the ID of the server that left
+            address (string): the address of the replacement, as "host:port"
+        Returns:
+            None
+        """
+        self.loop.create_task(self.open_replacement_link(departed_id, address))
+
+    async def open_replacement_link(self, departed_id, address):
+        host, _, port = address.rpartition(':')
+        self.print_info("Reconnecting to the replacement of Host ID #%s at %s..." % (departed_id, address))
+        try:
+            transport, protocol = await self.loop.create_connection(lambda: CRCServerProtocol(self), host, 
+                                                                    int(port))
+        except (OSError, ValueError) as error:
+            self.print_info("Could not reach the replacement of Host ID #%s: %s" % (departed_id, error))
+            self.finish_handover(departed_id)
+            return
+        self.start_handover(protocol.io_device.data, departed_id)
+
+    def cleanup(self):
+        """ This function closes the listening socket and every open transport.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        self.print_info("Cleaning up the server")
+        self.flush_connections()
+        self.listener.close()
+        for protocol in list(self.protocols):
+            protocol.transport.close()
+        # The selector and wake up channel CRCServer creates are not used by this engine
+        self.wakeup.close()
+        self.sel.close()
+
+##############################################################################################################
+
+    def queue_message(self, connection, message):
+        """ This function appends a packed message to a connection's write queue and schedules the queue to be
+        handed to the connection's transport at the end of the current event loop iteration.
+
+        Args:
+            connection (BaseConnectionData): the connection the message should be sent over
+            message (bytes): the packed message to be delivered
+        Returns:
+            None
+        """
+        if self.enqueue(connection, message):
+            self.schedule_flush(connection)
+
+    def schedule_flush(self, connection):
+        """ This function schedules a connection's write queue to be handed to its transport at the end of the
+        current event loop iteration, unless the transport has asked the protocol to pause writing.
+
+        Args:
+            connection (BaseConnectionData): the connection with pending output
+        Returns:
+            None
+        """
+        if connection.flush_scheduled or connection.sock.writing_paused or not connection.write_queue:
+            return
+        connection.flush_scheduled = True
+        if not self.connections_to_flush:
+            self.loop.call_soon(self.flush_connections)
+        self.connections_to_flush.append(connection)
+
+    def flush_connections(self):
+        """ This function writes everything queued since the last flush to the transports in one
+        writelines() call per connection.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        connections, self.connections_to_flush = self.connections_to_flush, []
+        counters = self.write_counters
+        for connection in connections:
+            connection.flush_scheduled = False
+            transport = connection.sock.transport
+            if not transport.is_closing():
+                self.batch_output(connection, 0)
+                self.compress_output(connection, 0)
+                transport.writelines(connection.write_queue)
+                counters['send_calls'] += 1
+                counters['messages_sent'] += len(connection.write_queue)
+                counters['bytes_sent'] += connection.pending_bytes
+            connection.write_queue.clear()
+            connection.pending_bytes = 0
+            # This may move spilled output back to the write queue
+            self.update_congestion(connection)
+            self.schedule_flush(connection)
+
+    def attach_connection_data(self, io_device, connection):
+        """ This function replaces the data object associated with a connection (e.g. a BaseConnectionData
+        with a ServerConnectionData once the remote host has registered).
+
+        Args:
+            io_device (AsyncIODevice): the connection whose data object should be replaced
+            connection (BaseConnectionData): the new data object
+        Returns:
+            None
+        """
+        previous = io_device.data
+        connection.take_over(previous)
+        if previous.flush_scheduled:
+            self.connections_to_flush[self.connections_to_flush.index(previous)] = connection
+            connection.flush_scheduled, previous.flush_scheduled = True, False
+        self.replace_ready_connection(previous, connection)
+        io_device.data = connection
+        self.update_congestion(connection)
+        if not connection.congested:
+            self.resume_upstreams(connection)
+
+    def close_connection(self, io_device):
+        """ This function closes a connection's transport and removes it from the routing index.
+
+        Args:
+            io_device (AsyncIODevice): the connection that should be closed
+        Returns:
+            None
+        """
+        self.disconnect(io_device.data)
+
+    def disconnect(self, connection):
+        """ This function closes a connection's transport and removes it from the routing index.
+
+        Args:
+            connection (BaseConnectionData): the connection that should be closed
+        Returns:
+            None
+        """
+        connection.sock.transport.close()
+        self.forget_connection(connection)
+
+    def set_reading(self, connection, enabled):
+        """ This function pauses or resumes reading from a connection's transport.
+
+        Args:
+            connection (BaseConnectionData): the connection to pause or resume
+            enabled (bool): whether the connection should be read from
+        Returns:
+            None
+        """
+        transport = connection.sock.transport
+        if transport.is_closing():
+            return
+        connection.reading_paused = not enabled
+        if not enabled:
+            transport.pause_reading()
+        elif not connection.read_throttled:
+            transport.resume_reading()
+
+    def schedule_dispatch(self, connection):
+        """ This function gives a connection with received messages a turn in the next round of the dispatch
+        phase and schedules the round if it is not scheduled yet.
+
+        Args:
+            connection (BaseConnectionData): the connection with messages in its inbox
+        Returns:
+            None
+        """
+        super(AsyncCRCServer, self).schedule_dispatch(connection)
+        if self.ready_connections and not self.dispatch_pending:
+            self.dispatch_pending = True
+            self.loop.call_soon(self.dispatch_ready_connections)
+
+    def dispatch_ready_connections(self):
+        """ This function runs one round of the dispatch phase and schedules another one for the next event
+        loop iteration if messages were carried over.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        self.dispatch_pending = False
+        super(AsyncCRCServer, self).dispatch_ready_connections()
+        if self.ready_connections and not self.dispatch_pending:
+            self.dispatch_pending = True
+            self.loop.call_soon(self.dispatch_ready_connections)
+
+    def throttle_reading(self, connection, throttled):
+        """ This function pauses the transport of a connection while it has carried over messages and resumes
+        it once they have been dispatched (unless backpressure paused it).
+
+        Args:
+            connection (BaseConnectionData): the connection to throttle
+            throttled (bool): whether reading should wait for the inbox to be dispatched
+        Returns:
+            None
+        """
+        connection.read_throttled = throttled
+        transport = connection.sock.transport
+        if transport.is_closing():
+            return
+        if throttled:
+            transport.pause_reading()
+        elif not connection.reading_paused:
+            transport.resume_reading()
+
+    def call_later(self, delay, callback, *args):
+        """ This function schedules callback(*args) to be called by the event loop after delay seconds.
+
+        Args:
+            delay (float): the number of seconds to wait
+            callback (callable): the function to call
+            args: the arguments to call it with
+        Returns:
+            TimerHandle: a handle that can be cancelled with its cancel() method
+        """
+        return self.loop.call_later(delay, callback, *args)
@@ -0,0 +1,42 @@
+# Measures the cost of tracking adjacent hosts through a join and quit storm on a hub server. Every join 
+# appends an ID to adjacent_user_ids and every quit checks whether the quitting client is adjacent and removes
+# it. The IDs quit in random order, which is the worst case for the list the server used before (kept below as
+# the baseline), since every removal scans and shifts the list.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.adjacency_churn --clients 50000
+import random, time
+from optparse import OptionParser
+from ChatServer import AdjacentIds
+
+
+def legacy_quit(adjacent_user_ids, client_id):
+    if client_id in adjacent_user_ids:
+        adjacent_user_ids.remove(client_id)
+
+
+def quit(adjacent_user_ids, client_id):
+    adjacent_user_ids.discard(client_id)
+
+
+def churn(adjacent_user_ids, quit, client_ids, quit_order):
+    start = time.perf_counter()
+    for client_id in client_ids:
+        adjacent_user_ids.append(client_id)
+    joined = time.perf_counter()
+    for client_id in quit_order:
+        quit(adjacent_user_ids, client_id)
+    return joined - start, time.perf_counter() - joined
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC adjacency churn benchmark")
+    op.add_option("--clients", type="int", default=50000)
+    options, args = op.parse_args()
+
+    client_ids = list(range(1000, 1000 + options.clients))
+    quit_order = random.Random(0).sample(client_ids, len(client_ids))
+    for name, adjacent_user_ids, quit_function in (('list', [], legacy_quit), ('AdjacentIds', AdjacentIds(), quit)):
+        joins, quits = churn(adjacent_user_ids, quit_function, client_ids, quit_order)
+        print("%-12s %i clients: joins %8.2fms, quits %9.2fms (%.2fus per quit)" % (
+            name, options.clients, 1000 * joins, 1000 * quits, 1e6 * quits / options.clients))
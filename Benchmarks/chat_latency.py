@@ -0,0 +1,87 @@
+# Measures the latency of interactive chat messages while a bulk stream is in flight. One client floods a
+# single CRC server with status messages addressed to it (standing in for a server link relaying a full state
+# sync), while a second client sends chat messages to a third one, one at a time, and times how long each takes
+# to arrive. The server's per-connection-class dispatch latency percentiles are printed as well.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.chat_latency --bulk-messages 200000
+#   python -m Benchmarks.chat_latency --bulk-messages 200000 --budget 1000000000
+import contextlib, io, threading, time
+from optparse import OptionParser
+from ChatMessageParser import *
+from CRCTestManager import SERVER_ENGINES
+from Benchmarks.chat_throughput import launch_servers, connect_client, BASE_PORT
+
+
+def flood(sock, message_count, content_size):
+    message = StatusUpdateMessage.bytes(900, 1, 0x00, 'x' * content_size)
+    batch = 1000
+    for _ in range(message_count // batch):
+        sock.sendall(message * batch)
+
+
+def ping(sender, receiver, stop, latencies):
+    decoder = MessageFrameDecoder()
+    message = ClientChatMessage.bytes(901, 902, 'ping')
+    while not stop.is_set():
+        start = time.perf_counter()
+        sender.sendall(message)
+        received = []
+        while not any(m.message_type == 0x81 for m in received):
+            received = decoder.feed(receiver.recv(65536))
+        latencies.append(time.perf_counter() - start)
+        time.sleep(0.001)
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def run(engine, bulk_messages, content_size, **extra):
+    servers = launch_servers(engine, 1, **extra)
+    server = servers[0][0]
+    bulk = connect_client(BASE_PORT, 900, 'bulk')
+    sender = connect_client(BASE_PORT, 901, 'sender')
+    receiver = connect_client(BASE_PORT, 902, 'receiver')
+    time.sleep(0.5)
+    receiver.recv(65536)
+
+    stop = threading.Event()
+    latencies = []
+    pinger = threading.Thread(target=ping, args=(sender, receiver, stop, latencies))
+    pinger.start()
+    start = time.perf_counter()
+    flood(bulk, bulk_messages, content_size)
+    while len(server.status_updates_log) < bulk_messages and time.perf_counter() - start < 60:
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    pinger.join()
+
+    for sock in (bulk, sender, receiver):
+        sock.close()
+    server.request_terminate = True
+    servers[0][1].join()
+    return elapsed, sorted(latencies), server.dispatch_latency_percentiles()
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC chat latency under bulk load benchmark")
+    op.add_option("--engine", type="choice", choices=list(SERVER_ENGINES.keys()), default="selector")
+    op.add_option("--bulk-messages", type="int", default=200000)
+    op.add_option("--content-size", type="int", default=32)
+    op.add_option("--budget", type="int", default=None, help="Messages dispatched per connection per turn")
+    options, args = op.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed, latencies, dispatch = run(SERVER_ENGINES[options.engine], options.bulk_messages,
+                                           options.content_size, read_budget_messages=options.budget,
+                                           read_budget_bytes=options.budget)
+
+    print("%s engine: %i bulk messages in %.3fs (%.0f msg/s)" % (
+        options.engine, options.bulk_messages, elapsed, options.bulk_messages / elapsed))
+    print("  chat round trips: %i, p50 %.2fms, p99 %.2fms, max %.2fms" % (
+        len(latencies), 1000 * percentile(latencies, 50), 1000 * percentile(latencies, 99), 1000 * latencies[-1]))
+    for connection_class, values in sorted(dispatch.items()):
+        print("  %s dispatch latency: %s" % (connection_class, ", ".join(
+            "p%s %.3fms" % (p, 1000 * seconds) for p, seconds in values.items())))
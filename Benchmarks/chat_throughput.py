@@ -0,0 +1,126 @@
+# Measures end-to-end chat throughput through a chain of CRC servers. Each sender client blasts chat messages
+# at its own receiver client connected to the last server in the chain and the time until the last message
+# arrives is reported. Server output is discarded while the benchmark runs so logging does not dominate the result.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.chat_throughput --engine selector --hops 0 --messages 20000
+#   python -m Benchmarks.chat_throughput --engine asyncio --hops 3 --messages 20000
+#   python -m Benchmarks.chat_throughput --engine selector --pairs 4 --messages 20000
+#   python -m Benchmarks.chat_throughput --engine selector --hops 3 --messages 20000 --no-batching
+import contextlib, io, socket, threading, time
+from collections import Counter
+from optparse import OptionParser, Values
+from ChatMessageParser import *
+from CRCTestManager import SERVER_ENGINES
+
+BASE_PORT = 47100
+
+
+def server_options(index, connect_to_port=None, **extra):
+    options = {
+        'id': index + 1,
+        'servername': 'server%i' % index,
+        'info': 'Benchmark server %i' % index,
+        'port': BASE_PORT + index,
+        'connect_to_host': 'server%i' % (index - 1) if connect_to_port else None,
+        'connect_to_port': connect_to_port,
+        'log_file': None,
+    }
+    options.update(extra)
+    return Values(options)
+
+
+def launch_servers(engine, count, **extra):
+    servers = []
+    for index in range(count):
+        connect_to_port = BASE_PORT + index - 1 if index else None
+        server = engine(server_options(index, connect_to_port, **extra), run_on_localhost=True)
+        thread = threading.Thread(target=server.run)
+        thread.start()
+        servers.append((server, thread))
+        time.sleep(0.2)
+    return servers
+
+
+def connect_client(port, client_id, name):
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(ClientRegistrationMessage.bytes(client_id, 0, name, 'Benchmark client'))
+    return sock
+
+
+def receive_chat_messages(sock, count, done):
+    decoder = MessageFrameDecoder()
+    received = 0
+    while received < count:
+        data = sock.recv(65536)
+        if not data:
+            break
+        received += sum(1 for m in decoder.feed(data) if m.message_type == 0x81)
+    done.append(time.perf_counter())
+
+
+def send_chat_messages(sock, source_id, destination_id, message_count, content_size):
+    message = ClientChatMessage.bytes(source_id, destination_id, 'x' * content_size)
+    batch = 100
+    for _ in range(message_count // batch):
+        sock.sendall(message * batch)
+
+
+def run(engine, hops, message_count, content_size, pairs=1, **extra):
+    servers = launch_servers(engine, hops + 1, **extra)
+    senders, receivers = [], []
+    for pair in range(pairs):
+        senders.append(connect_client(BASE_PORT, 1000 + 2 * pair, 'sender%i' % pair))
+        receivers.append(connect_client(BASE_PORT + hops, 1001 + 2 * pair, 'receiver%i' % pair))
+    time.sleep(0.5)
+
+    done = []
+    listeners = [threading.Thread(target=receive_chat_messages, args=(receiver, message_count, done))
+                 for receiver in receivers]
+    blasters = [threading.Thread(target=send_chat_messages,
+                                 args=(sender, 1000 + 2 * pair, 1001 + 2 * pair, message_count, content_size))
+                for pair, sender in enumerate(senders)]
+    for thread in listeners:
+        thread.start()
+
+    start = time.perf_counter()
+    for thread in blasters:
+        thread.start()
+    for thread in blasters + listeners:
+        thread.join(timeout=120)
+    completed = len(done) == pairs
+    elapsed = (max(done) if completed else time.perf_counter()) - start
+
+    for sock in senders + receivers:
+        sock.close()
+    for server, thread in servers:
+        server.request_terminate = True
+    for server, thread in servers:
+        thread.join()
+    write_counters = sum((server.write_counters for server, thread in servers), Counter())
+    return elapsed, completed, write_counters
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC chat throughput benchmark")
+    op.add_option("--engine", type="choice", choices=list(SERVER_ENGINES.keys()), default="selector")
+    op.add_option("--hops", type="int", default=0, help="Number of server to server hops between the clients")
+    op.add_option("--messages", type="int", default=20000)
+    op.add_option("--content-size", type="int", default=64)
+    op.add_option("--pairs", type="int", default=1, help="Number of sender/receiver client pairs")
+    op.add_option("--no-batching", action="store_false", dest="batching", default=True,
+                  help="Send every message between servers in its own frame")
+    options, args = op.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed, completed, write_counters = run(SERVER_ENGINES[options.engine], options.hops, options.messages,
+                                                 options.content_size, options.pairs,
+                                                 batch_server_links=options.batching)
+
+    total = options.messages * options.pairs
+    print("%s engine, %i hop(s), %i pair(s): %i messages in %.3fs (%.0f messages/s)%s" % (
+        options.engine, options.hops, options.pairs, total, elapsed, total / elapsed,
+        "" if completed else " -- TIMED OUT"))
+    print("  %.1f messages per send call" % (write_counters['messages_sent'] / max(1, write_counters['send_calls'])))
+    if write_counters['batches']:
+        print("  %.1f messages per batch" % (write_counters['batched_messages'] / write_counters['batches']))
@@ -0,0 +1,80 @@
+# Measures whether chat throughput grows with the number of workers that handle it, to decide whether
+# spreading one server's connections over several event loops is worth doing. Each worker runs its own
+# selector server with its own sender/receiver client pair, so the workers share no routing state and the
+# result is an upper bound for any sharded design.
+#
+# Workers run either as threads of one process, which is what reactor threads sharing one hosts_db would
+# look like, or as separate processes, which is what one process per core behind SO_REUSEPORT would look
+# like before paying for any cross-shard forwarding. The aggregate rate is reported for 1..--workers workers.
+# Threads share the GIL, so only the process figures can rise with the number of cores.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.core_scaling --workers 4 --messages 20000
+import contextlib, io, multiprocessing, threading, time
+from optparse import OptionParser
+from ChatServer import CRCServer
+from Benchmarks.chat_throughput import server_options, connect_client, receive_chat_messages, send_chat_messages
+
+BASE_PORT = 47200
+
+
+def worker(index, message_count, content_size, barrier, results):
+    port = BASE_PORT + index
+    server = CRCServer(server_options(index, port=port), run_on_localhost=True)
+    thread = threading.Thread(target=server.run)
+    thread.start()
+    time.sleep(0.2)
+    sender = connect_client(port, 1000, 'sender')
+    receiver = connect_client(port, 1001, 'receiver')
+    time.sleep(0.5)
+
+    done = []
+    listener = threading.Thread(target=receive_chat_messages, args=(receiver, message_count, done))
+    listener.start()
+    barrier.wait()
+    start = time.perf_counter()
+    send_chat_messages(sender, 1000, 1001, message_count, content_size)
+    listener.join(timeout=120)
+    results.put((start, done[0] if done else None))
+
+    sender.close()
+    receiver.close()
+    server.request_terminate = True
+    thread.join()
+
+
+def run(mode, workers, message_count, content_size):
+    # perf_counter() reads CLOCK_MONOTONIC, so the start and finish times of different processes compare
+    if mode == 'threads':
+        barrier, results, spawn = threading.Barrier(workers), multiprocessing.SimpleQueue(), threading.Thread
+    else:
+        context = multiprocessing.get_context('fork')
+        barrier, results, spawn = context.Barrier(workers), context.SimpleQueue(), context.Process
+    runners = [spawn(target=worker, args=(index, message_count, content_size, barrier, results))
+               for index in range(workers)]
+    for runner in runners:
+        runner.start()
+    times = [results.get() for _ in runners]
+    for runner in runners:
+        runner.join()
+
+    completed = all(finish is not None for start, finish in times)
+    finish = max(finish for start, finish in times) if completed else time.perf_counter()
+    return finish - min(start for start, finish in times), completed
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC multi-core scaling benchmark")
+    op.add_option("--workers", type="int", default=multiprocessing.cpu_count(), help="Largest number of workers")
+    op.add_option("--messages", type="int", default=20000, help="Messages sent by each worker's client")
+    op.add_option("--content-size", type="int", default=64)
+    options, args = op.parse_args()
+
+    print("%i CPU(s)" % multiprocessing.cpu_count())
+    for mode in ('threads', 'processes'):
+        for workers in range(1, options.workers + 1):
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed, completed = run(mode, workers, options.messages, options.content_size)
+            total = options.messages * workers
+            print("%i worker %s: %i messages in %.3fs (%.0f messages/s)%s" % (
+                workers, mode, total, elapsed, total / elapsed, "" if completed else " -- TIMED OUT"))
@@ -0,0 +1,86 @@
+# Measures how long it takes a server to send its full state to a new adjacent server. The server first learns
+# a roster of remote clients from a neighbouring server, then a new server registers and is sent the 
+# registration of every host the server knows. No sockets are used: the registrations are handed to
+# handle_messages() directly and the sync is left in the new server's write queue. The sync loop the server
+# used before registrations were cached (which encoded a new registration message for every host) is kept below
+# as the baseline.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.full_state_sync --hosts 100000
+import contextlib, io, selectors, time
+from optparse import OptionParser, Values
+from ChatMessageParser import *
+from ChatServer import CRCServer, BaseConnectionData, ServerConnectionData, ClientConnectionData
+
+
+def legacy_sync(server, new_server_connection):
+    for host_id, host_data in server.hosts_db.items():
+        if host_id != new_server_connection.id:
+            if isinstance(host_data, ServerConnectionData):
+                reg_msg = ServerRegistrationMessage.bytes(host_data.id, server.id, host_data.server_name, 
+                                                          host_data.server_info)
+                server.queue_message(new_server_connection, reg_msg)
+            elif isinstance(host_data, ClientConnectionData):
+                reg_msg = ClientRegistrationMessage.bytes(host_data.id, server.id, host_data.client_name, 
+                                                          host_data.client_info)
+                server.queue_message(new_server_connection, reg_msg)
+
+
+def cached_sync(server, new_server_connection):
+    server.queue_messages((new_server_connection,), (
+        host_data.registration for host_data in server.hosts_db.values() if host_data is not new_server_connection))
+
+
+def receive(server, connection, data):
+    io_device = selectors.SelectorKey(None, 0, selectors.EVENT_READ, connection)
+    server.handle_messages(connection.io_device or io_device, data)
+    while server.ready_connections:
+        server.dispatch_ready_connections()
+
+
+def populated_server(host_count):
+    options = Values({'id': 1, 'servername': 'theshire', 'info': 'Home of the Hobbits', 'port': 47150,
+                      'connect_to_host': None, 'connect_to_port': None, 'log_file': None})
+    server = CRCServer(options, run_on_localhost=True)
+    neighbour = BaseConnectionData()
+    receive(server, neighbour, ServerRegistrationMessage.bytes(2, 0, 'rivendell', 'Home of the Elves'))
+    neighbour = server.hosts_db[2]
+    roster = b''.join(ClientRegistrationMessage.bytes(host_id, 2, 'client%i' % host_id, 'Benchmark client')
+                      for host_id in range(1000, 1000 + host_count))
+    with memoryview(roster) as view:
+        for offset in range(0, len(roster), 1 << 20):
+            receive(server, neighbour, view[offset:offset + (1 << 20)])
+    return server
+
+
+def time_sync(server, sync):
+    connection = ServerConnectionData(3, 'greyhavens', 'Where the Elves sail from')
+    connection.write_queue = BaseConnectionData().write_queue
+    start = time.perf_counter()
+    sync(server, connection)
+    elapsed = time.perf_counter() - start
+    return elapsed, connection.pending_bytes, len(connection.write_queue)
+
+
+def time_join(server):
+    start = time.perf_counter()
+    receive(server, BaseConnectionData(), ServerRegistrationMessage.bytes(3, 0, 'greyhavens', 
+                                                                         'Where the Elves sail from'))
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC full-state sync benchmark")
+    op.add_option("--hosts", type="int", default=100000)
+    options, args = op.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = populated_server(options.hosts)
+    for name, sync in (('encoded per host', legacy_sync), ('cached, joined', cached_sync)):
+        elapsed, size, chunks = time_sync(server, sync)
+        print("%-18s %i hosts: %8.2fms, %i bytes in %i chunks" % (name, options.hosts, 1000 * elapsed, size, chunks))
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed = time_join(server)
+    print("new adjacent server registered and synced in %.2fms" % (1000 * elapsed))
+    server.wakeup.close()
+    server.sel.close()
@@ -0,0 +1,108 @@
+# Measures how much memory a server needs per host in hosts_db. Every server keeps a ServerConnectionData or
+# ClientConnectionData for every host in the network, so on a large network the replicated roster is where a
+# server's memory goes. The hosts are created the way handle_client_registration_message creates them for
+# non-adjacent clients (from a parsed registration message) and the memory they retain is measured with
+# tracemalloc. The dict backed classes the server used before its connection data was slotted are kept below
+# as the baseline. Message objects are measured the same way.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.host_memory --hosts 100000
+#   python -m Benchmarks.host_memory --hosts 1000000
+import gc, time, tracemalloc
+from collections import deque
+from optparse import OptionParser
+from ChatMessageParser import *
+from ChatServer import ClientConnectionData
+
+
+class LegacyBaseConnectionData():
+    def __init__(self):
+        self.write_queue = deque()
+        self.pending_bytes = 0
+        self.decoder = MessageFrameDecoder()
+        self.sock = None
+        self.write_interest = False
+        self.flush_scheduled = False
+        self.sent_registration = False
+        self.inbox = deque()
+        self.inbox_bytes = 0
+        self.io_device = None
+        self.dispatch_scheduled = False
+        self.read_throttled = False
+        self.congested = False
+        self.congestion_timer = None
+        self.slow_consumer = False
+        self.drop_chat = False
+        self.spill = None
+        self.paused_upstreams = []
+        self.paused_by = 0
+        self.reading_paused = False
+        self.dropped_messages = 0
+        self.spilled_bytes = 0
+
+class LegacyClientConnectionData(LegacyBaseConnectionData):
+    def __init__(self, id, client_name, client_info):
+        super(LegacyClientConnectionData, self).__init__()
+        self.id = id
+        self.client_name = client_name
+        self.client_info = client_info
+        self.first_link_id = None
+
+class LegacyClientChatMessage():
+    def __init__(self, bytes):
+        self.message_type = 0x81
+        self.source_id, self.destination_id, self.content_length = unpack_from("!III", bytes, 1)
+        self.variable_message_length = 13 + self.content_length
+        self.bytes = bytes
+
+
+def measure(build, count):
+    """ Returns the number of bytes retained by the result of build(count) and the time it took """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(count)
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return retained, elapsed
+
+
+def roster_builder(host_class):
+    def build(count):
+        hosts_db = {}
+        for host_id in range(1000, 1000 + count):
+            message = ClientRegistrationMessage(ClientRegistrationMessage.bytes(host_id, 2, 'client%i' % host_id,
+                                                                                'Benchmark client'))
+            host = host_class(message.source_id, message.client_name, message.client_info)
+            host.first_link_id = message.last_hop_id
+            hosts_db[message.source_id] = host
+        return hosts_db
+    return build
+
+
+def message_builder(message_class):
+    def build(count):
+        frame = ClientChatMessage.bytes(101, 102, 'x' * 32)
+        return [message_class(frame) for _ in range(count)]
+    return build
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC per-host memory benchmark")
+    op.add_option("--hosts", type="int", default=100000)
+    options, args = op.parse_args()
+
+    results = []
+    for name, build in (('hosts_db, dict backed', roster_builder(LegacyClientConnectionData)),
+                        ('hosts_db, slotted', roster_builder(ClientConnectionData)),
+                        ('ClientChatMessage, dict backed', message_builder(LegacyClientChatMessage)),
+                        ('ClientChatMessage, slotted', message_builder(ClientChatMessage))):
+        retained, elapsed = measure(build, options.hosts)
+        results.append(retained)
+        print("%-32s %i objects: %7.1f MiB (%5i bytes each), built in %.2fs" % (
+            name, options.hosts, retained / 2**20, retained / options.hosts, elapsed))
+    print("hosts_db is %.1fx smaller, messages are %.1fx smaller" % (results[0] / results[1],
+                                                                     results[2] / results[3]))
@@ -0,0 +1,79 @@
+# Measures what batch messages save on a server link. A server in the middle of a chain receives chat messages
+# from one adjacent server and forwards them to another, without any sockets: the received bytes are handed 
+# to handle_messages() in reads of RECV_BUFFER_SIZE bytes, dispatched, and the output queued for the next hop 
+# is prepared for sending the way flush_connection() does. The upstream either sends every message in its own
+# frame or packs them into batches, and the server either batches its own output or not.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.link_batching --messages 200000 --content-size 32
+import contextlib, io, selectors, time
+from optparse import OptionParser, Values
+from ChatMessageParser import *
+from ChatServer import CRCServer, BaseConnectionData, RECV_BUFFER_SIZE, MAX_BATCH_BYTES
+
+
+def transit_server(batch_output):
+    options = Values({'id': 1, 'servername': 'transit', 'info': 'Transit server', 'port': 47110,
+                      'connect_to_host': None, 'connect_to_port': None, 'log_file': None,
+                      'batch_server_links': batch_output})
+    server = CRCServer(options, run_on_localhost=True)
+    upstream, downstream = BaseConnectionData(), BaseConnectionData()
+    receive(server, upstream, ServerRegistrationMessage.bytes(2, 0, 'upstream', 'Upstream server') +
+            ClientRegistrationMessage.bytes(101, 2, 'sender', 'Benchmark client'))
+    receive(server, downstream, ServerRegistrationMessage.bytes(3, 0, 'downstream', 'Downstream server') +
+            ClientRegistrationMessage.bytes(102, 3, 'receiver', 'Benchmark client'))
+    receive(server, server.hosts_db[3], CapabilityAnnouncement.bytes(3, {'batch': ()}))
+    for host_id in (2, 3):
+        server.hosts_db[host_id].write_queue.clear()
+    return server, server.hosts_db[2], server.hosts_db[3]
+
+
+def receive(server, connection, data):
+    io_device = selectors.SelectorKey(None, 0, selectors.EVENT_READ, connection)
+    server.handle_messages(connection.io_device or io_device, data)
+    while server.ready_connections:
+        server.dispatch_ready_connections()
+
+
+def upstream_stream(message_count, content_size, batched):
+    message = ClientChatMessage.bytes(101, 102, 'x' * content_size)
+    if not batched:
+        return message * message_count
+    per_batch = MAX_BATCH_BYTES // len(message)
+    batches = [BatchMessage.bytes(2, [message] * min(per_batch, message_count - start))
+               for start in range(0, message_count, per_batch)]
+    return b''.join(batches)
+
+
+def run(message_count, content_size, batched_input, batch_output):
+    server, upstream, downstream = transit_server(batch_output)
+    stream = upstream_stream(message_count, content_size, batched_input)
+    sent_bytes = 0
+    start = time.perf_counter()
+    with memoryview(stream) as view:
+        for offset in range(0, len(stream), RECV_BUFFER_SIZE):
+            receive(server, upstream, view[offset:offset+RECV_BUFFER_SIZE])
+            server.batch_output(downstream, 0)
+            sent_bytes += downstream.pending_bytes
+            downstream.write_queue.clear()
+            downstream.pending_bytes = 0
+    elapsed = time.perf_counter() - start
+    server.wakeup.close()
+    server.sel.close()
+    return elapsed, len(stream), sent_bytes
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC server link batching benchmark")
+    op.add_option("--messages", type="int", default=200000)
+    op.add_option("--content-size", type="int", default=32)
+    options, args = op.parse_args()
+
+    print("%-10s %-10s %12s %14s %14s" % ("received", "sent", "msg/s", "bytes in/msg", "bytes out/msg"))
+    for batched_input, batch_output in ((False, False), (True, False), (False, True), (True, True)):
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, received_bytes, sent_bytes = run(options.messages, options.content_size, batched_input,
+                                                      batch_output)
+        print("%-10s %-10s %12.0f %14.1f %14.1f" % (
+            "batched" if batched_input else "frames", "batched" if batch_output else "frames",
+            options.messages / elapsed, received_bytes / options.messages, sent_bytes / options.messages))
@@ -0,0 +1,68 @@
+# Measures what link compression costs and saves per message. Messages are compressed the way a compressing
+# server link does it, in flushes of --per-flush messages through one LinkCompressor, and decompressed again
+# through one LinkDecompressor. Reported are the bytes sent per message and the CPU time spent compressing and 
+# decompressing per message, for chat messages of various content sizes (made of random words, so they repeat
+# no more than real chat does) and for the client registrations of a full state sync.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.link_compression --messages 20000 --per-flush 64
+import random, time
+from optparse import OptionParser
+from ChatMessageParser import *
+
+WORDS = ('the', 'ring', 'of', 'power', 'shire', 'hobbit', 'road', 'goes', 'ever', 'on', 'and', 'to', 'mordor', 
+         'we', 'must', 'go', 'a', 'wizard', 'is', 'never', 'late', 'second', 'breakfast', 'elves', 'mountain', 
+         'river', 'took', 'baggins', 'gandalf', 'friend', 'home', 'dark', 'fire', 'tree', 'stone', 'fellowship')
+
+
+def chat_messages(count, content_size):
+    rng = random.Random(content_size)
+    messages = []
+    for index in range(count):
+        content = ''
+        while len(content) < content_size:
+            content += rng.choice(WORDS) + ' '
+        messages.append(ClientChatMessage.bytes(1000 + index % 50, 2000 + index % 50, content[:content_size]))
+    return messages
+
+
+def roster_messages(count):
+    return [ClientRegistrationMessage.bytes(1000 + index, 1, 'client%i' % index, 'Client of server %i' % (index % 8))
+            for index in range(count)]
+
+
+def measure(codec, messages, per_flush):
+    """ Returns the bytes sent, and the seconds spent compressing and decompressing """
+    flushes = [messages[start:start+per_flush] for start in range(0, len(messages), per_flush)]
+    if codec is None:
+        return sum(len(message) for message in messages), 0.0, 0.0
+
+    compressor = LinkCompressor(1, codec)
+    decompressor = LinkDecompressor(codec, sum(len(message) for message in messages))
+    start = time.process_time()
+    frames = [compressor.compress(flush) for flush in flushes]
+    compressed = time.process_time()
+    for frame in frames:
+        decompressor.decompress(codec, memoryview(frame)[10:])
+    decompressed = time.process_time()
+    return sum(len(frame) for frame in frames), compressed - start, decompressed - compressed
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC link compression benchmark")
+    op.add_option("--messages", type="int", default=20000)
+    op.add_option("--per-flush", type="int", default=64, help="Messages compressed into one frame")
+    options, args = op.parse_args()
+
+    workloads = [('chat %i B' % size, chat_messages(options.messages, size)) for size in (16, 64, 256, 1024, 4096)]
+    workloads.append(('roster sync', roster_messages(options.messages)))
+
+    print("%-14s %-6s %12s %8s %16s %18s" % ("messages", "codec", "bytes/msg", "ratio", "compress us/msg", 
+                                             "decompress us/msg"))
+    for name, messages in workloads:
+        raw = sum(len(message) for message in messages)
+        for codec_name, codec in (('none', None), ('zlib', 0x01), ('lzma', 0x02)):
+            sent, compress_time, decompress_time = measure(codec, messages, options.per_flush)
+            print("%-14s %-6s %12.1f %7.2fx %16.2f %18.2f" % (
+                name, codec_name, sent / len(messages), raw / sent, 1e6 * compress_time / len(messages), 
+                1e6 * decompress_time / len(messages)))
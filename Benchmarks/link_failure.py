@@ -0,0 +1,78 @@
+# Measures how long it takes a server to recover from losing the link to an adjacent server with a large 
+# subtree behind it. The server learns a roster of remote clients through two neighbouring servers, then the 
+# link to one of them fails and every host reached through it is removed and reported as quit to the other. No
+# sockets are used: the registrations are handed to handle_messages() directly and the quits are left in the
+# remaining neighbour's write queue. A recovery that scans hosts_db for the hosts behind the link and handles 
+# their quits one by one is kept below as the baseline.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.link_failure --hosts 50000
+import contextlib, io, selectors, time
+from optparse import OptionParser, Values
+from ChatMessageParser import *
+from ChatServer import CRCServer, BaseConnectionData, ClientConnectionData
+
+
+def legacy_prune(server, connection):
+    lost = [host_id for host_id, host_data in server.hosts_db.items() 
+            if host_data is connection or host_data.first_link_id == connection.id]
+    for host_id in lost:
+        host_data = server.hosts_db.pop(host_id)
+        if isinstance(host_data, ClientConnectionData):
+            quit = ClientQuitMessage.bytes(host_id, "Connection lost")
+            for adjacent_id in list(server.adjacent_server_ids) + list(server.adjacent_user_ids):
+                if adjacent_id in server.hosts_db:
+                    server.queue_message(server.hosts_db[adjacent_id], quit)
+    server.adjacent_server_ids.discard(connection.id)
+
+
+def prune(server, connection):
+    server.prune_link(connection)
+
+
+def receive(server, connection, data):
+    io_device = selectors.SelectorKey(None, 0, selectors.EVENT_READ, connection)
+    server.handle_messages(connection.io_device or io_device, data)
+    while server.ready_connections:
+        server.dispatch_ready_connections()
+
+
+def populated_server(host_count):
+    options = Values({'id': 1, 'servername': 'theshire', 'info': 'Home of the Hobbits', 'port': 47190,
+                      'connect_to_host': None, 'connect_to_port': None, 'log_file': None})
+    server = CRCServer(options, run_on_localhost=True)
+    for server_id, first_host_id in ((2, 1000), (3, 1000 + host_count)):
+        receive(server, BaseConnectionData(), ServerRegistrationMessage.bytes(server_id, 0, 'server%i' % server_id,
+                                                                               'Benchmark server'))
+        roster = b''.join(ClientRegistrationMessage.bytes(host_id, server_id, 'client%i' % host_id, 
+                                                          'Benchmark client')
+                          for host_id in range(first_host_id, first_host_id + host_count))
+        with memoryview(roster) as view:
+            for offset in range(0, len(roster), 1 << 20):
+                receive(server, server.hosts_db[server_id], view[offset:offset + (1 << 20)])
+    return server
+
+
+def time_prune(host_count, prune):
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = populated_server(host_count)
+        lost, remaining = server.hosts_db[2], server.hosts_db[3]
+        remaining.write_queue.clear()
+        remaining.pending_bytes = 0
+        start = time.perf_counter()
+        prune(server, lost)
+        elapsed = time.perf_counter() - start
+    server.wakeup.close()
+    server.sel.close()
+    return elapsed, len(server.hosts_db), remaining.pending_bytes, len(remaining.write_queue)
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC link failure recovery benchmark")
+    op.add_option("--hosts", type="int", default=50000)
+    options, args = op.parse_args()
+
+    for name, prune_function in (('scan, quit per host', legacy_prune), ('subtree, joined', prune)):
+        elapsed, known, size, chunks = time_prune(options.hosts, prune_function)
+        print("%-20s %i hosts lost: %8.2fms, %i hosts left, %i bytes of quits in %i chunks" % (
+            name, options.hosts, 1000 * elapsed, known, size, chunks))
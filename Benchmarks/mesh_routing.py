@@ -0,0 +1,123 @@
+# Measures the paths chat messages take through a tree of servers and through a mesh of the same servers. The
+# tree is a chain (the longest path the test topologies have, end to end), and the mesh adds a link between
+# every server and the server --skip places further along, wrapping around. Every server computes its routes
+# from the link states of all servers (see CRCServer.compute_mesh_routes) and the hops from every server to
+# every other are counted by following them. The number of copies of one broadcast the servers send each
+# other is the price of the redundant links; it is counted as well. Finally, with --hosts clients spread over
+# the servers, the time one server takes to compute all of its routes is compared with the time it takes to
+# update them after one of its links goes down, which only moves the hosts whose first hop changed. No sockets
+# are used.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.mesh_routing --servers 11 --skip 3 --hosts 100000
+import contextlib, io, time
+from collections import deque
+from optparse import OptionParser, Values
+from ChatServer import CRCServer, ServerConnectionData, ClientConnectionData
+
+
+def chain(count):
+    return {server_id: {neighbour for neighbour in (server_id - 1, server_id + 1) if 1 <= neighbour <= count}
+            for server_id in range(1, count + 1)}
+
+
+def mesh(count, skip):
+    graph = chain(count)
+    for server_id in range(1, count + 1):
+        neighbour = (server_id + skip - 1) % count + 1
+        if neighbour != server_id:
+            graph[server_id].add(neighbour)
+            graph[neighbour].add(server_id)
+    return graph
+
+
+def routed_servers(graph):
+    servers = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for server_id, neighbours in graph.items():
+            options = Values({'id': server_id, 'servername': 'server%i' % server_id, 'info': 'Benchmark server',
+                              'port': 0, 'connect_to_host': None, 'connect_to_port': None, 'log_file': None,
+                              'mesh': True})
+            server = CRCServer(options, run_on_localhost=True)
+            for neighbour in neighbours:
+                server.routes.add_link(neighbour, ServerConnectionData(neighbour, 'server', ''))
+            server.link_states = {node: (1, frozenset(edges)) for node, edges in graph.items()}
+            server.compute_mesh_routes()
+            servers[server_id] = server
+    return servers
+
+
+def hop_counts(servers):
+    hops = []
+    for source in servers:
+        for destination in servers:
+            count, current = 0, source
+            while current != destination:
+                current = servers[current].mesh_next_hops[destination]
+                count += 1
+            if source != destination:
+                hops.append(count)
+    return hops
+
+
+def flood_copies(graph):
+    """ The copies of a broadcast sent between servers, averaged over the origins: the origin sends one to
+    each neighbour and every other server forwards the first copy it gets to each neighbour but the one it came
+    from and the origin """
+    copies = 0
+    for origin in graph:
+        arrivals = {origin: None}
+        queue = deque([origin])
+        while queue:
+            node = queue.popleft()
+            forwarded_to = graph[node] - {arrivals[node], origin}
+            copies += len(forwarded_to)
+            for neighbour in forwarded_to:
+                if neighbour not in arrivals:
+                    arrivals[neighbour] = node
+                    queue.append(neighbour)
+    return copies / len(graph)
+
+
+def recompute_times(server, graph, host_count):
+    for host_id in range(1000, 1000 + host_count):
+        host = ClientConnectionData(host_id, 'client%i' % host_id, 'Benchmark client')
+        host.home_id = host_id % len(graph) + 1
+        host.first_link_id = 0
+        server.hosts_db[host_id] = host
+        server.mesh_homes.setdefault(host.home_id, set()).add(host_id)
+    server.mesh_next_hops = {}
+    server.mesh_counters.clear()
+    start = time.perf_counter()
+    server.compute_mesh_routes()
+    full = time.perf_counter() - start, server.mesh_counters['route_updates']
+
+    # One of its links goes down
+    neighbour = max(graph[server.id])
+    server.link_states[server.id] = (2, frozenset(graph[server.id] - {neighbour}))
+    server.link_states[neighbour] = (2, frozenset(graph[neighbour] - {server.id}))
+    server.mesh_counters.clear()
+    start = time.perf_counter()
+    server.compute_mesh_routes()
+    return full, (time.perf_counter() - start, server.mesh_counters['route_updates'])
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC mesh routing benchmark")
+    op.add_option("--servers", type="int", default=11)
+    op.add_option("--skip", type="int", default=3)
+    op.add_option("--hosts", type="int", default=100000)
+    options, args = op.parse_args()
+
+    for name, graph in (('tree', chain(options.servers)), ('mesh', mesh(options.servers, options.skip))):
+        servers = routed_servers(graph)
+        hops = hop_counts(servers)
+        links = sum(len(neighbours) for neighbours in graph.values()) // 2
+        print("%s: %i links, %.2f hops on average, %i at most, %.1f copies per broadcast" % (
+            name, links, sum(hops) / len(hops), max(hops), flood_copies(graph)))
+        for server in servers.values():
+            server.wakeup.close()
+            server.sel.close()
+    for name, (elapsed, moved) in zip(('computing all routes', 'after a link went down'),
+                                      recompute_times(servers[1], graph, options.hosts)):
+        print("%-22s %8.2fms, %7i routes updated" % (name, 1000 * elapsed, moved))
@@ -0,0 +1,108 @@
+# Measures how many messages per second the message classes parse, for each of the six message types. The
+# original constructors (which built a format string per message, unpacked the strings with it and always
+# decoded them) are kept below as the baseline. Two access patterns are timed: "forward" only reads the header
+# fields and message.bytes, like the server does for chat and status messages it relays, and "decode" also
+# reads every string field.
+#
+# Run from the repository root with: python -m Benchmarks.message_parsing
+import time
+from struct import unpack
+from optparse import OptionParser
+from ChatMessageParser import *
+
+
+class LegacyServerRegistrationMessage():
+    strings = ('server_name', 'server_info')
+    def __init__(self, bytes):
+        msg = unpack("!xIIBH", bytes[:12])
+        self.source_id, self.last_hop_id, self.server_name_length, self.server_info_length = msg
+        self.server_name = unpack("!{0}s".format(self.server_name_length), bytes[12:12+self.server_name_length])[0].decode()
+        self.server_info = unpack("!{0}s".format(self.server_info_length), bytes[12+self.server_name_length:12+self.server_name_length+self.server_info_length])[0].decode()
+        self.variable_message_length = 12 + self.server_name_length + self.server_info_length
+        self.bytes = bytes[:self.variable_message_length]
+
+class LegacyClientRegistrationMessage():
+    strings = ('client_name', 'client_info')
+    def __init__(self, bytes):
+        msg = unpack("!xIIBH", bytes[:12])
+        self.source_id, self.last_hop_id, self.client_name_length, self.client_info_length = msg
+        self.client_name = unpack("!{0}s".format(self.client_name_length), bytes[12:12+self.client_name_length])[0].decode()
+        self.client_info = unpack("!{0}s".format(self.client_info_length), bytes[12+self.client_name_length:12+self.client_name_length+self.client_info_length])[0].decode()
+        self.variable_message_length = 12 + self.client_name_length + self.client_info_length
+        self.bytes = bytes[:self.variable_message_length]
+
+class LegacyStatusUpdateMessage():
+    strings = ('content',)
+    def __init__(self, bytes):
+        msg = unpack("!xIIHI", bytes[:15])
+        self.source_id, self.destination_id, self.status_code, self.content_length = msg
+        self.content = unpack("!{0}s".format(self.content_length), bytes[15:15+self.content_length])[0].decode()
+        self.variable_message_length = 15 + self.content_length
+        self.bytes = bytes[:self.variable_message_length]
+
+class LegacyClientChatMessage():
+    strings = ('content',)
+    def __init__(self, bytes):
+        msg = unpack("!xIII", bytes[:13])
+        self.source_id, self.destination_id, self.content_length = msg
+        self.content = unpack("!{0}s".format(self.content_length), bytes[13:13+self.content_length])[0].decode()
+        self.variable_message_length = 13 + self.content_length
+        self.bytes = bytes[:self.variable_message_length]
+
+class LegacyServerQuitMessage():
+    strings = ('content',)
+    def __init__(self, bytes):
+        msg = unpack("!xIII", bytes[:13])
+        self.source_id, self.replacement_id, self.content_length = msg
+        self.content = unpack("!{0}s".format(self.content_length), bytes[13:13+self.content_length])[0].decode()
+        self.variable_message_length = 13 + self.content_length
+        self.bytes = bytes[:self.variable_message_length]
+
+class LegacyClientQuitMessage():
+    strings = ('content',)
+    def __init__(self, bytes):
+        msg = unpack("!xII", bytes[:9])
+        self.source_id, self.content_length = msg
+        self.content = unpack("!{0}s".format(self.content_length), bytes[9:9+self.content_length])[0].decode()
+        self.variable_message_length = 9 + self.content_length
+        self.bytes = bytes[:self.variable_message_length]
+
+
+def sample_messages(content_size):
+    content = 'x' * content_size
+    return [
+        ('ServerRegistration', ServerRegistrationMessage, LegacyServerRegistrationMessage,
+         ServerRegistrationMessage.bytes(1, 0, 'theshire', 'Home of the Hobbits')),
+        ('ClientRegistration', ClientRegistrationMessage, LegacyClientRegistrationMessage,
+         ClientRegistrationMessage.bytes(101, 1, 'frodobaggins', 'Ring bearer')),
+        ('StatusUpdate', StatusUpdateMessage, LegacyStatusUpdateMessage,
+         StatusUpdateMessage.bytes(1, 101, 0x00, content)),
+        ('ClientChat', ClientChatMessage, LegacyClientChatMessage, ClientChatMessage.bytes(101, 102, content)),
+        ('ServerQuit', ServerQuitMessage, LegacyServerQuitMessage, ServerQuitMessage.bytes(2, 3, content)),
+        ('ClientQuit', ClientQuitMessage, LegacyClientQuitMessage, ClientQuitMessage.bytes(101, content)),
+    ]
+
+
+def parse_rate(message_class, strings, frame, iterations):
+    """ Returns the number of messages per second message_class parses, reading the given string fields """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        message = message_class(frame)
+        message.source_id, message.bytes
+        for name in strings:
+            getattr(message, name)
+    return iterations / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC message parsing micro-benchmark")
+    op.add_option("--iterations", type="int", default=200000)
+    op.add_option("--content-size", type="int", default=64)
+    options, args = op.parse_args()
+
+    print("%-20s %-8s %14s %14s %8s" % ("message", "access", "before msg/s", "after msg/s", "speedup"))
+    for name, message_class, legacy_class, frame in sample_messages(options.content_size):
+        for access, strings in (('forward', ()), ('decode', legacy_class.strings)):
+            before = parse_rate(legacy_class, strings, frame, options.iterations)
+            after = parse_rate(message_class, strings, frame, options.iterations)
+            print("%-20s %-8s %14.0f %14.0f %7.2fx" % (name, access, before, after, after / before))
@@ -0,0 +1,102 @@
+# Measures what a reconnect storm costs a server with and without a presence window. The Shire has --servers
+# adjacent servers, which accept batch messages, and --clients adjacent clients. --joins clients that were
+# behind a restarted server register again through the first adjacent server, --per-tick of them per iteration
+# of the event loop, and --churn of them quit again in the next iteration (e.g. clients that gave up). Without
+# a presence window every registration and quit is broadcast as it is handled, and the flush phase of every
+# iteration packs what each adjacent server was sent during it into batch messages. With a window of
+# --window-ticks iterations they are collected and sent when it closes, and joins and quits within the window
+# cancel each other. The frames written to the adjacent servers and the messages written to the adjacent clients
+# are counted. No sockets are used.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.presence_storm --joins 20000 --clients 200
+import contextlib, io, selectors, time
+from optparse import OptionParser, Values
+from ChatMessageParser import *
+from ChatServer import CRCServer, BaseConnectionData
+
+
+def receive(server, connection, data):
+    io_device = connection.io_device or selectors.SelectorKey(None, 0, selectors.EVENT_READ, connection)
+    server.handle_messages(io_device, data)
+    while server.ready_connections:
+        server.dispatch_ready_connections()
+
+
+def register(server, registration):
+    receive(server, BaseConnectionData(), registration)
+    return server.hosts_db[MessageParser.parse_message(registration).source_id]
+
+
+def flush_phase(server, connections):
+    """ Packs and takes the output of an iteration, and returns the frames and messages in it """
+    frames = messages = 0
+    for connection in connections:
+        server.batch_output(connection, 0)
+        data = b''.join(connection.write_queue)
+        connection.write_queue.clear()
+        connection.pending_bytes = 0
+        top_level, _ = MessageParser.index_frames(data)
+        frames += len(top_level)
+        messages += sum(frame[0] == 0x03 and len(MessageParser.index_batch(data, frame[3])) or 1
+                        for frame in top_level)
+    return frames, messages
+
+
+def storm(options, window_ticks):
+    server_options = Values({'id': 1, 'servername': 'theshire', 'info': 'Benchmark server', 'port': 0,
+                             'connect_to_host': None, 'connect_to_port': None, 'log_file': None,
+                             'presence_window': window_ticks and 1.0})
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = CRCServer(server_options, run_on_localhost=True)
+        servers = [register(server, ServerRegistrationMessage.bytes(server_id, 0, 'server%i' % server_id, 'Peer'))
+                   for server_id in range(2, 2 + options.servers)]
+        for connection in servers:
+            connection.capabilities = {'batch': ()}
+        clients = [register(server, ClientRegistrationMessage.bytes(client_id, 0, 'client%i' % client_id, 'Local'))
+                   for client_id in range(1000, 1000 + options.clients)]
+        server.flush_presence()
+        flush_phase(server, servers + clients)
+        server.presence_counters.clear()
+
+        link = servers[0]
+        joining = list(range(100000, 100000 + options.joins))
+        quitting = set(joining[::int(1 / options.churn)] if options.churn else ())
+        server_frames = client_messages = ticks = 0
+        start = time.perf_counter()
+        previous = []
+        while joining or previous:
+            batch, joining = joining[:options.per_tick], joining[options.per_tick:]
+            data = [ClientQuitMessage.bytes(client_id, 'Gave up') for client_id in previous
+                    if client_id in quitting]
+            data += [ClientRegistrationMessage.bytes(client_id, link.id, 'client%i' % client_id, 'Rejoining')
+                     for client_id in batch]
+            receive(server, link, b''.join(data))
+            previous = batch
+            ticks += 1
+            if window_ticks and (ticks % window_ticks == 0 or not (joining or previous)):
+                server.flush_presence()
+            frames, _ = flush_phase(server, servers)
+            server_frames += frames
+            client_messages += flush_phase(server, clients)[1]
+        elapsed = time.perf_counter() - start
+    server.wakeup.close()
+    server.sel.close()
+    return elapsed, server_frames, client_messages, server.presence_counters
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC presence coalescing benchmark")
+    op.add_option("--servers", type="int", default=4)
+    op.add_option("--clients", type="int", default=200)
+    op.add_option("--joins", type="int", default=20000)
+    op.add_option("--per-tick", type="int", default=50)
+    op.add_option("--churn", type="float", default=0.1)
+    op.add_option("--window-ticks", type="int", default=20)
+    options, args = op.parse_args()
+
+    for name, window_ticks in (('no window', 0), ('%i tick window' % options.window_ticks, options.window_ticks)):
+        elapsed, server_frames, client_messages, counters = storm(options, window_ticks)
+        print("%-16s %9.2fms, %7i frames to servers, %9i messages to clients, %i messages cancelled, "
+              "%i frames saved" % (name, 1000 * elapsed, server_frames, client_messages, counters['cancelled'],
+                                   counters['frames_saved']))
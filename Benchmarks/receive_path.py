@@ -0,0 +1,135 @@
+# Measures how much memory the receive path allocates while reading and reassembling 10,000 chat messages 
+# from a socket, comparing the original approach (recv() a new bytes object per read and re-slice the 
+# remaining data after every parsed message) with the pooled approach (recv_into() a reusable buffer and walk
+# offsets over a memoryview with a MessageFrameDecoder).
+#
+# Constructing the message objects costs the same in both approaches, so it is replaced by a stub while 
+# allocations are counted. Allocations are sampled with tracemalloc at every read and every parsed message.
+#
+# Run from the repository root with: python -m Benchmarks.receive_path
+import socket, threading, tracemalloc, time
+from ChatMessageParser import *
+
+MESSAGE_COUNT = 10000
+RECV_SIZE = 65536
+
+
+def legacy_receive(sock, payload_size):
+    # Reads data and parses it the way the server originally did, keeping an incomplete trailing message 
+    # around as bytes so the comparison stays correct for reads that end mid message
+    pending = b''
+    received = 0
+    while received < payload_size:
+        data = sock.recv(RECV_SIZE)
+        received += len(data)
+        data = pending + data
+        while len(data) > 0:
+            length = MessageParser.frame_length(data)
+            if length is None or length > len(data):
+                break
+            msg = MessageParser.parse_message(data)
+            data = data[msg.variable_message_length:]
+        pending = data
+
+
+def pooled_receive(sock, payload_size):
+    pool = ReceiveBufferPool(RECV_SIZE)
+    decoder = MessageFrameDecoder()
+    received = 0
+    while received < payload_size:
+        buffer = pool.acquire()
+        count = sock.recv_into(buffer)
+        received += count
+        with memoryview(buffer) as view:
+            decoder.feed(view[:count])
+        pool.release(buffer)
+
+
+class AllocationCounter:
+    def __init__(self):
+        self.allocated = 0
+        self.last = 0
+
+    def start(self):
+        tracemalloc.start()
+        self.last = tracemalloc.get_traced_memory()[0]
+
+    # Adds the growth since the previous sample and starts a new sampling interval
+    def sample(self):
+        current, peak = tracemalloc.get_traced_memory()
+        self.allocated += max(0, peak - self.last)
+        tracemalloc.reset_peak()
+        self.last = current
+
+    def stop(self):
+        self.sample()
+        tracemalloc.stop()
+
+
+class StubMessage:
+    variable_message_length = 0
+
+
+class CountingSocket:
+    def __init__(self, sock, counter):
+        self.sock = sock
+        self.counter = counter
+
+    def recv(self, size):
+        self.counter.sample()
+        return self.sock.recv(size)
+
+    def recv_into(self, buffer):
+        self.counter.sample()
+        return self.sock.recv_into(buffer)
+
+
+def count_allocations(receive, payload):
+    reader, writer = socket.socketpair()
+    sender = threading.Thread(target=writer.sendall, args=(payload,))
+    sender.start()
+
+    counter = AllocationCounter()
+    stub = StubMessage()
+    def parse_message(bytes):
+        counter.sample()
+        stub.variable_message_length = MessageParser.frame_length(bytes)
+        return stub
+
+    original_parse_message = MessageParser.parse_message
+    MessageParser.parse_message = staticmethod(parse_message)
+    try:
+        counter.start()
+        receive(CountingSocket(reader, counter), len(payload))
+        counter.stop()
+    finally:
+        MessageParser.parse_message = original_parse_message
+
+    sender.join()
+    reader.close()
+    writer.close()
+    return counter.allocated
+
+
+def time_receive(receive, payload):
+    reader, writer = socket.socketpair()
+    sender = threading.Thread(target=writer.sendall, args=(payload,))
+    start = time.perf_counter()
+    sender.start()
+    receive(reader, len(payload))
+    elapsed = time.perf_counter() - start
+    sender.join()
+    reader.close()
+    writer.close()
+    return elapsed
+
+
+if __name__ == "__main__":
+    for content_size in [16, 256, 4096]:
+        payload = b''.join(ClientChatMessage.bytes(101, 102, "x" * content_size) for _ in range(MESSAGE_COUNT))
+        print("%i messages with %i byte content (%i bytes total)" % (MESSAGE_COUNT, content_size, len(payload)))
+        for name, receive in [("recv + re-slicing", legacy_receive), ("recv_into + decoder", pooled_receive)]:
+            allocated = count_allocations(receive, payload)
+            elapsed = time_receive(receive, payload)
+            print("  %-20s %12i bytes allocated by the receive path (%8.1f per message), %.3fs with parsing" % (
+                name, allocated, allocated / MESSAGE_COUNT, elapsed))
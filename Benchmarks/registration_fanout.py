@@ -0,0 +1,78 @@
+# Measures the write path of a single CRC server during a client registration storm. Every client receives a
+# welcome message and the registrations of all other clients, so n clients produce n * n messages. Clients
+# connect in bursts (all of a burst's registrations are sent in one go), and the server's write counters are
+# reported: how many send system calls and selector updates it needed per message.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.registration_fanout --clients 200 --burst 20
+import contextlib, io, selectors, socket, threading, time
+from optparse import OptionParser
+from ChatMessageParser import *
+from CRCTestManager import SERVER_ENGINES
+from Benchmarks.chat_throughput import launch_servers, BASE_PORT
+
+
+def drain_clients(sel, stop):
+    """ Reads and discards everything the server sends to the clients """
+    while not stop.is_set():
+        for key, mask in sel.select(timeout=0.05):
+            try:
+                key.fileobj.recv(65536)
+            except OSError:
+                pass
+
+
+def run(engine, client_count, burst, **extra):
+    servers = launch_servers(engine, 1, **extra)
+    server = servers[0][0]
+
+    sel = selectors.DefaultSelector()
+    stop = threading.Event()
+    reader = threading.Thread(target=drain_clients, args=(sel, stop))
+    reader.start()
+
+    clients = []
+    expected = client_count * client_count
+    start = time.perf_counter()
+    for first in range(0, client_count, burst):
+        batch = [socket.create_connection(('127.0.0.1', BASE_PORT)) for _ in range(min(burst, client_count - first))]
+        time.sleep(0.01)
+        for offset, sock in enumerate(batch):
+            client_id = 1000 + first + offset
+            sock.sendall(ClientRegistrationMessage.bytes(client_id, 0, 'client%i' % client_id, 'Benchmark client'))
+            sock.setblocking(False)
+            sel.register(sock, selectors.EVENT_READ)
+        clients += batch
+        time.sleep(0.01)
+
+    # Wait for the server to send every welcome and registration message
+    deadline = time.perf_counter() + 30
+    while server.write_counters['messages_sent'] < expected and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    reader.join()
+    for sock in clients:
+        sock.close()
+    server.request_terminate = True
+    servers[0][1].join()
+    return elapsed, server.write_counters
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC registration fan-out benchmark")
+    op.add_option("--engine", type="choice", choices=list(SERVER_ENGINES.keys()), default="selector")
+    op.add_option("--clients", type="int", default=200)
+    op.add_option("--burst", type="int", default=20, help="Number of clients that register at once")
+    options, args = op.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        elapsed, counters = run(SERVER_ENGINES[options.engine], options.clients, options.burst)
+
+    messages = counters['messages_sent']
+    print("%s engine, %i clients in bursts of %i: %i messages in %.3fs" % (
+        options.engine, options.clients, options.burst, messages, elapsed))
+    print("  %i send calls (%.1f messages per call), %i selector updates (%.3f per message)" % (
+        counters['send_calls'], messages / max(1, counters['send_calls']),
+        counters['selector_updates'], counters['selector_updates'] / max(1, messages)))
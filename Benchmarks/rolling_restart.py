@@ -0,0 +1,125 @@
+# Measures what it costs the network when a server in the middle of it is taken down for a restart. Rivendell
+# links the Shire to Gondor, and both the Shire and Gondor have a roster of adjacent clients. When Rivendell
+# leaves with the Shire as its replacement, Gondor reconnects to the Shire and only the routes to the hosts
+# behind the moved link are rewritten. Leaving without a replacement is kept below as the baseline: both 
+# sides remove everything behind Rivendell, tell their clients about it, and Gondor then joins the Shire like a
+# new server, which syncs the whole roster both ways and announces it to every client again. No sockets are 
+# used: the servers' write queues are handed to handle_messages() directly.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.rolling_restart --clients 2000
+import contextlib, io, selectors, time
+from optparse import OptionParser, Values
+from ChatMessageParser import *
+from ChatServer import CRCServer, BaseConnectionData
+
+
+class Network():
+    def __init__(self):
+        self.wires = []
+        self.messages = 0
+        self.bytes = 0
+
+    def receive(self, server, connection, data):
+        io_device = connection.io_device or selectors.SelectorKey(None, 0, selectors.EVENT_READ, connection)
+        server.handle_messages(io_device, data)
+        while server.ready_connections:
+            server.dispatch_ready_connections()
+
+    def current(self, connection):
+        return connection.io_device.data if connection.io_device else connection
+
+    def take(self, connection):
+        data = b''.join(self.current(connection).write_queue)
+        self.current(connection).write_queue.clear()
+        self.current(connection).pending_bytes = 0
+        return data
+
+    def pump(self):
+        moved = True
+        while moved:
+            moved = False
+            for wire in self.wires:
+                for source, destination, link in ((1, 2, 3), (3, 0, 1)):
+                    data = self.take(wire[source])
+                    if data:
+                        self.messages += len(MessageParser.index_frames(data)[0])
+                        self.bytes += len(data)
+                        self.receive(wire[destination], self.current(wire[link]), data)
+                        moved = True
+
+    def connect(self, server, peer, departed_id=None):
+        connection = BaseConnectionData()
+        self.wires.append([server, connection, peer, BaseConnectionData()])
+        if departed_id is None:
+            server.send_registration(connection, announce=server.announce_on_connect)
+        else:
+            server.start_handover(connection, departed_id)
+        self.pump()
+
+    def close_links(self, server):
+        for wire in [wire for wire in self.wires if server in (wire[0], wire[2])]:
+            self.wires.remove(wire)
+            for peer, connection in ((wire[0], wire[1]), (wire[2], wire[3])):
+                if peer is not server:
+                    peer.forget_connection(self.current(connection))
+
+
+def build(client_count):
+    network = Network()
+    servers = []
+    for server_id, name in ((1, 'theshire'), (2, 'rivendell'), (3, 'gondor')):
+        options = Values({'id': server_id, 'servername': name, 'info': 'Benchmark server', 'port': 47210 + server_id,
+                          'connect_to_host': None, 'connect_to_port': None, 'log_file': None,
+                          'announce_on_connect': True})
+        servers.append(CRCServer(options, run_on_localhost=True))
+    theshire, rivendell, gondor = servers
+    network.connect(rivendell, theshire)
+    network.connect(gondor, rivendell)
+    clients = []
+    for server, first_id in ((theshire, 1000), (gondor, 1000 + client_count)):
+        for client_id in range(first_id, first_id + client_count):
+            connection = BaseConnectionData()
+            network.receive(server, connection, ClientRegistrationMessage.bytes(client_id, 0, 'client%i' % client_id,
+                                                                                'Benchmark client'))
+            clients.append(network.current(connection))
+        network.pump()
+    for client in clients:
+        network.take(client)
+    return network, servers, clients
+
+
+def restart(client_count, handover):
+    with contextlib.redirect_stdout(io.StringIO()):
+        network, (theshire, rivendell, gondor), clients = build(client_count)
+        network.messages = network.bytes = 0
+        start = time.perf_counter()
+        if handover:
+            gondor.connect_to_replacement = lambda departed_id, address: network.connect(gondor, theshire, 
+                                                                                        departed_id)
+            rivendell.depart(1, ('127.0.0.1', theshire.port))
+            network.pump()
+            network.close_links(rivendell)
+        else:
+            rivendell.depart()
+            network.pump()
+            network.close_links(rivendell)
+            network.connect(gondor, theshire)
+        elapsed = time.perf_counter() - start
+        client_bytes = sum(len(network.take(client)) for client in clients)
+        known = len(theshire.hosts_db) + len(gondor.hosts_db)
+    for server in (theshire, rivendell, gondor):
+        server.wakeup.close()
+        server.sel.close()
+    return elapsed, network.messages, network.bytes, client_bytes, known
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC rolling restart benchmark")
+    op.add_option("--clients", type="int", default=2000, help="Clients on each side of the restarted server")
+    options, args = op.parse_args()
+
+    for name, handover in (('quit and rejoin', False), ('handover', True)):
+        elapsed, messages, size, client_bytes, known = restart(options.clients, handover)
+        print("%-16s %8.2fms, %5i messages (%8i bytes) between servers, %10i bytes to clients, %i routes" % (
+            name, 1000 * elapsed, messages, size, client_bytes, known))
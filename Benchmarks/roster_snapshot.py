@@ -0,0 +1,62 @@
+# Measures how long a new server takes to learn the roster of the network it joins, when the roster is sent 
+# as one registration message per host and when it is sent as roster snapshots. A server that knows a roster
+# of remote clients produces the sync for a new adjacent server in both forms, and a second server that has 
+# just linked up with it receives it. No sockets are used: the sync is handed to handle_messages() of the new
+# server in reads of RECV_BUFFER_SIZE bytes and dispatched.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.roster_snapshot --hosts 100000
+import contextlib, io, time
+from optparse import OptionParser, Values
+from ChatMessageParser import *
+from ChatServer import CRCServer, BaseConnectionData, ServerConnectionData, RECV_BUFFER_SIZE
+from Benchmarks.full_state_sync import populated_server, receive
+
+
+def encode_sync(server, snapshots):
+    connection = ServerConnectionData(3, 'greyhavens', 'Where the Elves sail from')
+    connection.write_queue = BaseConnectionData().write_queue
+    if snapshots:
+        connection.capabilities = {'snapshot': ()}
+    start = time.perf_counter()
+    server.send_full_state(connection, list(server.hosts_db.values()))
+    elapsed = time.perf_counter() - start
+    return b''.join(connection.write_queue), elapsed
+
+
+def joining_server():
+    options = Values({'id': 3, 'servername': 'greyhavens', 'info': 'Where the Elves sail from', 'port': 47151,
+                      'connect_to_host': None, 'connect_to_port': None, 'log_file': None})
+    server = CRCServer(options, run_on_localhost=True)
+    receive(server, BaseConnectionData(), ServerRegistrationMessage.bytes(1, 0, 'theshire', 'Home of the Hobbits'))
+    return server, server.hosts_db[1]
+
+
+def apply_sync(sync):
+    server, link = joining_server()
+    start = time.perf_counter()
+    with memoryview(sync) as view:
+        for offset in range(0, len(sync), RECV_BUFFER_SIZE):
+            receive(server, link, view[offset:offset+RECV_BUFFER_SIZE])
+    elapsed = time.perf_counter() - start
+    hosts = len(server.hosts_db)
+    server.wakeup.close()
+    server.sel.close()
+    return elapsed, hosts
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC roster snapshot benchmark")
+    op.add_option("--hosts", type="int", default=100000)
+    options, args = op.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = populated_server(options.hosts)
+    print("%-14s %10s %12s %12s %10s" % ("sync", "bytes", "encode ms", "apply ms", "hosts"))
+    for name, snapshots in (('registrations', False), ('snapshots', True)):
+        sync, encoded = encode_sync(server, snapshots)
+        with contextlib.redirect_stdout(io.StringIO()):
+            applied, hosts = apply_sync(sync)
+        print("%-14s %10i %12.2f %12.2f %10i" % (name, len(sync), 1000 * encoded, 1000 * applied, hosts))
+    server.wakeup.close()
+    server.sel.close()
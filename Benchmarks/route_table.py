@@ -0,0 +1,101 @@
+# Measures the routing table (see RouteTable) on its own. It is filled with --routes destinations spread over
+# --links adjacent hosts, both one route at a time, the way a server adds hosts as they register, and with one
+# call to rebuild(). Then it times lookups, moving every route of one link to another (a handover) and
+# removing every route of one link (a failed link). The way routes were resolved before the table (through the
+# first_link_id of the destination's connection data object in hosts_db, and a scan of hosts_db for the hosts
+# behind a link) is kept below as the baseline.
+#
+# Run from the repository root with e.g.:
+#   python -m Benchmarks.route_table --routes 1000000
+import random, time
+from optparse import OptionParser
+from RouteTable import RouteTable
+from ChatServer import ClientConnectionData, ServerConnectionData
+
+SERVER_ID = 1
+
+
+def legacy_lookup(hosts_db, adjacent_connections, destination_id):
+    host = hosts_db.get(destination_id)
+    if host is None:
+        return None
+    if host.first_link_id == SERVER_ID:
+        return adjacent_connections.get(destination_id)
+    return adjacent_connections.get(host.first_link_id)
+
+
+def legacy_move(hosts_db, old_link_id, new_link_id):
+    moved = [host for host in hosts_db.values() if host.first_link_id == old_link_id]
+    for host in moved:
+        host.first_link_id = new_link_id
+    return len(moved)
+
+
+def legacy_remove(hosts_db, link_id):
+    lost = [host_id for host_id, host in hosts_db.items() if host.first_link_id == link_id]
+    for host_id in lost:
+        del hosts_db[host_id]
+    return len(lost)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def fill(table, routes):
+    for destination_id, link_id in routes:
+        table.add(destination_id, link_id)
+
+
+def lookups(lookup, destination_ids):
+    for destination_id in destination_ids:
+        lookup(destination_id)
+
+
+if __name__ == "__main__":
+    op = OptionParser(description="CRC routing table benchmark")
+    op.add_option("--routes", type="int", default=1000000)
+    op.add_option("--links", type="int", default=8)
+    op.add_option("--lookups", type="int", default=1000000)
+    options, args = op.parse_args()
+
+    link_ids = list(range(2, 2 + options.links))
+    routes = [(destination_id, link_ids[destination_id % options.links])
+              for destination_id in range(1000, 1000 + options.routes)]
+    sample = [random.randrange(1000, 1000 + options.routes) for _ in range(options.lookups)]
+
+    hosts_db, adjacent_connections = {}, {}
+    for link_id in link_ids:
+        adjacent_connections[link_id] = hosts_db[link_id] = ServerConnectionData(link_id, 'server', '')
+        hosts_db[link_id].first_link_id = SERVER_ID
+    for destination_id, link_id in routes:
+        host = hosts_db[destination_id] = ClientConnectionData(destination_id, 'client', '')
+        host.first_link_id = link_id
+
+    table = RouteTable()
+    for link_id in link_ids:
+        table.add_link(link_id, adjacent_connections[link_id])
+    added, _ = timed(fill, table, routes)
+    rebuilt_table = RouteTable()
+    rebuilt, _ = timed(rebuilt_table.rebuild, routes)
+    print("%i routes over %i links: added one by one in %.0fms, rebuilt in %.0fms" % (
+        options.routes, options.links, 1000 * added, 1000 * rebuilt))
+
+    before, _ = timed(lookups, lambda destination_id: legacy_lookup(hosts_db, adjacent_connections,
+                                                                     destination_id), sample)
+    after, _ = timed(lookups, table.lookup, sample)
+    print("%-24s %10.0f/s before, %10.0f/s after" % ("lookups", options.lookups / before, options.lookups / after))
+
+    before, count = timed(legacy_move, hosts_db, link_ids[0], link_ids[1])
+    after, moved = timed(table.move_link, link_ids[0], link_ids[1])
+    assert len(moved) == count
+    print("%-24s %10.1fms before, %10.1fms after (%i routes)" % ("moving a link's routes", 1000 * before,
+                                                                 1000 * after, count))
+
+    before, count = timed(legacy_remove, hosts_db, link_ids[2])
+    after, removed = timed(table.pop_link_routes, link_ids[2])
+    assert len(removed) == count
+    print("%-24s %10.1fms before, %10.1fms after (%i routes)" % ("removing a link's routes", 1000 * before,
+                                                                 1000 * after, count))
@@ -2,6 +2,7 @@ import threading, os, re, time, sys, json, traceback
 from optparse import OptionParser
 from ChatClient import CRCClient
 from ChatServer import CRCServer
+from AsyncChatServer import AsyncCRCServer
 from ChatMessageParser import *
 from Testers.NetworkConnectivityTest import NetworkConnectivityTest
 from Testers.CRCFunctionalityTest import CRCFunctionalityTest
@@ -102,9 +103,21 @@ class CRCTestManager(object):
         return tester.run_test(test)
         
 
-if __name__ == "__main__":
+# The server engines that can be selected with --engine
+SERVER_ENGINES = {
+    'selector': CRCServer,
+    'asyncio': AsyncCRCServer,
+}
 
-    test_manager = CRCTestManager()
+if __name__ == "__main__":
+    op = OptionParser(description="CPSC 3600 CRC test manager")
+    op.add_option(
+        "--engine",
+        metavar="X", type="choice", choices=list(SERVER_ENGINES.keys()), default="selector",
+        help="The server engine to test: %s (default: selector)" % ", ".join(SERVER_ENGINES.keys()))
+    options, args = op.parse_args()
+
+    test_manager = CRCTestManager(SERVER_ENGINES[options.engine])
     basic_score = 0
     message_parsing_score = 0
     CRC_connection_score = 0
@@ -26,6 +26,15 @@ class CRCClient(object):
         self.status_updates_log = []
         self.chat_messages_log = []
 
+        # The optional protocol features this client announces to its server after registering (nothing is 
+        # announced if there are none) and the ones the server announced in reply (see CapabilityAnnouncement)
+        self.capabilities = getattr(options, 'capabilities', None) or {}
+        self.server_capabilities = {}
+
+        # Reassembles the bytes received from the server into complete messages
+        self.decoder = MessageFrameDecoder()
+        # Preallocated buffer the server socket is read into
+        self.recv_buffer = bytearray(65536)
 
         # This dictionary contains mappings from commands to command handlers.
         # Upon receiving a command X, the appropriate command handler can be called with: self.message_handlers[X](...args)
@@ -35,6 +44,7 @@ class CRCClient(object):
             0x80:self.handle_client_registration_message,
             0x81:self.handle_client_chat_message,
             0x82:self.handle_client_quit_message,
+            0x02:self.handle_server_quit_message,
         }
 
 
@@ -51,6 +61,8 @@ class CRCClient(object):
 
         # Send the registration message to the server
         self.send_message_to_server(ClientRegistrationMessage.bytes(self.id, 0, self.client_name, self.info))
+        if self.capabilities:
+            self.send_message_to_server(CapabilityAnnouncement.bytes(self.id, self.capabilities))
 
         self.start_listening_to_server()
         
@@ -69,17 +81,18 @@ class CRCClient(object):
 
 
     def listen_for_server_input(self):
+        view = memoryview(self.recv_buffer)
         while not self.request_terminate:
-            rcvd = self.sock.recv(2048)
+            rcvd = self.sock.recv_into(view)
             if rcvd:
-                self.handle_messages(rcvd)
+                self.handle_messages(view[:rcvd])
             else:
                 self.print_info("Server has disconnected!")
                 self.request_terminate = True
 
     # This is a function stub that will be completed in a future assignment
     def handle_messages(self, recv_data):
-        messages = MessageParser.parse_messages(recv_data)
+        messages = self.decoder.feed(recv_data)
 
         for message in messages:
              # If we recognize the command, then process it using the assigned message handler
@@ -104,13 +117,33 @@ class CRCClient(object):
         self.connected_user_ids[message.source_id] = message
 
     def handle_status_message(self, message):
-        self.status_updates_log.append(message.content)
+        if CapabilityAnnouncement.is_announcement(message):
+            self.server_capabilities = CapabilityAnnouncement.capabilities(message)
+        else:
+            self.status_updates_log.append(message.content)
 
     def handle_client_chat_message(self, message):
         self.chat_messages_log.append(message.content)
 
     def handle_client_quit_message(self, message):
-        del self.connected_user_ids[message.source_id]
+        self.connected_user_ids.pop(message.source_id, None)
+
+    def handle_server_quit_message(self, message):
+        # Our server is leaving. If it named a replacement, move over to it: the network keeps our registration
+        # (naming the departed server as the last hop tells the replacement we are moving) and our roster
+        if not message.replacement_id:
+            return
+        host, _, port = message.content.rpartition(':')
+        self.print_info("Server is leaving, reconnecting to %s" % message.content)
+        previous = self.sock
+        self.serveraddr, self.serverport = host, int(port)
+        self.connect_to_server()
+        previous.close()
+        self.decoder = MessageFrameDecoder()
+        self.send_message_to_server(ClientRegistrationMessage.bytes(self.id, message.source_id, self.client_name,
+                                                                    self.info))
+        if self.capabilities:
+            self.send_message_to_server(CapabilityAnnouncement.bytes(self.id, self.capabilities))
 
 
     ######################################################################
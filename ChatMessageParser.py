@@ -1,49 +1,295 @@
 from os import replace
 from abc import ABC
 from enum import Enum
-from struct import pack, unpack
+from struct import pack, unpack, unpack_from, Struct
+from itertools import chain, repeat
+import lzma, zlib
 
 # Message codes
 # 0x00 - Server Registration Message
 # 0x01 - Status Message
 # 0x02 - Server Quit Message
+# 0x03 - Message Batch (server links only)
+# 0x04 - Compressed Messages (server links only)
+# 0x05 - Roster Snapshot (server links only)
+# 0x06 - Link State (server links only)
+# 0x07 - Flooded Message (server links only)
 # 0x80 - User Registration message
 # 0x81 - User Message
 # 0x82 - User Quit Message
+
+# Codecs of the length fields frame_length() reads
+HALF_LENGTH = Struct("!H")
+INT_LENGTH = Struct("!I")
+
+# The fields every frame starts with: the message type, the source ID and a second ID, which is the destination
+# ID of status (0x01) and chat (0x81) messages. Every message is at least this long.
+FRAME_HEADER = Struct("!BII")
+
+# The length table of a batch message
+BATCH_LENGTH = Struct("!I")
+
 class MessageParser:
     
     @staticmethod
     def parse_messages(bytes):
-        data = bytes
+        messages, consumed = MessageParser.parse_frames(bytes)
+        if consumed < len(bytes):
+            raise Exception("Incomplete message!!")
+        return messages
+
+    # Parses every complete message in a bytes-like object by walking offsets over a memoryview, so the 
+    # remaining data is never copied. Returns the messages and the number of bytes they span.
+    @staticmethod
+    def parse_frames(bytes):
         messages = []
-        while(len(data) > 0):           
-            msg = None
-            code = data[0]
-            if code == 0x00:
-                msg = ServerRegistrationMessage(data)
-            elif code == 0x80:
-                msg = ClientRegistrationMessage(data)
-            elif code == 0x01:
-                msg =  StatusUpdateMessage(data)
-            elif code == 0x81:
-                msg =  ClientChatMessage(data)
-            elif code == 0x01:
-                msg =  ServerQuitMessage(data)
-            elif code == 0x82:
-                msg =  ClientQuitMessage(data)
-            
-            if msg:
-                messages.append(msg)
-                data = data[msg.variable_message_length:]
-            else:
-                raise Exception("Unrecognized message type!!")
-        
+        offset = 0
+        end = len(bytes)
+        with memoryview(bytes) as view:
+            while offset < end:
+                length = MessageParser.frame_length(view, offset)
+                if length is None or offset + length > end:
+                    break
+                messages.append(MessageParser.parse_message(view[offset:offset+length].tobytes()))
+                offset += length
+        return messages, offset
+
+    # Indexes every complete message in a bytes-like object without parsing it. Returns a list with a 
+    # (message type, source ID, destination ID, offset, length) tuple per message and the number of bytes the 
+    # messages span. The destination ID is only meaningful for status and chat messages.
+    @staticmethod
+    def index_frames(bytes):
+        frames = []
+        offset = 0
+        end = len(bytes)
+        frame_length = MessageParser.frame_length
+        unpack_header = FRAME_HEADER.unpack_from
+        while offset < end:
+            length = frame_length(bytes, offset)
+            if length is None or offset + length > end:
+                break
+            frames.append(unpack_header(bytes, offset) + (offset, length))
+            offset += length
+        return frames, offset
+
+    # Indexes the messages packed into the batch message starting at offset, like index_frames() does for the 
+    # messages of a stream: the offsets of the returned tuples point into bytes, not into the batch. The length
+    # table is used instead of reading every message's header length.
+    @staticmethod
+    def index_batch(bytes, offset=0):
+        _, _, count, batch_length = BATCH_HEADER.unpack_from(bytes, offset)
+        position = offset + 13 + BATCH_LENGTH.size * count
+        end = offset + 13 + batch_length
+        if position > end:
+            raise Exception("Malformed batch message!!")
+        unpack_header = FRAME_HEADER.unpack_from
+        frames = []
+        for (length,) in BATCH_LENGTH.iter_unpack(bytes[offset+13:position]):
+            if length < FRAME_HEADER.size or position + length > end:
+                raise Exception("Malformed batch message!!")
+            frames.append(unpack_header(bytes, position) + (position, length))
+            position += length
+        if position != end:
+            raise Exception("Malformed batch message!!")
+        return frames
+
+    @staticmethod
+    def parse_message(bytes):
+        code = bytes[0]
+        if code == 0x00:
+            return ServerRegistrationMessage(bytes)
+        elif code == 0x80:
+            return ClientRegistrationMessage(bytes)
+        elif code == 0x01:
+            return StatusUpdateMessage(bytes)
+        elif code == 0x81:
+            return ClientChatMessage(bytes)
+        elif code == 0x02:
+            return ServerQuitMessage(bytes)
+        elif code == 0x82:
+            return ClientQuitMessage(bytes)
+        elif code == 0x03:
+            return BatchMessage(bytes)
+        elif code == 0x04:
+            return CompressedMessage(bytes)
+        elif code == 0x05:
+            return RosterSnapshotMessage(bytes)
+        elif code == 0x06:
+            return LinkStateMessage(bytes)
+        elif code == 0x07:
+            return FloodMessage(bytes)
+        else:
+            raise Exception("Unrecognized message type!!")
+
+    # Returns the total length of the message starting at offset, or None if not enough of its fixed-size
+    # header has been received yet to know it
+    @staticmethod
+    def frame_length(bytes, offset=0):
+        available = len(bytes) - offset
+        if available < 1:
+            return None
+
+        code = bytes[offset]
+        if code == 0x00 or code == 0x80:
+            # Fixed 12 byte header, name length (byte) at 9 and info length (half) at 10
+            if available < 12:
+                return None
+            return 12 + bytes[offset+9] + HALF_LENGTH.unpack_from(bytes, offset+10)[0]
+        elif code == 0x01:
+            # Fixed 15 byte header, message length (int) at 11
+            if available < 15:
+                return None
+            return 15 + INT_LENGTH.unpack_from(bytes, offset+11)[0]
+        elif code == 0x81 or code == 0x02 or code == 0x03 or code == 0x07:
+            # Fixed 13 byte header, message length (int) at 9
+            if available < 13:
+                return None
+            return 13 + INT_LENGTH.unpack_from(bytes, offset+9)[0]
+        elif code == 0x82:
+            # Fixed 9 byte header, message length (int) at 5
+            if available < 9:
+                return None
+            return 9 + INT_LENGTH.unpack_from(bytes, offset+5)[0]
+        elif code == 0x04:
+            # Fixed 10 byte header, payload length (int) at 5
+            if available < 10:
+                return None
+            return 10 + INT_LENGTH.unpack_from(bytes, offset+5)[0]
+        elif code == 0x05:
+            # Fixed 17 byte header, snapshot length (int) at 5
+            if available < 17:
+                return None
+            return 17 + INT_LENGTH.unpack_from(bytes, offset+5)[0]
+        elif code == 0x06:
+            # Fixed 13 byte header, neighbour count (int) at 9, followed by one int per neighbour
+            if available < 13:
+                return None
+            return 13 + 4 * INT_LENGTH.unpack_from(bytes, offset+9)[0]
+        else:
+            raise Exception("Unrecognized message type!!")
+
+
+# A MessageFrameDecoder reassembles the byte stream received over one connection into complete messages. TCP 
+# does not preserve message boundaries, so a single read may end in the middle of a message or contain several
+# messages. Bytes belonging to an incomplete message are kept until the rest of it arrives with a later read.
+#
+# The data passed to feed() may be a memoryview of a reusable receive buffer. Complete messages are parsed 
+# straight out of it and only the bytes of a trailing incomplete message are copied into the decoder.
+class MessageFrameDecoder:
+    def __init__(self):
+        self.buffer = bytearray()
+
+    # Consumes newly received bytes and returns the list of messages that are now complete
+    def feed(self, data):
+        buffer = self.buffer
+        if not buffer:
+            messages, consumed = MessageParser.parse_frames(data)
+            if consumed < len(data):
+                buffer += data[consumed:]
+            return messages
+
+        buffer += data
+        messages, consumed = MessageParser.parse_frames(buffer)
+        if consumed:
+            del buffer[:consumed]
         return messages
 
+    # Consumes newly received bytes like feed(), but only indexes the messages that are now complete (see 
+    # MessageParser.index_frames). Returns a bytes object holding the complete messages and their index, whose
+    # offsets point into it. The bytes are copied once per call instead of once per message, and not at all if
+    # data is a bytes object made up of complete messages.
+    def feed_frames(self, data):
+        buffer = self.buffer
+        if not buffer:
+            frames, consumed = MessageParser.index_frames(data)
+            if consumed < len(data):
+                buffer += data[consumed:]
+            if consumed == len(data) and type(data) is bytes:
+                return data, frames
+            with memoryview(data) as view:
+                return view[:consumed].tobytes(), frames
+
+        buffer += data
+        frames, consumed = MessageParser.index_frames(buffer)
+        with memoryview(buffer) as view:
+            chunk = view[:consumed].tobytes()
+        if consumed:
+            del buffer[:consumed]
+        return chunk, frames
+
+    # The number of bytes received that do not form a complete message yet
+    def pending(self):
+        return len(self.buffer)
+
+
+# A ReceiveBufferPool hands out preallocated bytearrays to receive into with socket.recv_into(), so reading 
+# from a socket does not allocate a new bytes object for every read. Buffers must be released back to the pool
+# once the data received into them has been consumed.
+class ReceiveBufferPool:
+    def __init__(self, buffer_size=65536, count=4):
+        self.buffer_size = buffer_size
+        self.free_buffers = [bytearray(buffer_size) for _ in range(count)]
+
+    def acquire(self):
+        if self.free_buffers:
+            return self.free_buffers.pop()
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer):
+        self.free_buffers.append(buffer)
 
-# Abstract class for messages
+
+# Abstract class for messages. Messages are slotted, so they do not carry a __dict__ each.
 class Message(ABC):
-    pass
+    __slots__ = ()
+
+
+# With __slots__ a message class cannot have both a static encoder and an instance attribute called bytes, so
+# the encoder is wrapped in this descriptor: ClientChatMessage.bytes(...) encodes a message and message.bytes
+# returns the encoded message, which is stored in the _bytes slot.
+class MessageBytes:
+    __slots__ = ('encode',)
+
+    def __init__(self, encode):
+        self.encode = encode
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self.encode
+        return instance._bytes
+
+
+# Header codecs, compiled once. Every header starts with the message type byte and is followed by the 
+# variable length strings, which are sliced out of the message directly.
+SERVER_REGISTRATION_HEADER = Struct("!BIIBH")   # type, source ID, last hop ID, name length, info length
+CLIENT_REGISTRATION_HEADER = Struct("!BIIBH")   # type, source ID, last hop ID, name length, info length
+STATUS_UPDATE_HEADER = Struct("!BIIHI")         # type, source ID, destination ID, status code, content length
+CLIENT_CHAT_HEADER = Struct("!BIII")            # type, source ID, destination ID, content length
+SERVER_QUIT_HEADER = Struct("!BIII")            # type, source ID, replacement ID, content length
+CLIENT_QUIT_HEADER = Struct("!BII")             # type, source ID, content length
+BATCH_HEADER = Struct("!BIII")                  # type, source ID, message count, batch length
+COMPRESSED_HEADER = Struct("!BIIB")             # type, source ID, payload length, codec
+ROSTER_SNAPSHOT_HEADER = Struct("!BIIII")       # type, source ID, snapshot length, server count, client count
+LINK_STATE_HEADER = Struct("!BIII")             # type, source ID, sequence number, neighbour count
+FLOOD_HEADER = Struct("!BIII")                  # type, source ID, sequence number, message length
+
+# The strings of a message (names, info and content) are only decoded when they are accessed, so messages that
+# are forwarded as they are (which only need message.bytes) are never decoded.
+
+# The last hop ID of a registration message, which a server rewrites before forwarding it
+LAST_HOP_ID = Struct("!I")
+LAST_HOP_OFFSET = 5
+
+
+# Registration messages are forwarded with the forwarding server as their last hop. forwarded_bytes() patches
+# the last hop ID of the received message instead of encoding the names and info strings again.
+class RegistrationMessage(Message):
+    __slots__ = ()
+
+    def forwarded_bytes(self, last_hop_id):
+        frame = bytearray(self._bytes)
+        LAST_HOP_ID.pack_into(frame, LAST_HOP_OFFSET, last_hop_id)
+        return bytes(frame)
 
 
 # #### Server Registration Message ####
@@ -54,22 +300,29 @@ class Message(ABC):
 # ServerInfoLength (half)
 # ServerNameString (variable length, UTF-8 encoding)
 # ServerInfoString (variable length, UTF-8 encoding)
-class ServerRegistrationMessage(Message):
+class ServerRegistrationMessage(RegistrationMessage):
+    __slots__ = ('source_id', 'last_hop_id', 'server_name_length', 'server_info_length', 'variable_message_length',
+                 '_bytes')
+    message_type = 0x00
+
     def __init__(self, bytes):
-        self.message_type = 0x00
-        msg = unpack("!xIIBH", bytes[:12])
-        self.source_id = msg[0]
-        self.last_hop_id = msg[1]
-        self.server_name_length = msg[2]
-        self.server_info_length = msg[3]
-        self.server_name = unpack("!{0}s".format(self.server_name_length), bytes[12:12+self.server_name_length])[0].decode()
-        self.server_info = unpack("!{0}s".format(self.server_info_length), bytes[12+self.server_name_length:12+self.server_name_length+self.server_info_length])[0].decode()
+        (_, self.source_id, self.last_hop_id, self.server_name_length, 
+         self.server_info_length) = SERVER_REGISTRATION_HEADER.unpack_from(bytes)
         self.variable_message_length = 12 + self.server_name_length + self.server_info_length
-        self.bytes = bytes[:self.variable_message_length]
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
+
+    @property
+    def server_name(self):
+        return str(self._bytes[12:12+self.server_name_length], 'utf-8')
+
+    @property
+    def server_info(self):
+        return str(self._bytes[12+self.server_name_length:self.variable_message_length], 'utf-8')
         
-    @staticmethod
+    @MessageBytes
     def bytes(source_id, last_hop_id, server_name, server_info):
-        return pack("!BIIBH{0}s{1}s".format(len(server_name), len(server_info)), 0x00, source_id, last_hop_id, len(server_name), len(server_info), server_name.encode(), server_info.encode())
+        name, info = server_name.encode(), server_info.encode()
+        return SERVER_REGISTRATION_HEADER.pack(0x00, source_id, last_hop_id, len(name), len(info)) + name + info
 
 
 # #### User Registrtion Message ####
@@ -80,22 +333,29 @@ class ServerRegistrationMessage(Message):
 # UserInfoLength (half)
 # UserNameString (variable length, UTF-8 encoding)
 # UserInfoString (variable length, UTF-8 encoding)
-class ClientRegistrationMessage(Message):
+class ClientRegistrationMessage(RegistrationMessage):
+    __slots__ = ('source_id', 'last_hop_id', 'client_name_length', 'client_info_length', 'variable_message_length',
+                 '_bytes')
+    message_type = 0x80
+
     def __init__(self, bytes):
-        self.message_type = 0x80
-        msg = unpack("!xIIBH", bytes[:12])
-        self.source_id = msg[0]
-        self.last_hop_id = msg[1]
-        self.client_name_length = msg[2]
-        self.client_info_length = msg[3]
-        self.client_name = unpack("!{0}s".format(self.client_name_length), bytes[12:12+self.client_name_length])[0].decode()
-        self.client_info = unpack("!{0}s".format(self.client_info_length), bytes[12+self.client_name_length:12+self.client_name_length+self.client_info_length])[0].decode()
+        (_, self.source_id, self.last_hop_id, self.client_name_length, 
+         self.client_info_length) = CLIENT_REGISTRATION_HEADER.unpack_from(bytes)
         self.variable_message_length = 12 + self.client_name_length + self.client_info_length
-        self.bytes = bytes[:self.variable_message_length]
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
 
-    @staticmethod
+    @property
+    def client_name(self):
+        return str(self._bytes[12:12+self.client_name_length], 'utf-8')
+
+    @property
+    def client_info(self):
+        return str(self._bytes[12+self.client_name_length:self.variable_message_length], 'utf-8')
+
+    @MessageBytes
     def bytes(source_id, last_hop_id, client_name, client_info):
-        return pack("!BIIBH{0}s{1}s".format(len(client_name), len(client_info)), 0x80, source_id, last_hop_id, len(client_name), len(client_info), client_name.encode(), client_info.encode())
+        name, info = client_name.encode(), client_info.encode()
+        return CLIENT_REGISTRATION_HEADER.pack(0x80, source_id, last_hop_id, len(name), len(info)) + name + info
 
 
 # #### Status Update Message ####
@@ -106,20 +366,24 @@ class ClientRegistrationMessage(Message):
 # MessageLength (int)
 # MessageString (variable length, UTF-8 encoding)
 class StatusUpdateMessage(Message):
+    __slots__ = ('source_id', 'destination_id', 'status_code', 'content_length', 'variable_message_length', 
+                 '_bytes')
+    message_type = 0x01
+
     def __init__(self, bytes):
-        self.message_type = 0x01
-        msg = unpack("!xIIHI", bytes[:15])
-        self.source_id = msg[0]
-        self.destination_id = msg[1]
-        self.status_code = msg[2]
-        self.content_length = msg[3]
-        self.content = unpack("!{0}s".format(self.content_length), bytes[15:15+self.content_length])[0].decode()
+        (_, self.source_id, self.destination_id, self.status_code, 
+         self.content_length) = STATUS_UPDATE_HEADER.unpack_from(bytes)
         self.variable_message_length = 15 + self.content_length
-        self.bytes = bytes[:self.variable_message_length]
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
 
-    @staticmethod
+    @property
+    def content(self):
+        return str(self._bytes[15:self.variable_message_length], 'utf-8')
+
+    @MessageBytes
     def bytes(source_id, destination_id, message_code, content):
-        return pack("!BIIHI{0}s".format(len(content)), 0x01, source_id, destination_id, message_code, len(content), content.encode())
+        content = content.encode()
+        return STATUS_UPDATE_HEADER.pack(0x01, source_id, destination_id, message_code, len(content)) + content
 
 
 # #### User Chat Message ####
@@ -129,41 +393,51 @@ class StatusUpdateMessage(Message):
 # MessageLength (int)
 # MessageString (variable length, UTF-8 encoding)
 class ClientChatMessage(Message):
+    __slots__ = ('source_id', 'destination_id', 'content_length', 'variable_message_length', '_bytes')
+    message_type = 0x81
+
     def __init__(self, bytes):
-        self.message_type = 0x81
-        msg = unpack("!xIII", bytes[:13])
-        self.source_id = msg[0]
-        self.destination_id = msg[1]
-        self.content_length = msg[2]
-        self.content = unpack("!{0}s".format(self.content_length), bytes[13:13+self.content_length])[0].decode()
+        _, self.source_id, self.destination_id, self.content_length = CLIENT_CHAT_HEADER.unpack_from(bytes)
         self.variable_message_length = 13 + self.content_length
-        self.bytes = bytes[:self.variable_message_length]
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
 
-    @staticmethod
+    @property
+    def content(self):
+        return str(self._bytes[13:self.variable_message_length], 'utf-8')
+
+    @MessageBytes
     def bytes(source_id, destination_id, content):
-        return pack("!BIII{0}s".format(len(content)), 0x81, source_id, destination_id, len(content), content.encode())
+        content = content.encode()
+        return CLIENT_CHAT_HEADER.pack(0x81, source_id, destination_id, len(content)) + content
 
 
 # #### Server Shutdown Message (Extra Credit) ####
 # MessageType (byte = 0x02)
 # SourceID (int)
-# ReplacementServerID (int)
+# ReplacementServerID (int, 0 if there is none)
 # MessageLength (int)
 # MessageString (variable length, UTF-8 encoding)
+#
+# When a server leaves with a replacement, the message string is the address ("host:port") the replacement 
+# listens on, so the leaving server's adjacent servers and clients can reconnect to it. Otherwise it is the
+# reason the server left.
 class ServerQuitMessage(Message):
+    __slots__ = ('source_id', 'replacement_id', 'content_length', 'variable_message_length', '_bytes')
+    message_type = 0x02
+
     def __init__(self, bytes):
-        self.message_type = 0x02
-        msg = unpack("!xIII", bytes[:13])
-        self.source_id = msg[0]
-        self.replacement_id = msg[1]
-        self.content_length = msg[2]
-        self.content = unpack("!{0}s".format(self.content_length), bytes[13:13+self.content_length])[0].decode()
+        _, self.source_id, self.replacement_id, self.content_length = SERVER_QUIT_HEADER.unpack_from(bytes)
         self.variable_message_length = 13 + self.content_length
-        self.bytes = bytes[:self.variable_message_length]
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
 
-    @staticmethod
+    @property
+    def content(self):
+        return str(self._bytes[13:self.variable_message_length], 'utf-8')
+
+    @MessageBytes
     def bytes(source_id, replacement_server_id, content):
-        return pack("!BIII{0}s".format(len(content)), 0x81, source_id, replacement_server_id, len(content), content.encode())
+        content = content.encode()
+        return SERVER_QUIT_HEADER.pack(0x02, source_id, replacement_server_id, len(content)) + content
 
 
 # #### User Quit Message ####
@@ -172,15 +446,299 @@ class ServerQuitMessage(Message):
 # MessageLength (int)
 # MessageString (variable length, UTF-8 encoding)
 class ClientQuitMessage(Message):
+    __slots__ = ('source_id', 'content_length', 'variable_message_length', '_bytes')
+    message_type = 0x82
+
     def __init__(self, bytes):
-        self.message_type = 0x82
-        msg = unpack("!xII", bytes[:9])
-        self.source_id = msg[0]
-        self.content_length = msg[1]
-        self.content = unpack("!{0}s".format(self.content_length), bytes[9:9+self.content_length])[0].decode()
+        _, self.source_id, self.content_length = CLIENT_QUIT_HEADER.unpack_from(bytes)
         self.variable_message_length = 9 + self.content_length
-        self.bytes = bytes[:self.variable_message_length]
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
 
-    @staticmethod
+    @property
+    def content(self):
+        return str(self._bytes[9:self.variable_message_length], 'utf-8')
+
+    @MessageBytes
     def bytes(source_id, content):
-        return pack("!BII{0}s".format(len(content)), 0x82, source_id, len(content), content.encode())
\ No newline at end of file
+        content = content.encode()
+        return CLIENT_QUIT_HEADER.pack(0x82, source_id, len(content)) + content
+
+# #### Message Batch ####
+# MessageType (byte = 0x03)
+# SourceID (int, the server that packed the batch)
+# MessageCount (int)
+# BatchLength (int, the length of the length table and the messages)
+# MessageLengths (MessageCount ints)
+# Messages (the packed messages, back to back)
+#
+# Servers pack runs of messages queued for the same adjacent server into a batch message, which the receiving
+# server unpacks and dispatches as if the messages had been received one by one. Batches are only sent over 
+# server links, clients always receive the messages themselves.
+class BatchMessage(Message):
+    __slots__ = ('source_id', 'message_count', 'batch_length', 'variable_message_length', '_bytes')
+    message_type = 0x03
+
+    def __init__(self, bytes):
+        _, self.source_id, self.message_count, self.batch_length = BATCH_HEADER.unpack_from(bytes)
+        self.variable_message_length = 13 + self.batch_length
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
+
+    @property
+    def messages(self):
+        frames = MessageParser.index_batch(self._bytes)
+        return [self._bytes[offset:offset+length] for _, _, _, offset, length in frames]
+
+    @MessageBytes
+    def bytes(source_id, messages):
+        lengths = list(map(len, messages))
+        table = pack("!%iI" % len(lengths), *lengths)
+        header = BATCH_HEADER.pack(0x03, source_id, len(lengths), len(table) + sum(lengths))
+        return b''.join([header, table, *messages])
+
+
+# #### Compressed Messages ####
+# MessageType (byte = 0x04)
+# SourceID (int, the server that compressed the messages)
+# PayloadLength (int)
+# Codec (byte, see COMPRESSION_CODECS)
+# Payload (a run of complete messages, compressed with the codec)
+#
+# Servers only compress the messages they send to an adjacent server that announced it accepts the codec (see 
+# CapabilityAnnouncement). The payload of a zlib frame continues the compression stream of the previous frames
+# sent over the same link, so it can only be decompressed by the link's LinkDecompressor.
+class CompressedMessage(Message):
+    __slots__ = ('source_id', 'payload_length', 'codec', 'variable_message_length', '_bytes')
+    message_type = 0x04
+
+    def __init__(self, bytes):
+        _, self.source_id, self.payload_length, self.codec = COMPRESSED_HEADER.unpack_from(bytes)
+        self.variable_message_length = 10 + self.payload_length
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
+
+    @property
+    def payload(self):
+        return self._bytes[10:self.variable_message_length]
+
+    @MessageBytes
+    def bytes(source_id, codec, payload):
+        return COMPRESSED_HEADER.pack(0x04, source_id, len(payload), codec) + payload
+
+
+# The codecs messages sent between servers can be compressed with
+COMPRESSION_CODECS = {'zlib': 0x01, 'lzma': 0x02}
+
+# A LinkCompressor compresses runs of the messages sent over one server link into CompressedMessages. The zlib 
+# codec keeps one compression stream per link and ends every message with a sync flush, so later messages are 
+# compressed against everything sent before them, which is what makes repetitive roster data shrink. The lzma
+# module cannot flush a stream without ending it, so lzma compresses every message on its own.
+class LinkCompressor:
+    def __init__(self, source_id, codec, level=None):
+        self.source_id = source_id
+        self.codec = codec
+        self.level = level
+        if codec == 0x01:
+            self.stream = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level)
+        elif codec == 0x02:
+            self.stream = None
+        else:
+            raise Exception("Unrecognized compression codec!!")
+
+    # Compresses a list of complete messages (bytes-like) into a single CompressedMessage
+    def compress(self, messages):
+        if self.stream is not None:
+            compress = self.stream.compress
+            payload = b''.join([*map(compress, messages), self.stream.flush(zlib.Z_SYNC_FLUSH)])
+        else:
+            payload = lzma.compress(b''.join(messages), format=lzma.FORMAT_ALONE, 
+                                    preset=lzma.PRESET_DEFAULT if self.level is None else self.level)
+        return CompressedMessage.bytes(self.source_id, self.codec, payload)
+
+
+# A LinkDecompressor decompresses the payloads of the CompressedMessages received over one server link, in the
+# order they were received in. A payload that decompresses to more than max_length bytes is rejected without 
+# decompressing the rest of it, so a small frame cannot make the receiver allocate an arbitrary amount of memory.
+class LinkDecompressor:
+    def __init__(self, codec, max_length):
+        self.codec = codec
+        self.max_length = max_length
+        if codec == 0x01:
+            self.stream = zlib.decompressobj()
+        elif codec == 0x02:
+            self.stream = None
+        else:
+            raise Exception("Unrecognized compression codec!!")
+
+    # Returns the messages a payload compressed with the given codec decompresses to
+    def decompress(self, codec, payload):
+        if codec != self.codec:
+            raise Exception("Compression codec changed!!")
+        if self.stream is not None:
+            stream = self.stream
+            data = stream.decompress(payload, self.max_length + 1)
+            if len(data) > self.max_length or stream.unconsumed_tail:
+                raise Exception("Compressed message too large!!")
+            return data
+        stream = lzma.LZMADecompressor(format=lzma.FORMAT_ALONE)
+        data = stream.decompress(payload, self.max_length + 1)
+        if len(data) > self.max_length:
+            raise Exception("Compressed message too large!!")
+        if not stream.eof or stream.unused_data:
+            raise Exception("Incomplete compressed message!!")
+        return data
+
+
+# #### Capability Announcement ####
+# A Status Update Message (0x01) with the status code STATUS_CAPABILITIES, addressed to the reserved ID 
+# CAPABILITIES_ID. Its content lists the optional protocol features the source supports, separated by commas, 
+# each optionally followed by '=' and a list of values separated by '+' (e.g. "batch,compress=zlib+lzma").
+#
+# Hosts announce their capabilities right after registering with an adjacent host, and only use a feature on 
+# the connection once the other side has announced it too. Since the announcement is an ordinary status message
+# addressed to a host that does not exist, hosts that predate capabilities drop it without complaint, and 
+# features are never used with them. Capabilities a host does not know are ignored.
+CAPABILITIES_ID = 0xFFFFFFFF
+STATUS_CAPABILITIES = 0x10
+
+class CapabilityAnnouncement:
+
+    @staticmethod
+    def is_announcement(message):
+        return message.destination_id == CAPABILITIES_ID and message.status_code == STATUS_CAPABILITIES
+
+    # Returns a dictionary mapping the name of every announced capability to a tuple of its values
+    @staticmethod
+    def capabilities(message):
+        capabilities = {}
+        for capability in message.content.split(','):
+            name, _, values = capability.strip().partition('=')
+            if name:
+                capabilities[name] = tuple(value for value in values.split('+') if value)
+        return capabilities
+
+    @staticmethod
+    def bytes(source_id, capabilities):
+        content = ','.join(name + ('=' + '+'.join(values) if values else '') 
+                           for name, values in capabilities.items())
+        return StatusUpdateMessage.bytes(source_id, CAPABILITIES_ID, STATUS_CAPABILITIES, content)
+
+
+# #### Roster Snapshot ####
+# MessageType (byte = 0x05)
+# SourceID (int, the server sending the snapshot)
+# SnapshotLength (int, the length of everything after the header)
+# ServerCount (int)
+# ClientCount (int)
+# HostIDs (ServerCount + ClientCount ints, the servers first)
+# NameLengths (one byte per host)
+# InfoLengths (one half per host)
+# Strings (the name and the info string of every host, back to back, UTF-8 encoding)
+#
+# A roster snapshot carries the registrations of many hosts in one frame, column by column. It replaces the 
+# registration messages a server sends to a new adjacent server that announced the 'snapshot' capability. The
+# first hop of every host in a snapshot is the server that sent it, just like the last hop of the registration
+# messages it replaces, so it is not repeated per host.
+class RosterSnapshotMessage(Message):
+    __slots__ = ('source_id', 'snapshot_length', 'server_count', 'client_count', 'variable_message_length', 
+                 '_bytes')
+    message_type = 0x05
+
+    def __init__(self, bytes):
+        (_, self.source_id, self.snapshot_length, self.server_count, 
+         self.client_count) = ROSTER_SNAPSHOT_HEADER.unpack_from(bytes)
+        self.variable_message_length = 17 + self.snapshot_length
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
+
+    # Returns a (message type, host ID, name length, info length, name and info bytes) tuple per host, where 
+    # the message type is the type of the host's registration message (0x00 or 0x80)
+    def hosts(self):
+        data = self._bytes
+        count = self.server_count + self.client_count
+        ids = unpack_from("!%iI" % count, data, 17)
+        name_lengths = data[17 + 4*count:17 + 5*count]
+        info_lengths = unpack_from("!%iH" % count, data, 17 + 5*count)
+        offset = 17 + 7*count
+        if offset + sum(name_lengths) + sum(info_lengths) != self.variable_message_length:
+            raise Exception("Malformed roster snapshot!!")
+        hosts = []
+        append = hosts.append
+        message_types = chain(repeat(0x00, self.server_count), repeat(0x80, self.client_count))
+        for message_type, host_id, name_length, info_length in zip(message_types, ids, name_lengths, info_lengths):
+            end = offset + name_length + info_length
+            append((message_type, host_id, name_length, info_length, data[offset:end]))
+            offset = end
+        return hosts
+
+    # Encodes a snapshot of the given registration messages (e.g. the ones a server caches for its hosts)
+    @MessageBytes
+    def bytes(source_id, registrations):
+        servers = [registration for registration in registrations if registration[0] == 0x00]
+        clients = [registration for registration in registrations if registration[0] == 0x80]
+        ordered = servers + clients
+        headers = [SERVER_REGISTRATION_HEADER.unpack_from(registration) for registration in ordered]
+        count = len(ordered)
+        body = b''.join([pack("!%iI" % count, *[header[1] for header in headers]),
+                         pack("!%iB" % count, *[header[3] for header in headers]),
+                         pack("!%iH" % count, *[header[4] for header in headers]),
+                         *[registration[12:] for registration in ordered]])
+        return ROSTER_SNAPSHOT_HEADER.pack(0x05, source_id, len(body), len(servers), len(clients)) + body
+
+
+# #### Link State ####
+# MessageType (byte = 0x06)
+# SourceID (int, the server whose links are described)
+# SequenceNumber (int, increases with every link state the server sends)
+# NeighbourCount (int)
+# NeighbourIDs (NeighbourCount ints, the servers the source has a mesh link with)
+#
+# Servers in a mesh flood their link state to every other mesh server whenever one of their mesh links comes up
+# or goes down. Every mesh server keeps the latest link state of every other one and computes its routes from 
+# them (see CRCServer.compute_mesh_routes). A link state is forwarded only if it is newer than the one kept.
+class LinkStateMessage(Message):
+    __slots__ = ('source_id', 'seq', 'neighbour_count', 'variable_message_length', '_bytes')
+    message_type = 0x06
+
+    def __init__(self, bytes):
+        _, self.source_id, self.seq, self.neighbour_count = LINK_STATE_HEADER.unpack_from(bytes)
+        self.variable_message_length = 13 + 4 * self.neighbour_count
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
+
+    @property
+    def neighbours(self):
+        return unpack_from("!%iI" % self.neighbour_count, self._bytes, 13)
+
+    @MessageBytes
+    def bytes(source_id, seq, neighbours):
+        neighbours = sorted(neighbours)
+        return LINK_STATE_HEADER.pack(0x06, source_id, seq, len(neighbours)) + pack("!%iI" % len(neighbours), 
+                                                                                   *neighbours)
+
+
+# #### Flooded Message ####
+# MessageType (byte = 0x07)
+# SourceID (int, the mesh server the message entered the mesh at)
+# SequenceNumber (int, 0 if the message is not flooded)
+# MessageLength (int)
+# Message (a single complete message)
+#
+# Broadcasts between mesh servers (registrations and quits) are wrapped in flooded messages, since a mesh has 
+# redundant links and the same broadcast reaches a server more than once. The source numbers the broadcasts it
+# floods, so every server forwards each one once and drops the copies that took another path. The source is 
+# also the server the hosts in the message are reached through. A server sending its roster to a new mesh 
+# neighbour wraps every registration with sequence number 0, which only tells the neighbour which server the
+# host is reached through; such messages are neither numbered nor forwarded.
+class FloodMessage(Message):
+    __slots__ = ('source_id', 'seq', 'message_length', 'variable_message_length', '_bytes')
+    message_type = 0x07
+
+    def __init__(self, bytes):
+        _, self.source_id, self.seq, self.message_length = FLOOD_HEADER.unpack_from(bytes)
+        self.variable_message_length = 13 + self.message_length
+        self._bytes = bytes if len(bytes) == self.variable_message_length else bytes[:self.variable_message_length]
+
+    @property
+    def message(self):
+        return MessageParser.parse_message(self._bytes[13:self.variable_message_length])
+
+    @MessageBytes
+    def bytes(source_id, seq, message):
+        return b''.join([FLOOD_HEADER.pack(0x07, source_id, seq, len(message)), message])
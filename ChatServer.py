@@ -1,9 +1,95 @@
 from ChatMessageParser import *
+from RouteTable import RouteTable
 from socket import *
-import os
+import socket as socket_module
+from collections import deque, Counter
+from itertools import chain, islice
+from types import MappingProxyType
+from heapq import heappush, heappop
+import os, sys, tempfile, threading, time
 import selectors
 import logging
 
+# The maximum number of bytes read from a socket at once
+RECV_BUFFER_SIZE = 65536
+
+# The maximum number of buffers handed to a single sendmsg() call
+try:
+    MAX_SEND_BUFFERS = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    MAX_SEND_BUFFERS = 1024
+
+# The maximum number of times in a row the flush phase of the event loop is put off because more input is 
+# already waiting to be handled
+MAX_DEFERRED_FLUSHES = 8
+
+# Default fair read scheduling budgets (see CRCServer.__init__): the number of messages and the number of bytes
+# of messages a connection may have dispatched per turn of the dispatch phase
+DEFAULT_READ_BUDGET_MESSAGES = 256
+DEFAULT_READ_BUDGET_BYTES = 64 * 1024
+
+# The number of dispatch latency samples kept per connection class
+LATENCY_SAMPLE_COUNT = 4096
+
+# Default backpressure settings (see CRCServer.__init__). A connection is congested once more than the high 
+# watermark is queued on it and stays congested until its queue drains below the low watermark.
+DEFAULT_WRITE_HIGH_WATERMARK = 1024 * 1024
+DEFAULT_WRITE_LOW_WATERMARK = 256 * 1024
+DEFAULT_SLOW_CONSUMER_TIMEOUT = 5.0
+SLOW_CONSUMER_POLICIES = ('drop_chat', 'disconnect', 'spill')
+
+# Runs of messages queued on a server link are packed into batch messages of at most MAX_BATCH_BYTES bytes of
+# messages (see BaseConnectionData.batch_queued). Messages larger than BATCH_MESSAGE_LIMIT are sent as they are,
+# since for them copying the message into a batch costs more than its header does.
+BATCHED_MESSAGE_TYPES = frozenset((0x00, 0x01, 0x02, 0x80, 0x81, 0x82))
+BATCH_MESSAGE_LIMIT = 4096
+MAX_BATCH_BYTES = 64 * 1024
+
+# Default link compression settings (see CRCServer.__init__). Output queued on a compressing server link is 
+# only compressed if there is at least DEFAULT_COMPRESSION_THRESHOLD bytes of it, and at most 
+# MAX_COMPRESSED_INPUT bytes of messages are compressed into a single CompressedMessage, so the receiving server 
+# does not have to buffer arbitrarily large frames before it can decompress them. A received CompressedMessage 
+# that decompresses to more than that is rejected (see LinkDecompressor).
+DEFAULT_COMPRESSION_THRESHOLD = 512
+MAX_COMPRESSED_INPUT = 256 * 1024
+
+# The capabilities of a host that has not announced any (see CapabilityAnnouncement)
+NO_CAPABILITIES = MappingProxyType({})
+
+# A new adjacent server is sent the full state of the network once it has announced its capabilities, so the 
+# state can be sent as roster snapshots if it accepts them. Servers announce right behind their registration, so
+# one that sent anything else behind it predates capabilities and is sent registration messages right away. If 
+# nothing arrived behind the registration yet, the announcement is waited for until the capability timeout 
+# (DEFAULT_CAPABILITY_TIMEOUT seconds by default) expires. A roster snapshot carries at most MAX_SNAPSHOT_HOSTS 
+# hosts, so a large roster is split into frames the receiving server can handle without buffering all of it.
+DEFAULT_CAPABILITY_TIMEOUT = 1.0
+MAX_SNAPSHOT_HOSTS = 16384
+
+# The number of seconds a server waits after the link to an adjacent host closed before it removes the host 
+# (and every host reached through it) from its routing state and tells the rest of the network they quit. When
+# a whole network shuts down, every server closes its links at about the same time, and the servers do not 
+# flood each other with quit messages for hosts that are going away anyway.
+LINK_FAILURE_GRACE = 1.0
+
+# The number of seconds a server waits for the hosts behind an adjacent server that left with a replacement to 
+# reconnect through the replacement. The hosts that have not been reached again by then are removed like the
+# hosts behind a failed link.
+HANDOVER_TIMEOUT = 5.0
+
+# The number of sequence numbers below the highest one seen from a mesh server within which a server remembers 
+# which of its flooded messages it has handled (see FloodWindow). Copies of older messages are dropped.
+FLOOD_WINDOW = 4096
+
+# The messages that are flooded between mesh servers, and the link state of a mesh server nothing is known about
+FLOODED_MESSAGE_TYPES = frozenset((0x00, 0x80, 0x82))
+NO_LINK_STATE = (0, frozenset())
+
+# The client registration and quit messages a server with a presence window collects (see PresenceAggregator)
+PRESENCE_MESSAGE_TYPES = frozenset((0x80, 0x82))
+
+# The value written to an eventfd (or socket pair) to wake up the event loop
+WAKEUP_INCREMENT = (1).to_bytes(8, sys.byteorder)
+
 ##############################################################################################################
 
 class BaseConnectionData():
@@ -12,38 +98,589 @@ class BaseConnectionData():
     one representing data associated with a connected server and one representing data associated with a 
     connected client.         
     
-    The fundamental responsibility of classes derived from ConnectionData is to store a write buffer 
-    associated with a particular socket. This server will append messages to be sent to this write buffer and 
+    The fundamental responsibility of classes derived from ConnectionData is to store a write queue 
+    associated with a particular socket. This server will append messages to be sent to this write queue and 
     will then send the messages at a later point when it is possible to do so (i.e. the next time select() is 
     called by the main loop). This functionality is defined in this base class. Other functionality will be 
     defined in derived subclasses.
+
+    The write queue holds one chunk per queued message. Pending chunks are flushed with a single scatter-gather
+    sendmsg() call and a partially sent chunk is replaced by a memoryview of its unsent tail, so neither 
+    queueing nor sending ever copies the data that is already pending.
+
+    Once the server treats a connection as a slow consumer (see CRCServer.handle_slow_consumer) the queue 
+    either drops chat messages or diverts everything queued to a SpillFile on disk.
+
+    Received messages wait in the inbox until the server's dispatch phase hands them to the message handlers 
+    (see CRCServer.dispatch_ready_connections).
+
+    The capabilities the host at the other end announced (see CapabilityAnnouncement) decide which optional 
+    protocol features are used on the connection, e.g. batching and compression. The compressor and 
+    decompressor keep the state of the connection's compression streams.
+
+    Connection data objects are slotted, since every server keeps one for every host in the network. Only the 
+    objects of adjacent hosts have a socket: ServerConnectionData and ClientConnectionData objects are created 
+    without buffers and take over those of the BaseConnectionData they replace once they are attached to a 
+    socket (see take_over).
     """    
+    __slots__ = ('write_queue', 'pending_bytes', 'decoder', 'sock', 'write_interest', 'flush_scheduled', 
+                 'sent_registration', 'inbox', 'inbox_bytes', 'io_device', 'dispatch_scheduled', 
+                 'read_throttled', 'congested', 'congestion_timer', 'slow_consumer', 'drop_chat', 'spill', 
+                 'paused_upstreams', 'paused_by', 'reading_paused', 'dropped_messages', 'spilled_bytes', 
+                 'capabilities', 'compressor', 'decompressor')
+    connection_class = 'unregistered'       # The class dispatch latencies are recorded under
+
+    def __init__(self, buffers=True):
+        self.write_queue = deque() if buffers else None   # Chunks (bytes or memoryviews) waiting to be sent
+        self.pending_bytes = 0              # The total number of bytes in write_queue
+        self.decoder = MessageFrameDecoder() if buffers else None  # Reassembles received bytes into messages
+        self.sock = None                    # The socket this connection's data is associated with
+        self.write_interest = False         # Whether the socket is registered with the selector for EVENT_WRITE
+        self.flush_scheduled = False        # Whether the connection is waiting for the flush phase of the loop
+        self.sent_registration = False      # Whether this server has already introduced itself on this socket
+
+        # Fair read scheduling state
+        self.inbox = deque() if buffers else None  # Received messages waiting to be dispatched
+        self.inbox_bytes = 0                # The total size of the messages in inbox
+        self.io_device = None               # The io_device the messages in inbox are handed to handlers with
+        self.dispatch_scheduled = False     # Whether the connection is waiting for a turn in the dispatch phase
+        self.read_throttled = False         # Whether reading waits until the inbox has been dispatched
+
+        # Backpressure state
+        self.congested = False              # Whether pending_bytes is above the high watermark (see CRCServer)
+        self.congestion_timer = None        # Turns the connection into a slow consumer if it stays congested
+        self.slow_consumer = False          # Whether the slow consumer policy is applied to this connection
+        self.drop_chat = False              # Whether chat messages queued on this connection are dropped
+        self.spill = None                   # The SpillFile queued messages are diverted to while spilling
+        self.paused_upstreams = [] if buffers else None  # Connections paused because this one is congested
+        self.paused_by = 0                  # The number of congested connections this one stopped reading for
+        self.reading_paused = False         # Whether the socket is unsubscribed from EVENT_READ
+        self.dropped_messages = 0           # The number of chat messages dropped as a slow consumer
+        self.spilled_bytes = 0              # The number of bytes diverted to disk as a slow consumer
+
+        # Optional protocol features
+        self.capabilities = NO_CAPABILITIES # Maps the capabilities the host announced to their values
+        self.compressor = None              # The LinkCompressor output is compressed with, if any
+        self.decompressor = None            # The LinkDecompressor of the CompressedMessages received, if any
+
+    def queue(self, message):
+        """ Appends a packed message to the end of the write queue, or to the spill file while spilling. Chat 
+        messages are dropped instead while drop_chat is set.
+
+        Args:
+            message (bytes): the packed message to be sent
+        Returns:
+            bool: False if the message was dropped, True otherwise
+        """
+        if not message:
+            return True
+        if self.spill is not None:
+            self.spill.write(message)
+            self.spilled_bytes += len(message)
+            return True
+        if self.drop_chat and message[0] == 0x81:
+            self.dropped_messages += 1
+            return False
+        self.write_queue.append(message)
+        self.pending_bytes += len(message)
+        return True
+
+    def drop_queued_chat(self):
+        """ Drops every queued chat message except the one at the head of the queue, which may already be 
+        partially sent.
+
+        Args:
+            None
+        Returns:
+            int: the number of messages dropped
+        """
+        queue = self.write_queue
+        kept = deque(islice(queue, 1))
+        dropped = 0
+        for chunk in islice(queue, 1, None):
+            if chunk[0] == 0x81:
+                dropped += 1
+                self.pending_bytes -= len(chunk)
+            else:
+                kept.append(chunk)
+        self.write_queue = kept
+        self.dropped_messages += dropped
+        return dropped
+
+    def spill_queued(self, spill):
+        """ Starts diverting output to a spill file and moves everything queued behind the head of the queue 
+        (which may already be partially sent) to it.
+
+        Args:
+            spill (SpillFile): the file to spill to
+        Returns:
+            int: the number of bytes moved to the spill file
+        """
+        self.spill = spill
+        queue = self.write_queue
+        moved = 0
+        for chunk in islice(queue, 1, None):
+            spill.write(chunk)
+            moved += len(chunk)
+        self.write_queue = deque(islice(queue, 1))
+        self.pending_bytes -= moved
+        self.spilled_bytes += moved
+        return moved
+
+    def refill_from_spill(self, limit):
+        """ Moves up to limit bytes from the spill file back to the write queue.
+
+        Args:
+            limit (int): the maximum number of bytes to move
+        Returns:
+            int: the number of bytes moved
+        """
+        data = self.spill.read(limit)
+        if data:
+            self.write_queue.append(data)
+            self.pending_bytes += len(data)
+        return len(data)
+
+    def batch_queued(self, source_id, start=0):
+        """ Packs every run of two or more small messages queued from index start on into a batch message. 
+        Messages that cannot be batched stay where they are, so the order of the queue is preserved.
+
+        Args:
+            source_id (int): the ID of the server sending the batches
+            start (int): the index of the first chunk that may be batched, which is 1 if the head of the queue 
+                may already be partially sent
+        Returns:
+            tuple: the number of batch messages created and the number of messages packed into them
+        """
+        queue = self.write_queue
+        if len(queue) - start < 2:
+            return 0, 0
+
+        packed = deque(islice(queue, start))
+        batch_sizes = []
+        run = []
+        run_bytes = 0
+        # An empty chunk ends the last run
+        for chunk in chain(islice(queue, start, None), (b'',)):
+            length = len(chunk)
+            if length and length <= BATCH_MESSAGE_LIMIT and chunk[0] in BATCHED_MESSAGE_TYPES:
+                if run_bytes + length <= MAX_BATCH_BYTES:
+                    run.append(chunk)
+                    run_bytes += length
+                    continue
+                batchable = True
+            else:
+                batchable = False
+            if len(run) > 1:
+                packed.append(BatchMessage.bytes(source_id, run))
+                batch_sizes.append(len(run))
+            elif run:
+                packed.append(run[0])
+            if batchable:
+                run = [chunk]
+                run_bytes = length
+            else:
+                run = []
+                run_bytes = 0
+                if length:
+                    packed.append(chunk)
+
+        if not batch_sizes:
+            return 0, 0
+        self.write_queue = packed
+        # Every batch adds a header and a length table entry per message
+        messages = sum(batch_sizes)
+        self.pending_bytes += len(batch_sizes) * BATCH_HEADER.size + messages * BATCH_LENGTH.size
+        return len(batch_sizes), messages
+
+    def compress_queued(self, start=0, threshold=0):
+        """ Compresses the messages queued from index start on into CompressedMessages, if there are at least 
+        threshold bytes of them.
+
+        Args:
+            start (int): the index of the first chunk that may be compressed, which is 1 if the head of the queue
+                may already be partially sent
+            threshold (int): the minimum number of bytes worth compressing
+        Returns:
+            tuple: the number of bytes compressed and the number of bytes they were compressed to
+        """
+        queue = self.write_queue
+        size = self.pending_bytes - (len(queue[0]) if start and queue else 0)
+        if len(queue) <= start or size < threshold:
+            return 0, 0
+
+        compressed = deque(islice(queue, start))
+        run = []
+        run_bytes = 0
+        for chunk in islice(queue, start, None):
+            if run and run_bytes + len(chunk) > MAX_COMPRESSED_INPUT:
+                compressed.append(self.compressor.compress(run))
+                run = []
+                run_bytes = 0
+            if len(chunk) > MAX_COMPRESSED_INPUT:
+                # Too large for the receiving server to decompress, so it is sent as it is
+                compressed.append(chunk)
+                continue
+            run.append(chunk)
+            run_bytes += len(chunk)
+        if run:
+            compressed.append(self.compressor.compress(run))
+
+        compressed_size = sum(len(chunk) for chunk in islice(compressed, start, None))
+        self.write_queue = compressed
+        self.pending_bytes += compressed_size - size
+        return size, compressed_size
+
+    def take_over(self, other):
+        """ Takes over the socket and the per-connection state of another connection data object, e.g. when a
+        BaseConnectionData is replaced by a ServerConnectionData after registration. Everything queued on the
+        other object is moved in front of this object's own queue, so nothing is lost or sent twice.
+
+        Args:
+            other (BaseConnectionData): the connection data object that is being replaced
+        Returns:
+            None
+        """
+        self.sock = other.sock
+        if self.write_queue:
+            other.write_queue.extend(self.write_queue)
+        self.write_queue, other.write_queue = other.write_queue, deque()
+        self.pending_bytes += other.pending_bytes
+        other.pending_bytes = 0
+        self.decoder = other.decoder
+        self.inbox, other.inbox = other.inbox, deque()
+        self.inbox_bytes, other.inbox_bytes = other.inbox_bytes, 0
+        self.io_device = other.io_device
+        self.read_throttled = other.read_throttled
+        self.paused_upstreams, other.paused_upstreams = other.paused_upstreams, []
+        self.capabilities, other.capabilities = other.capabilities, NO_CAPABILITIES
+        self.compressor, other.compressor = other.compressor, None
+        self.decompressor, other.decompressor = other.decompressor, None
+        self.sent_registration = other.sent_registration
+        if other.congestion_timer:
+            # The server recomputes the congestion state of the new object once it is attached
+            other.congestion_timer.cancel()
+
+    def send_pending(self):
+        """ Sends as much of the write queue as the socket accepts with a single system call and drops 
+        whatever was sent from the queue.
+
+        Args:
+            None
+        Returns:
+            tuple: the number of bytes sent and the number of queued chunks that were completely sent
+        """
+        queue = self.write_queue
+        if not queue:
+            return 0, 0
+
+        try:
+            if len(queue) == 1 or not hasattr(self.sock, 'sendmsg'):
+                sent = self.sock.send(queue[0])
+            else:
+                sent = self.sock.sendmsg(list(islice(queue, MAX_SEND_BUFFERS)))
+        except (BlockingIOError, InterruptedError):
+            return 0, 0
+
+        self.pending_bytes -= sent
+        remaining = sent
+        completed = 0
+        while remaining:
+            chunk = queue[0]
+            if remaining >= len(chunk):
+                remaining -= len(chunk)
+                queue.popleft()
+                completed += 1
+            else:
+                queue[0] = memoryview(chunk)[remaining:]
+                remaining = 0
+        return sent, completed
+
+class WakeupChannel():
+    """ A WakeupChannel lets other threads hand work to a server's event loop. Callbacks are appended to an 
+    inbox and the loop is woken up by making a file descriptor that is registered with its selector readable: 
+    an eventfd where the platform supports it and one end of a socket pair (the self-pipe trick) otherwise. The
+    channel is only signalled once until the loop drains it, so a burst of submissions costs one system call.
+
+    The channel itself is registered with the selector as both the file object and the data of its key.
+    """
+    def __init__(self):
+        self.inbox = deque()                # (callback, args) tuples waiting to be run by the event loop
+        self.signalled = False              # Whether a wake up is pending that the loop has not drained yet
+        if hasattr(os, 'eventfd'):
+            self.read_fd = self.write_fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+            self.sockets = ()
+        else:
+            self.sockets = socketpair()
+            for sock in self.sockets:
+                sock.setblocking(False)
+            self.read_fd, self.write_fd = (sock.fileno() for sock in self.sockets)
+
+    def fileno(self):
+        return self.read_fd
+
+    def signal(self):
+        """ Wakes up the event loop. May be called from any thread.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        if not self.signalled:
+            self.signalled = True
+            try:
+                os.write(self.write_fd, WAKEUP_INCREMENT)
+            except (BlockingIOError, OSError):
+                # The loop has not drained earlier wake ups yet (or is shutting down), so it is awake anyway
+                pass
+
+    def call_soon_threadsafe(self, callback, *args):
+        """ Schedules callback(*args) to be called by the event loop. May be called from any thread.
+
+        Args:
+            callback (callable): the function to call
+            args: the arguments to call it with
+        Returns:
+            None
+        """
+        self.inbox.append((callback, args))
+        self.signal()
+
+    def run_pending(self):
+        """ Drains the wake up and runs every callback in the inbox. Called by the event loop when the channel
+        becomes readable.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        try:
+            os.read(self.read_fd, 4096)
+        except (BlockingIOError, InterruptedError):
+            pass
+        # Clear the flag before draining the inbox, so anything submitted from now on signals again
+        self.signalled = False
+        inbox = self.inbox
+        while inbox:
+            callback, args = inbox.popleft()
+            callback(*args)
+
+    def close(self):
+        # Never write to the file descriptors once they are closed, they may be reused by then
+        self.signalled = True
+        if self.sockets:
+            for sock in self.sockets:
+                sock.close()
+        else:
+            os.close(self.read_fd)
+
+class SpillFile():
+    """ A SpillFile is a temporary file that buffers the output of a slow consumer on disk instead of in 
+    memory. Data is read back in the order it was written.
+    """
+    def __init__(self, directory=None):
+        self.file = tempfile.TemporaryFile(dir=directory)
+        self.read_offset = 0
+        self.write_offset = 0
+
+    def __len__(self):
+        return self.write_offset - self.read_offset
+
+    def write(self, data):
+        self.file.seek(self.write_offset)
+        self.file.write(data)
+        self.write_offset += len(data)
+
+    def read(self, limit):
+        self.file.seek(self.read_offset)
+        data = self.file.read(min(limit, len(self)))
+        self.read_offset += len(data)
+        if self.read_offset == self.write_offset:
+            # Everything has been read back, start over at the beginning of the file
+            self.file.truncate(0)
+            self.read_offset = self.write_offset = 0
+        return data
+
+    def close(self):
+        self.file.close()
+
+class Timer():
+    """ A Timer is a callback scheduled with CRCServer.call_later(). Cancelled timers stay in the server's 
+    heap of timers but are skipped once they are due.
+    """
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+    def cancel(self):
+        self.cancelled = True
+
+class AdjacentIds():
+    """ AdjacentIds is an insertion-ordered set of host IDs, which is what CRCServer.adjacent_server_ids and 
+    adjacent_user_ids used to be lists of. The IDs are the keys of a dictionary, so membership tests, append() 
+    and remove() take constant time instead of scanning the list, and an ID is never listed twice. It supports 
+    the list operations the server and the tests use (iteration, len(), in, == with lists, append(), extend(), 
+    remove() and clear()) and nothing positional: an index would not survive the removal of an ID anyway.
+    """
+    __slots__ = ('ids',)
+
+    def __init__(self, ids=()):
+        self.ids = dict.fromkeys(ids)
+
+    def __contains__(self, host_id):
+        return host_id in self.ids
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, host_id):
+        self.ids[host_id] = None
+
+    def extend(self, host_ids):
+        self.ids.update(dict.fromkeys(host_ids))
+
+    def remove(self, host_id):
+        try:
+            del self.ids[host_id]
+        except KeyError:
+            raise ValueError("%r is not adjacent" % (host_id,)) from None
+
+    def discard(self, host_id):
+        self.ids.pop(host_id, None)
+
+    def clear(self):
+        self.ids.clear()
+
+    def __eq__(self, other):
+        if isinstance(other, (AdjacentIds, list, tuple)):
+            return list(self.ids) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self.ids))
+
+class FloodWindow():
+    """ FloodWindow remembers which of the messages flooded by one mesh server a server has handled, so the 
+    copies that reach it over other links can be dropped (see CRCServer.handle_flood_message). It keeps the 
+    highest sequence number seen and the numbers seen within FLOOD_WINDOW below it, since messages flooded close
+    together can arrive out of order over different paths. Anything older is taken as seen.
+    """
+    __slots__ = ('highest', 'seen')
+
     def __init__(self):
-        self.write_buffer = b''
+        self.highest = 0
+        self.seen = set()
+
+    def add(self, seq):
+        """ Records a sequence number and returns whether it had not been seen before """
+        if seq > self.highest:
+            self.highest = seq
+            self.seen.add(seq)
+            if len(self.seen) > 2 * FLOOD_WINDOW:
+                oldest = seq - FLOOD_WINDOW
+                self.seen = {seen for seen in self.seen if seen > oldest}
+            return True
+        if seq <= self.highest - FLOOD_WINDOW or seq in self.seen:
+            return False
+        self.seen.add(seq)
+        return True
+
+class PresenceAggregator():
+    """ PresenceAggregator collects the client registration and quit messages a server broadcasts during its 
+    presence window, in the order they were handled, so they can be sent together once the window closes (see
+    CRCServer.flush_presence). A quit cancels the pending registration of the same client, since the rest of the
+    network never heard of it, and a registration cancels the pending quit of a client that comes back the way 
+    it left (with the same registration over the same link), since nothing changed for anybody else.
+    """
+    __slots__ = ('pending', 'timer')
+
+    def __init__(self):
+        self.pending = {}   # (Message type, host ID) to the message, the host's first link and its registration
+        self.timer = None   # Closes the presence window
+
+    def __len__(self):
+        return len(self.pending)
+
+    def joining(self, host_id):
+        """ Returns whether the registration of host_id is pending """
+        return (0x80, host_id) in self.pending
+
+    def add(self, host, message):
+        """ Adds the registration or quit message of a host, unless it cancels the pending message of the host,
+        and returns whether it was added """
+        pending = self.pending
+        if message[0] == 0x82:
+            if pending.pop((0x80, host.id), None) is not None:
+                return False
+        else:
+            quit = pending.get((0x82, host.id))
+            if quit is not None and quit[1] == host.first_link_id and quit[2] == host.registration:
+                del pending[(0x82, host.id)]
+                return False
+        pending[(message[0], host.id)] = (message, host.first_link_id, host.registration)
+        return True
+
+    def take(self):
+        """ Removes the pending messages and returns them as (host ID, message, first link ID) tuples, in order """
+        entries = [(host_id, message, link_id) for (_, host_id), (message, link_id, _) in self.pending.items()]
+        self.pending.clear()
+        return entries
 
 class ServerConnectionData(BaseConnectionData):
     """ ServerConnectionData encapsulates data associated with a connection to another server. It derives from 
-    BaseConnectionData which means it contains a write buffer, in addition to additional properties defined 
+    BaseConnectionData which means it contains a write queue, in addition to additional properties defined 
     in this class that are specific to connections with other servers.
+
+    The server's registration message is kept in its encoded form, with this server as its last hop, so it can
+    be sent to new adjacent servers as it is (see CRCServer.queue_messages). If the link to an adjacent server 
+    replaces the link to a server that left, it keeps that server's ID (see 
+    CRCServer.handle_handover_registration). In a mesh, a host learned from a flooded message keeps the ID of 
+    the mesh server that flooded it, which its route follows (see CRCServer.compute_mesh_routes).
     """    
+    __slots__ = ('id', 'server_name', 'server_info', 'first_link_id', 'registration', 'pending_sync', 'replaces',
+                 'home_id')
+    connection_class = 'server'
+
     def __init__(self, id, server_name, server_info):
-        super(ServerConnectionData, self).__init__()
+        super(ServerConnectionData, self).__init__(buffers=False)
         self.id = id
         self.server_name = server_name     # Stores the name of the server
         self.server_info = server_info     # Stores a human-readable description of the server
         self.first_link_id = None          # The ID of the first host on the path to this server
+        self.registration = None           # The encoded registration message forwarded for this server
+        self.pending_sync = None           # The hosts and timer of a full-state sync waiting for capabilities
+        self.replaces = None               # The ID of the departed server this link took over from
+        self.home_id = None                # The ID of the mesh server this server is reached through
 
 class ClientConnectionData(BaseConnectionData):    
     """ ClientConnectionData encapsulates data associated with a connection to a client application. It 
-    derives from BaseConnectionData which means it contains a write buffer, in addition to additional 
+    derives from BaseConnectionData which means it contains a write queue, in addition to additional 
     properties defined in this class that are specific to connections with client applications.
+
+    Like ServerConnectionData, it keeps the client's registration message in its forwarded form and the ID of 
+    the mesh server it is reached through.
     """
+    __slots__ = ('id', 'client_name', 'client_info', 'first_link_id', 'registration', 'home_id')
+    connection_class = 'client'
+
     def __init__(self, id, client_name, client_info):
-        super(ClientConnectionData, self).__init__()
+        super(ClientConnectionData, self).__init__(buffers=False)
         self.id = id
         self.client_name = client_name      # Stores the name of the client
         self.client_info = client_info      # Stores a human-readable description of the client
         self.first_link_id = None           # The ID of the first host on the path to this client
+        self.registration = None            # The encoded registration message forwarded for this client
+        self.home_id = None                 # The ID of the mesh server this client is reached through
 
 ##############################################################################################################
 
@@ -55,10 +692,11 @@ class CRCServer(object):
             servers and clients that this server knows about. The key should be the remote machine's ID and 
             the value should be its corresponding ServerConnectionData or ClientConnectionData that you create
             when processing the remote machine's Registration Message.
-        * self.adjacent_server_ids (list): this list should store the IDs of all adjacent servers. You can use
-            this list to find the appropriate ServerConnectionData objects stored in self.hosts_db when needed
-        * self.adjacent_client_ids (list): this list should store the IDs of all adjacent clients. It serves
-            the same purpose as self.adjacent_server_ids except for client machines.
+        * self.adjacent_server_ids (AdjacentIds): this list should store the IDs of all adjacent servers. You 
+            can use this list to find the appropriate ServerConnectionData objects stored in self.hosts_db when 
+            needed. It is an AdjacentIds, an ordered set that behaves like a list.
+        * self.adjacent_user_ids (AdjacentIds): this list should store the IDs of all adjacent clients. It 
+            serves the same purpose as self.adjacent_server_ids except for client machines.
         * self.status_updates_log (list): the message of any status updates addressed to this server should be
             placed in this list. This is purely for the purpose of grading.
         * self.id (int): the ID of this server. It is initialized upon class instantiation.
@@ -74,7 +712,8 @@ class CRCServer(object):
             startup. If this is empty then this server is the first server to come online and does not need to
             connect to any other servers on startup.
         * self.request_terminate (bool): a flag used by the testing application to indicate whether your code
-            should continue running or shutdown. You should NOT change the value of this variable in your code
+            should continue running or shutdown. You should NOT change the value of this variable in your code.
+            Setting it wakes up the event loop, so the server shuts down immediately.
                 
         Args:
             options (Options): an object containing various properties used to configure the server
@@ -87,12 +726,183 @@ class CRCServer(object):
         # Create selector for non-blocking I/O
         self.sel = selectors.DefaultSelector()
 
+        # Lets other threads wake up the event loop (to terminate it or to run submitted work), so select() 
+        # can block until something happens instead of polling
+        self.wakeup = WakeupChannel()
+        self.sel.register(self.wakeup, selectors.EVENT_READ, self.wakeup)
+
         # Network state tracking
         self.hosts_db = {}
-        self.adjacent_server_ids = []
-        self.adjacent_user_ids = []
+        self.adjacent_server_ids = AdjacentIds()
+        self.adjacent_user_ids = AdjacentIds()
         self.status_updates_log = []
 
+        # Routing table mapping the ID of every known host to the adjacent host messages for it are written to,
+        # with a reverse index of the hosts reached through every adjacent host (see RouteTable). Every 
+        # forwarded message is resolved through it (see self.get_outbound_connection). It is kept in step with
+        # the first_link_id of the hosts in hosts_db by self.route_host(), self.unroute_host() and 
+        # self.reroute_hosts(). Its links are the routing index mapping the ID of every adjacent host to the
+        # connection data object registered with the selector for its socket, which self.adjacent_connections is
+        # a read-only view of: adjacent hosts are added and removed with self.routes.add_link() and remove_link().
+        self.routes = RouteTable()
+        self.adjacent_connections = MappingProxyType(self.routes.links)
+
+        # Preallocated buffers that sockets are read into with recv_into(), so reads do not allocate
+        self.recv_buffers = ReceiveBufferPool(RECV_BUFFER_SIZE)
+
+        # Heap of Timers scheduled with self.call_later()
+        self.timers = []
+
+        # Fair read scheduling. Received messages are not handled while reading; they are queued in the 
+        # connection's inbox and dispatched once all ready sockets have been read. Every connection with 
+        # pending messages gets one turn per iteration of the event loop, in round robin order, in which at 
+        # most read_budget_messages messages or read_budget_bytes bytes of messages are dispatched. Messages 
+        # left over are carried over to the connection's next turn, and the connection is not read from until 
+        # they have been dispatched, so a busy server link cannot hold up the clients' chat messages. The time 
+        # every message waited to be dispatched is sampled per connection class (see 
+        # self.dispatch_latency_percentiles).
+        self.read_budget_messages = getattr(options, 'read_budget_messages', None) or DEFAULT_READ_BUDGET_MESSAGES
+        self.read_budget_bytes = getattr(options, 'read_budget_bytes', None) or DEFAULT_READ_BUDGET_BYTES
+        self.ready_connections = deque()
+        self.dispatch_latencies = {connection_class: deque(maxlen=LATENCY_SAMPLE_COUNT) 
+                                   for connection_class in ('client', 'server', 'unregistered')}
+
+        # Backpressure. A connection with more than write_high_watermark bytes queued is congested until less 
+        # than write_low_watermark bytes are queued. Reading from a connection is paused while messages it sent 
+        # are waiting on a congested connection, and a connection that stays congested for slow_consumer_timeout
+        # seconds is treated as a slow consumer according to slow_consumer_policy: 'drop_chat' drops the chat 
+        # messages queued for it, 'disconnect' closes it and 'spill' buffers its output in a file in 
+        # spill_directory. Either way the connections paused on its account resume reading.
+        self.write_high_watermark = getattr(options, 'write_high_watermark', None) or DEFAULT_WRITE_HIGH_WATERMARK
+        self.write_low_watermark = getattr(options, 'write_low_watermark', None) or DEFAULT_WRITE_LOW_WATERMARK
+        self.slow_consumer_timeout = getattr(options, 'slow_consumer_timeout', None) or DEFAULT_SLOW_CONSUMER_TIMEOUT
+        self.slow_consumer_policy = getattr(options, 'slow_consumer_policy', None) or 'drop_chat'
+        self.spill_directory = getattr(options, 'spill_directory', None)
+        if self.slow_consumer_policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError("Unknown slow consumer policy: %s" % self.slow_consumer_policy)
+
+        # Congested connections messages were queued on while handling the current read
+        self.congested_downstreams = set()
+
+        # Server wide backpressure counters (congestion_events, paused_reads, slow_consumers, 
+        # disconnected_slow_consumers, dropped_messages and spilled_bytes)
+        self.backpressure_counters = Counter()
+
+        # Output is not sent as soon as it is queued. Every connection that had messages queued on it during an
+        # iteration of the event loop is flushed with a single send once all ready sockets have been handled, 
+        # and is only registered for EVENT_WRITE if the socket could not take all of it. Since the server does
+        # its own coalescing, Nagle's algorithm is disabled (tcp_nodelay); tcp_cork additionally corks the 
+        # socket around every flush (Linux only).
+        self.connections_to_flush = []
+        self.deferred_flushes = 0
+        self.tcp_nodelay = getattr(options, 'tcp_nodelay', True)
+        self.tcp_cork = getattr(options, 'tcp_cork', False) and hasattr(socket_module, 'TCP_CORK')
+
+        # Write path counters (send_calls, messages_sent, bytes_sent, selector_updates, batches and 
+        # batched_messages), see self.messages_per_send_call()
+        self.write_counters = Counter()
+
+        # Whether runs of messages queued on a server link are sent as batch messages (see self.batch_output). 
+        # Batches are only sent to servers that announced they accept them
+        self.batch_server_links = getattr(options, 'batch_server_links', True)
+
+        # Link compression. compression lists the codecs (see COMPRESSION_CODECS) this server is willing to 
+        # compress the output of its server links with, in order of preference, either as a list or as a comma
+        # separated string. Compression is disabled if it is empty. A link is only compressed if the server at 
+        # the other end announced it accepts one of them, and only flushes of at least compression_threshold
+        # bytes are compressed. compression_level is passed on to the codec. The compression counters count the
+        # bytes_in compressed to bytes_out and the bytes_received that were decompressed to bytes_decompressed.
+        compression = getattr(options, 'compression', None) or ()
+        if isinstance(compression, str):
+            compression = [codec.strip() for codec in compression.split(',') if codec.strip()]
+        for codec in compression:
+            if codec not in COMPRESSION_CODECS:
+                raise ValueError("Unknown compression codec: %s" % codec)
+        self.compression = [COMPRESSION_CODECS[codec] for codec in compression]
+        self.compression_threshold = getattr(options, 'compression_threshold', None) or DEFAULT_COMPRESSION_THRESHOLD
+        self.compression_level = getattr(options, 'compression_level', None)
+        self.compression_counters = Counter()
+
+        # Capability negotiation. Unless announce_capabilities is False, this server announces the optional 
+        # protocol features it supports to every server it links up with, and to every client that announces 
+        # its own (see self.handle_capability_announcement). A feature is only used on a connection once the 
+        # host at the other end has announced it.
+        self.announce_capabilities = getattr(options, 'announce_capabilities', True)
+        self.capabilities = {
+            'batch': (),                            # Accepts batch messages
+            'compress': tuple(COMPRESSION_CODECS),  # Accepts compressed messages in these codecs
+            'failover': (),                         # Handles server quit messages (see self.depart)
+        }
+
+        # Adjacent servers that left with a replacement, mapping their IDs to their connection data objects, the
+        # IDs of their replacements and the timers that remove the hosts left over (see 
+        # self.handle_server_quit_message). The hosts that have not been reached through another link yet are 
+        # still routed through the departed server in self.routes.
+        self.departed = {}
+
+        # Registrations of hosts that reconnected before the server they were adjacent to left, mapping the ID of
+        # that server to the connections holding them and the timer that rejects them (see 
+        # self.hold_handover_registration), and the connections whose held registration was rejected
+        self.held_handovers = {}
+        self.expired_handovers = set()
+
+        # Whether new adjacent servers that accept them are sent the roster as roster snapshots instead of one 
+        # registration message per host (see self.send_full_state), and whether this server accepts them
+        self.roster_snapshots = getattr(options, 'roster_snapshots', True)
+        if self.roster_snapshots:
+            self.capabilities['snapshot'] = ()      # Accepts roster snapshots
+
+        # How long the full-state sync of a new adjacent server waits for its capability announcement before it 
+        # is sent as registration messages (see self.send_pending_sync), and whether this server announces its 
+        # capabilities right behind the registration it sends to the server it connects to. Otherwise it only 
+        # announces them once that server has replied, since the assignment's connectivity tests expect a 
+        # connecting server to send nothing but its registration until then.
+        self.capability_timeout = getattr(options, 'capability_timeout', None) or DEFAULT_CAPABILITY_TIMEOUT
+        self.announce_on_connect = getattr(options, 'announce_on_connect', False)
+
+        # Mesh topologies. Without mesh, the servers must form a tree: a server registering with an ID that is
+        # already known is a duplicate. With mesh, a server may also link up with mesh servers it already 
+        # reaches through another path, and connects to every address in mesh_peers (a list of (host, port) 
+        # tuples or a comma separated string of "host:port") on startup. Registrations and quits are flooded 
+        # between mesh servers with per server sequence numbers, and copies that arrive over other links are
+        # dropped (see self.handle_flood_message). The mesh servers also flood the IDs of their mesh neighbours
+        # (self.link_states maps every mesh server's ID to the sequence number and neighbours of its latest 
+        # link state), and every host is routed over the first hop of a shortest path to the mesh server it 
+        # was flooded by (see self.compute_mesh_routes), so a failed link only reroutes the hosts behind it as 
+        # long as they are reachable through another one. The mesh counters count floods_sent, 
+        # floods_forwarded, duplicate_floods, link_states and route_updates.
+        self.mesh = getattr(options, 'mesh', False)
+        mesh_peers = getattr(options, 'mesh_peers', None) or ()
+        if isinstance(mesh_peers, str):
+            mesh_peers = [peer.strip().rpartition(':') for peer in mesh_peers.split(',') if peer.strip()]
+            mesh_peers = [(host, int(port)) for host, _, port in mesh_peers]
+        self.mesh_peers = list(mesh_peers)
+        if self.mesh:
+            self.capabilities['mesh'] = ()          # Accepts flooded messages and link states
+        self.link_states = {}
+        self.link_state_seq = 0
+        self.flood_seq = 0
+        self.flood_windows = {}                     # Mesh server IDs to FloodWindows
+        self.mesh_next_hops = {}                    # Mesh server IDs to the adjacent server on a shortest path
+        self.mesh_homes = {}                        # Mesh server IDs to the IDs of the hosts flooded by them
+        self.current_flood = None                   # The flooded message being handled and the link it came in
+        self.mesh_counters = Counter()
+
+        # Presence coalescing. With a presence_window of some seconds, the client registration and quit
+        # messages this server would broadcast (its own clients' and those it forwards) are collected for that
+        # long and then sent together (see self.flush_presence): adjacent servers that accept batch messages
+        # are sent them packed into batch messages, a client that quits within the window it registered in is
+        # never announced, and neither is a client that quits and registers again the same way. Anything
+        # handled in the meantime that may depend on the collected messages (e.g. a chat message from a client
+        # that just registered, or a new adjacent server) sends them first. Registrations and quits flooded
+        # through a mesh are forwarded right away. Without a window (the default) every message is broadcast
+        # as it is handled. The presence counters count the joins and quits collected, the messages cancelled,
+        # the flushes, the batches sent and the frames_saved, the messages adjacent hosts were not sent as
+        # frames of their own.
+        self.presence_window = getattr(options, 'presence_window', None) or 0
+        self.presence = PresenceAggregator()
+        self.presence_counters = Counter()
+
         # Server configuration from options
         self.id = options.id
         self.server_name = options.servername
@@ -113,6 +923,17 @@ class CRCServer(object):
             0x80: self.handle_client_registration_message,
             0x81: self.handle_client_chat_message,
             0x82: self.handle_client_quit_message,
+            0x02: self.handle_server_quit_message,
+            0x05: self.handle_roster_snapshot_message,
+            0x06: self.handle_link_state_message,
+            0x07: self.handle_flood_message,
+        }
+
+        # Fast paths for messages that are forwarded as they are, which are queued on the next hop's connection
+        # straight from the received data without being parsed (see self.dispatch_messages)
+        self.relay_handlers = {
+            0x01: self.relay_status_message,
+            0x81: self.relay_client_chat_message,
         }
 
         self.log_file = options.log_file
@@ -142,6 +963,86 @@ class CRCServer(object):
         # Begin listening for connections on the server socket
         self.check_IO_devices_for_messages()
         
+    @property
+    def request_terminate(self):
+        return self._request_terminate
+
+    @request_terminate.setter
+    def request_terminate(self, value):
+        self._request_terminate = value
+        if value:
+            self.wake_up()
+
+    def wake_up(self):
+        """ This function interrupts the select() call of the event loop. It may be called from any thread.
+
+        Args:
+            None
+        Returns:
+            None        
+        """
+        self.wakeup.signal()
+
+    def call_soon_threadsafe(self, callback, *args):
+        """ This function schedules callback(*args) to be called by the thread running the event loop. It may 
+        be called from any thread and is the only safe way to touch the server's state from another thread.
+
+        Args:
+            callback (callable): the function to call
+            args: the arguments to call it with
+        Returns:
+            None        
+        """
+        self.wakeup.call_soon_threadsafe(callback, *args)
+
+    def submit(self, destination_id, message):
+        """ This function sends a message to a host from any thread. The message is handed to the event loop,
+        which routes it like any other message to destination_id.
+
+        Args:
+            destination_id (int): the ID of the destination machine
+            message (bytes): the packed message to be delivered
+        Returns:
+            None        
+        """
+        self.call_soon_threadsafe(self.send_message_to_host, destination_id, message)
+
+    def call_later(self, delay, callback, *args):
+        """ This function schedules callback(*args) to be called by the event loop after delay seconds. It must 
+        be called from the thread running the event loop.
+
+        Args:
+            delay (float): the number of seconds to wait
+            callback (callable): the function to call
+            args: the arguments to call it with
+        Returns:
+            Timer: a timer that can be cancelled with its cancel() method
+        """
+        timer = Timer(time.monotonic() + delay, callback, args)
+        heappush(self.timers, timer)
+        return timer
+
+    def run_timers(self):
+        """ This function calls every timer that is due.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        timers = self.timers
+        now = time.monotonic()
+        while timers and timers[0].deadline <= now:
+            timer = heappop(timers)
+            if not timer.cancelled:
+                timer.callback(*timer.args)
+
+    def next_timer_timeout(self):
+        """ Returns the number of seconds until the next timer is due, or None if there are no timers. """
+        if self.timers:
+            return max(0, self.timers[0].deadline - time.monotonic())
+        return None
+
 ##############################################################################################################
 
     def setup_server_socket(self):
@@ -176,7 +1077,8 @@ class CRCServer(object):
     def connect_to_server(self):
         """ This function is responsible for connecting to a remote CRC server upon starting this server. Each
         new CRC Server (except for the first one) registers with an existing server on start up. That server 
-        is its entry point into the existing CRC server network.
+        is its entry point into the existing CRC server network. A mesh server then links up with its mesh 
+        peers as well (see self.connect_to_mesh_peer).
 
         NOTE: Even though you know this is a server, it's best to use a BaseConnectionData object for the data
             parameter to be consistent with how other connections are added. That will get modified when you 
@@ -195,15 +1097,37 @@ class CRCServer(object):
         
         # Make socket non-blocking and register with selector
         client_socket.setblocking(False)
-        connection_data = BaseConnectionData()
-        self.sel.register(client_socket, selectors.EVENT_READ | selectors.EVENT_WRITE, connection_data)
+        connection_data = self.register_connection(client_socket)
         
         # Send server registration message with last_hop_id=0 (initial registration)
-        reg_msg = ServerRegistrationMessage.bytes(self.id, 0, self.server_name, self.server_info)
-        connection_data.write_buffer += reg_msg
+        self.send_registration(connection_data, announce=self.announce_on_connect)
         
         self.print_info("Connected to another server")
 
+        if self.mesh:
+            for address in self.mesh_peers:
+                self.connect_to_mesh_peer(address)
+
+    def connect_to_mesh_peer(self, address):
+        """ This function opens a redundant link to another mesh server and registers with it, the same way 
+        self.connect_to_server() does. A peer that cannot be reached is skipped; it can link up with this 
+        server when it starts.
+
+        Args:
+            address (tuple): the (host, port) the peer listens on
+        Returns:
+            None        
+        """
+        self.print_info("Connecting to mesh peer %s:%i..." % address)
+        try:
+            peer_socket = socket(AF_INET, SOCK_STREAM)
+            peer_socket.connect(address)
+        except OSError as error:
+            self.print_info("Could not reach mesh peer %s:%i: %s" % (address + (error,)))
+            return
+        peer_socket.setblocking(False)
+        self.send_registration(self.register_connection(peer_socket), announce=self.announce_on_connect)
+
     def check_IO_devices_for_messages(self):
         """ This function manages the main loop responsible for processing input and output on all sockets 
         this server is connected to. This is accomplished in a nonblocking manner using the selector created 
@@ -212,8 +1136,15 @@ class CRCServer(object):
         NOTE: All calls to select() MUST be inside the while loop. Select() is itself a blocking call and we 
             need to be able to terminate the server to test its functionality. The server may not be able to  
             shut down if calls to select() are made outside of the loop since those calls can block.
-        NOTE: Pass a short timeout value into your select() call (e.g. 0.1 seconds) to prevent your code from 
-            hanging when it is time to terminate it
+        NOTE: select() blocks until a socket is ready or the next timer is due. Setting self.request_terminate or 
+            calling self.submit() from another thread makes self.wakeup readable, which wakes the loop up 
+            right away
+        NOTE: Received messages are handled in a dispatch phase after all ready sockets have been read, which
+            gives every connection a budgeted turn (see self.dispatch_ready_connections)
+        NOTE: Output is sent in a flush phase with one send per socket before the loop blocks in select() again
+            (see self.select_events and self.flush_connections)
+        NOTE: Sockets are only registered for EVENT_WRITE while they have pending output (see 
+            self.queue_message), so an idle server sleeps in select() instead of spinning on writable sockets
 
         Args:
             None
@@ -223,16 +1154,25 @@ class CRCServer(object):
         self.print_info("Listening for new connections on port " + str(self.port))
         
         while not self.request_terminate:
-            # Get ready sockets with timeout to allow termination
-            events = self.sel.select(timeout=0.1)
+            self.run_timers()
+
+            # Block until a socket is ready, the next timer is due or another thread wakes us up (after sending 
+            # everything that was queued since the last flush)
+            events = self.select_events()
             
             for key, mask in events:
                 if key.data is None:
                     # This is the server socket (listening socket)
                     self.accept_new_connection(key)
+                elif key.data is self.wakeup:
+                    # Another thread submitted work or asked us to terminate
+                    self.wakeup.run_pending()
                 else:
                     # This is a client/server connection socket
                     self.handle_io_device_events(key, mask)
+
+            # Hand the received messages to the message handlers
+            self.dispatch_ready_connections()
                     
         # Clean up when terminating
         self.cleanup()
@@ -261,6 +1201,10 @@ class CRCServer(object):
             except Exception:
                 # Skip any sockets that have already been closed
                 continue
+
+        # Sockets whose reading is paused and that have nothing to send are not registered with the selector
+        for connection in self.adjacent_connections.values():
+            connection.sock.close()
             
         # Close the selector
         self.sel.close()
@@ -274,89 +1218,1095 @@ class CRCServer(object):
             new client (you'll find that out when processing the registration message sent over the connected  
             socket). As such you don't know whether to use a ServerConncetionData or a ClientConnectionData  
             object when registering the socket with the selector. Instead, use a BaseConnectionData object so 
-            you have access to a write_buffer. We'll replace this with the appropriate object later when 
+            you have access to a write queue. We'll replace this with the appropriate object later when 
             handling the registration message.
 
         Args:
-            io_device (SelectorKey): 
+            io_device (SelectorKey): 
+        Returns:
+            None        
+        """
+        # Accept the connection
+        conn, addr = io_device.fileobj.accept()
+        conn.setblocking(False)
+        
+        # Register with selector using BaseConnectionData (we don't know if it's server or client yet)
+        self.register_connection(conn)
+
+    def register_connection(self, sock):
+        """ This function registers a newly connected socket with the selector for EVENT_READ. The socket is
+        associated with a BaseConnectionData object until the remote host has registered.
+
+        Args:
+            sock (socket): the connected, non-blocking socket
+        Returns:
+            BaseConnectionData: the data object associated with the socket
+        """
+        if self.tcp_nodelay:
+            sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+
+        connection_data = BaseConnectionData()
+        connection_data.sock = sock
+        self.sel.register(sock, selectors.EVENT_READ, connection_data)
+        return connection_data
+
+    def handle_io_device_events(self, io_device, event_mask):
+        """ This function is responsible for handling READ and WRITE events for a given IO device. Incomming  
+        messages will be read and passed to the appropriate message handler here and the write buffer  
+        associated with this socket will be sent over the socket here.
+
+        Args:
+            io_device (SelectorKey):
+            event_mask (int): 
+        Returns:
+            None        
+        """
+        # Handle READ events, unless messages received earlier are still waiting to be dispatched (the data is 
+        # then left in the socket's buffer until they have been)
+        if event_mask & selectors.EVENT_READ and not io_device.data.read_throttled:
+            buffer = self.recv_buffers.acquire()
+            try:
+                received = io_device.fileobj.recv_into(buffer)
+                if received:
+                    # We received data, queue the messages it completes. The decoder copies out anything it 
+                    # needs to keep, so the buffer can be reused right away.
+                    with memoryview(buffer) as view:
+                        self.handle_messages(io_device, view[:received])
+                else:
+                    # No data means connection was closed by peer
+                    self.close_connection(io_device)
+                    return
+            except ConnectionResetError:
+                # Handle connection reset
+                self.close_connection(io_device)
+                return
+            finally:
+                self.recv_buffers.release(buffer)
+                
+        # Handle WRITE events. Handling the read may have replaced the data object associated with this socket 
+        # (e.g. on registration), so look up the current one before sending.
+        if event_mask & selectors.EVENT_WRITE:
+            connection = self.current_connection(io_device)
+            if connection is not None and not connection.flush_scheduled:
+                self.flush_connection(connection)
+
+    def current_connection(self, io_device):
+        """ This function returns the data object currently associated with a socket, which is not 
+        io_device.data anymore if a message handler replaced it.
+
+        Args:
+            io_device (SelectorKey): the key the socket was selected with
+        Returns:
+            BaseConnectionData: the data object, or None if the socket is not registered anymore
+        """
+        try:
+            return self.sel.get_key(io_device.fileobj).data
+        except (KeyError, ValueError):
+            return None
+
+    def queue_message(self, connection, message):
+        """ This function appends a packed message to a connection's write queue and schedules the connection 
+        to be flushed at the end of the current iteration of the event loop (unless its socket is already 
+        waiting for EVENT_WRITE). All outgoing messages should be queued through this function.
+
+        Args:
+            connection (BaseConnectionData): the connection the message should be sent over
+            message (bytes): the packed message to be delivered
+        Returns:
+            None        
+        """
+        if self.enqueue(connection, message) and not connection.flush_scheduled and not connection.write_interest:
+            connection.flush_scheduled = True
+            self.connections_to_flush.append(connection)
+
+    def queue_messages(self, connections, messages):
+        """ This function queues a run of packed messages (e.g. the cached registration messages of a 
+        full-state sync) on every given connection. The messages are joined into a single chunk once, so the 
+        run costs one buffer of the scatter-gather send per connection no matter how many messages it holds. A 
+        run that is too small to be joined safely (batch_queued expects every chunk of at most 
+        BATCH_MESSAGE_LIMIT bytes to be a single message) is queued message by message.
+
+        Args:
+            connections (iterable): the connections the messages should be sent over
+            messages (iterable): the packed messages, in the order they should be sent
+        Returns:
+            None        
+        """
+        messages = list(messages)
+        data = b''.join(messages)
+        for connection in connections:
+            if len(data) > BATCH_MESSAGE_LIMIT:
+                self.queue_message(connection, data)
+            else:
+                for message in messages:
+                    self.queue_message(connection, message)
+
+    def select_events(self):
+        """ This function waits for the next batch of I/O events. If output is waiting to be flushed it first 
+        polls the selector without blocking: input that is already waiting (or messages carried over to 
+        another turn) is handled before flushing (up to MAX_DEFERRED_FLUSHES times in a row), so the output 
+        generated by several reads is sent with a single send per socket. Otherwise, or once nothing is 
+        waiting, the pending output is flushed and the selector blocks until the next event or timer.
+
+        Args:
+            None
+        Returns:
+            list: the (key, events) tuples returned by select()
+        """
+        if self.connections_to_flush:
+            events = self.sel.select(timeout=0)
+            if (events or self.ready_connections) and self.deferred_flushes < MAX_DEFERRED_FLUSHES:
+                self.deferred_flushes += 1
+                return events
+            self.flush_connections()
+            self.deferred_flushes = 0
+            if events:
+                return events
+        # Messages carried over to the next turn of their connection are dispatched without waiting
+        return self.sel.select(timeout=0 if self.ready_connections else self.next_timer_timeout())
+
+    def flush_connections(self):
+        """ This function is the flush phase of the event loop. It sends the output queued on every connection
+        during the current iteration, so a burst of messages to the same socket costs one system call.
+
+        Args:
+            None
+        Returns:
+            None        
+        """
+        connections, self.connections_to_flush = self.connections_to_flush, []
+        for connection in connections:
+            connection.flush_scheduled = False
+            if connection.sock.fileno() != -1:
+                self.flush_connection(connection)
+
+    def flush_connection(self, connection):
+        """ This function sends as much of a connection's write queue as possible in one scatter-gather call 
+        and registers the socket for EVENT_WRITE if anything is left.
+
+        Args:
+            connection (BaseConnectionData): the connection to send the queued output of
+        Returns:
+            None        
+        """
+        sock = connection.sock
+        # Whatever is left queued after a flush waits for EVENT_WRITE and its head may be partially sent
+        start = 1 if connection.write_interest else 0
+        self.batch_output(connection, start)
+        self.compress_output(connection, start)
+        try:
+            if self.tcp_cork:
+                sock.setsockopt(IPPROTO_TCP, socket_module.TCP_CORK, 1)
+            sent, completed = connection.send_pending()
+            if self.tcp_cork:
+                sock.setsockopt(IPPROTO_TCP, socket_module.TCP_CORK, 0)
+        except ConnectionError:
+            # Handle connection reset or broken pipe
+            self.disconnect(connection)
+            return
+
+        counters = self.write_counters
+        counters['send_calls'] += 1
+        counters['messages_sent'] += completed
+        counters['bytes_sent'] += sent
+
+        self.update_congestion(connection)
+        self.update_write_interest(connection)
+
+    def batch_output(self, connection, start):
+        """ This function packs the messages queued on a server link into batch messages right before they are
+        sent, so the receiving server handles one frame per run of messages. Nothing is batched for hosts that
+        did not announce the 'batch' capability (which clients do not) or for slow consumers, whose queue may 
+        hold spilled data that does not start at a message boundary.
+
+        Args:
+            connection (BaseConnectionData): the connection that is about to be flushed
+            start (int): the index of the first queued chunk that may be batched
+        Returns:
+            None
+        """
+        if self.batch_server_links and 'batch' in connection.capabilities and not connection.slow_consumer:
+            batches, messages = connection.batch_queued(self.id, start)
+            if batches:
+                self.write_counters['batches'] += batches
+                self.write_counters['batched_messages'] += messages
+
+    def compress_output(self, connection, start):
+        """ This function compresses the messages queued on a server link right before they are sent, if the 
+        link compresses its output (see self.handle_capability_announcement). Like batching, compression 
+        leaves the output of slow consumers alone.
+
+        Args:
+            connection (BaseConnectionData): the connection that is about to be flushed
+            start (int): the index of the first queued chunk that may be compressed
+        Returns:
+            None
+        """
+        if connection.compressor is not None and not connection.slow_consumer:
+            size, compressed_size = connection.compress_queued(start, self.compression_threshold)
+            if size:
+                self.compression_counters['bytes_in'] += size
+                self.compression_counters['bytes_out'] += compressed_size
+
+    def messages_per_send_call(self):
+        """ Returns the average number of messages sent per send system call. """
+        return self.write_counters['messages_sent'] / max(1, self.write_counters['send_calls'])
+
+    def enqueue(self, connection, message):
+        """ This function appends a message to a connection's write queue and updates the connection's 
+        backpressure state. It is shared by the server engines, which differ in how queued output is sent.
+
+        Args:
+            connection (BaseConnectionData): the connection the message should be sent over
+            message (bytes): the packed message to be delivered
+        Returns:
+            bool: False if the message was dropped, True otherwise
+        """
+        if connection.spill is not None:
+            self.backpressure_counters['spilled_bytes'] += len(message)
+        if not connection.queue(message):
+            self.backpressure_counters['dropped_messages'] += 1
+            return False
+
+        self.update_congestion(connection)
+        if connection.congested and not connection.slow_consumer:
+            self.congested_downstreams.add(connection)
+        return True
+
+    def update_write_interest(self, connection):
+        """ This function subscribes a connection's socket to EVENT_WRITE while it has pending output and 
+        unsubscribes it once its write queue has drained.
+
+        Args:
+            connection (BaseConnectionData): the connection whose selector registration should be updated
+        Returns:
+            None        
+        """
+        want_write = bool(connection.write_queue)
+        if want_write != connection.write_interest:
+            connection.write_interest = want_write
+            self.update_selector_events(connection)
+
+    def update_selector_events(self, connection):
+        """ This function registers a connection's socket with the selector for the events it is currently 
+        interested in: EVENT_READ unless its reading is paused and EVENT_WRITE while it has pending output. A 
+        socket interested in neither is unregistered until it is interested in one of them again.
+
+        Args:
+            connection (BaseConnectionData): the connection whose selector registration should be updated
+        Returns:
+            None        
+        """
+        if connection.sock is None:
+            return
+
+        self.write_counters['selector_updates'] += 1
+        events = 0 if connection.reading_paused else selectors.EVENT_READ
+        if connection.write_interest:
+            events |= selectors.EVENT_WRITE
+
+        if events:
+            try:
+                self.sel.modify(connection.sock, events, connection)
+            except KeyError:
+                self.sel.register(connection.sock, events, connection)
+        else:
+            self.sel.unregister(connection.sock)
+
+    def attach_connection_data(self, io_device, connection):
+        """ This function replaces the data object associated with a socket (e.g. a BaseConnectionData with 
+        a ServerConnectionData once the remote host has registered). Output already queued on the old data 
+        object is moved to the new one so nothing is lost or sent twice.
+
+        Args:
+            io_device (SelectorKey): the key of the socket whose data object should be replaced
+            connection (BaseConnectionData): the new data object
+        Returns:
+            None        
+        """
+        previous = io_device.data
+        connection.take_over(previous)
+        if previous.flush_scheduled:
+            self.connections_to_flush[self.connections_to_flush.index(previous)] = connection
+            connection.flush_scheduled, previous.flush_scheduled = True, False
+        self.replace_ready_connection(previous, connection)
+        # Messages of the same read that are still waiting to be dispatched are handed to the handlers with 
+        # the new data object
+        connection.io_device = previous.io_device = io_device._replace(data=connection)
+        connection.write_interest = previous.write_interest
+        self.update_selector_events(connection)
+        self.update_congestion(connection)
+        if not connection.congested:
+            self.resume_upstreams(connection)
+
+    def close_connection(self, io_device):
+        """ This function unregisters a socket from the selector, closes it and removes the associated host 
+        from the routing index so no further messages are routed over the closed socket.
+
+        Args:
+            io_device (SelectorKey): the key of the socket that should be closed
+        Returns:
+            None        
+        """
+        self.disconnect(self.current_connection(io_device) or io_device.data)
+
+    def disconnect(self, connection):
+        """ This function closes a connection's socket, unregistering it from the selector if it is 
+        registered, and removes the connection from the routing index.
+
+        Args:
+            connection (BaseConnectionData): the connection that should be closed
+        Returns:
+            None        
+        """
+        try:
+            self.sel.unregister(connection.sock)
+        except KeyError:
+            pass
+        connection.sock.close()
+        self.forget_connection(connection)
+
+    def forget_connection(self, connection):
+        """ This function removes a closed connection from the routing index and releases its backpressure 
+        state: connections paused on its account resume reading and its spill file is deleted. The host is 
+        removed after LINK_FAILURE_GRACE seconds, unless it is a mesh server that can still be reached through
+        another link.
+
+        Args:
+            connection (BaseConnectionData): the data object of the connection that was closed
+        Returns:
+            None        
+        """
+        host_id = getattr(connection, 'id', None)
+        if self.adjacent_connections.get(host_id) is connection:
+            self.routes.remove_link(host_id)
+        if host_id is not None and self.hosts_db.get(host_id) is connection:
+            if self.mesh and 'mesh' in connection.capabilities:
+                self.mesh_link_down(connection)
+            if connection.first_link_id is None or connection.first_link_id == self.id:
+                self.call_later(LINK_FAILURE_GRACE, self.prune_link, connection)
+
+        if connection.congestion_timer:
+            connection.congestion_timer.cancel()
+        connection.congested = False
+        self.resume_upstreams(connection)
+        if connection.spill is not None:
+            connection.spill.close()
+            connection.spill = None
+        connection.inbox.clear()
+        connection.inbox_bytes = 0
+        self.expired_handovers.discard(connection)
+
+    def route_host(self, host):
+        """ This function routes a host through its first link in self.routes, or through itself if it is 
+        adjacent.
+
+        Args:
+            host (BaseConnectionData): the connection data object of the host
+        Returns:
+            None        
+        """
+        self.routes.add(host.id, host.id if host.first_link_id == self.id else host.first_link_id)
+
+    def unroute_host(self, host):
+        """ This function removes the route of a host that left the network, and removes it from the hosts
+        flooded by its mesh server.
+
+        Args:
+            host (BaseConnectionData): the connection data object of the host
+        Returns:
+            None        
+        """
+        self.routes.remove(host.id)
+        if host.home_id is not None:
+            homed = self.mesh_homes.get(host.home_id)
+            if homed is not None:
+                homed.discard(host.id)
+
+    def reroute_hosts(self, hosts, link_id):
+        """ This function routes known hosts through another adjacent host, which becomes their first link
+        (or becomes adjacent itself, if it is among them).
+
+        Args:
+            hosts (iterable): the connection data objects of the hosts
+            link_id (int): the ID of the adjacent host
+        Returns:
+            int: the number of hosts
+        """
+        routes = self.routes
+        count = 0
+        for host in hosts:
+            host.first_link_id = self.id if host.id == link_id else link_id
+            routes.add(host.id, link_id)
+            count += 1
+        return count
+
+    def prune_link(self, connection):
+        """ This function removes an adjacent host whose link failed from the routing state, together with 
+        every host that was reached through it (see RouteTable.routed_through), in time proportional to the 
+        number of hosts removed. The rest of the network is told the clients among them quit with one run of 
+        client quit messages per adjacent host, which is queued as a single chunk. Nothing is done if the host 
+        has been removed or replaced in the meantime (e.g. it quit before closing its socket) or can be reached
+        through another link of a mesh, and hosts that registered again through another link during the grace
+        period are kept.
+
+        Args:
+            connection (BaseConnectionData): the connection data object of the host whose link failed
+        Returns:
+            None        
+        """
+        if self.hosts_db.get(connection.id) is not connection:
+            return
+        if connection.first_link_id is not None and connection.first_link_id != self.id:
+            return
+        self.adjacent_server_ids.discard(connection.id)
+        self.adjacent_user_ids.discard(connection.id)
+        if self.adjacent_connections.get(connection.id) is connection:
+            self.routes.remove_link(connection.id)
+        self.prune_subtree(connection)
+
+    def prune_subtree(self, connection):
+        """ This function removes a host and the hosts still reached through it from hosts_db and tells the
+        rest of the network they left: the clients with client quit messages, sent to every adjacent host, and
+        the servers with server quit messages, sent to the adjacent servers that handle them.
+
+        Args:
+            connection (BaseConnectionData): the connection data object of the host
+        Returns:
+            None        
+        """
+        self.flush_presence()
+        hosts_db = self.hosts_db
+        lost = [connection.id] if hosts_db.get(connection.id) is connection else []
+        lost.extend(self.routes.pop_link_routes(connection.id))
+
+        quits = []
+        server_quits = []
+        lost_servers = []
+        for host_id in lost:
+            host = hosts_db.pop(host_id, None)
+            if host is None:
+                continue
+            self.unroute_host(host)
+            if isinstance(host, ClientConnectionData):
+                quits.append(ClientQuitMessage.bytes(host_id, "Connection lost"))
+            else:
+                server_quits.append(ServerQuitMessage.bytes(host_id, 0, "Connection lost"))
+                lost_servers.append(host_id)
+        self.print_info("Lost the link to Host ID #%s: removed %i servers and %i clients" % (
+            connection.id, len(server_quits), len(quits)))
+
+        adjacent_connections = self.adjacent_connections
+        if quits:
+            self.queue_messages(filter(None, map(adjacent_connections.get, self.adjacent_server_ids)), quits)
+            self.queue_messages(filter(None, map(adjacent_connections.get, self.adjacent_user_ids)), quits)
+        if server_quits:
+            self.queue_messages(self.failover_connections(self.adjacent_server_ids), server_quits)
+        if lost_servers and self.mesh:
+            self.forget_mesh_servers(lost_servers)
+
+    def failover_connections(self, host_ids, ignore_host_id=None):
+        """ This function returns the connections of the given adjacent hosts that announced they handle 
+        server quit messages (hosts that predate them would treat them as an unknown message type).
+
+        Args:
+            host_ids (iterable): the IDs of the adjacent hosts
+            ignore_host_id (int): the ID of a host that should be left out
+        Returns:
+            list: the connection data objects
+        """
+        adjacent_connections = self.adjacent_connections
+        return [adjacent_connections[host_id] for host_id in host_ids if host_id != ignore_host_id and 
+                host_id in adjacent_connections and 'failover' in adjacent_connections[host_id].capabilities]
+
+    def depart(self, replacement_id=0, replacement_address=None, reason="Server shutting down"):
+        """ This function announces that this server is leaving the network (e.g. to be restarted). If a
+        replacement is named, which must be an adjacent server, the adjacent servers and clients reconnect to 
+        it and the hosts behind this server stay registered: the rest of the network only rewrites their
+        routes. Otherwise the adjacent servers remove everything behind this server right away. The server 
+        should be terminated once the announcement has been sent. It must be called from the thread running 
+        the event loop (see self.call_soon_threadsafe).
+
+        Args:
+            replacement_id (int): the ID of the replacement server, or 0 if there is none
+            replacement_address (tuple): the (host, port) the replacement listens on, by default the address
+                this server connected to on startup
+            reason (string): the reason this server leaves, sent if there is no replacement
+        Returns:
+            None        
+        """
+        if replacement_id:
+            if replacement_id not in self.adjacent_server_ids:
+                raise ValueError("The replacement must be an adjacent server: %s" % replacement_id)
+            host, port = replacement_address or (self.connect_to_host_addr, self.connect_to_port)
+            content = "%s:%i" % (host, port)
+        else:
+            content = reason
+        self.print_info("Leaving the network (replacement: Host ID #%s)" % replacement_id)
+        self.flush_presence()
+        self.queue_messages(self.failover_connections(chain(self.adjacent_server_ids, self.adjacent_user_ids)), 
+                            (ServerQuitMessage.bytes(self.id, replacement_id, content),))
+
+    def connect_to_replacement(self, departed_id, address):
+        """ This function connects to the server that replaces a departed adjacent server and hands the 
+        departed server's link over to it (see self.replacement_connected). The connection is opened on a 
+        thread of its own, giving up after HANDOVER_TIMEOUT seconds, so a replacement that is slow to answer 
+        does not hold up the event loop and every other link with it.
+
+        Args:
+            departed_id (int): the ID of the server that left
+            address (string): the address of the replacement, as "host:port"
+        Returns:
+            None        
+        """
+        self.print_info("Reconnecting to the replacement of Host ID #%s at %s..." % (departed_id, address))
+
+        def connect():
+            try:
+                host, _, port = address.rpartition(':')
+                sock, error = create_connection((host, int(port)), timeout=HANDOVER_TIMEOUT), None
+            except (OSError, ValueError) as connect_error:
+                sock, error = None, connect_error
+            self.call_soon_threadsafe(self.replacement_connected, departed_id, sock, error)
+
+        threading.Thread(target=connect, name="replacement-%s" % departed_id, daemon=True).start()
+
+    def replacement_connected(self, departed_id, sock, error):
+        """ This function starts the handover to the replacement of a departed adjacent server once the 
+        connection to it is open (see self.start_handover). If the replacement could not be reached, the hosts 
+        behind the departed server are removed right away. A connection that opened after the handover ended is
+        closed.
+
+        Args:
+            departed_id (int): the ID of the server that left
+            sock (socket): the connected socket, or None if the replacement could not be reached
+            error (Exception): the reason the replacement could not be reached
+        Returns:
+            None        
+        """
+        if sock is None:
+            self.print_info("Could not reach the replacement of Host ID #%s: %s" % (departed_id, error))
+            self.finish_handover(departed_id)
+            return
+        if departed_id not in self.departed:
+            sock.close()
+            return
+        sock.setblocking(False)
+        self.start_handover(self.register_connection(sock), departed_id)
+
+    def start_handover(self, connection, departed_id):
+        """ This function registers this server with the replacement of a departed adjacent server. The 
+        registration names the departed server as its last hop, which tells the replacement this server 
+        already belongs to the network and is moving over from the departed server. It is followed by the 
+        registrations of the hosts on this server's side (every host not reached through the departed server),
+        which the replacement uses to rewrite their routes, queued as a single chunk.
+
+        Args:
+            connection (BaseConnectionData): the new connection to the replacement
+            departed_id (int): the ID of the server that left
+        Returns:
+            None        
+        """
+        self.queue_message(connection, ServerRegistrationMessage.bytes(self.id, departed_id, self.server_name,
+                                                                       self.server_info))
+        connection.sent_registration = True
+        self.queue_messages((connection,), (host_data.registration for host_data in self.hosts_db.values()
+                                            if host_data.first_link_id != departed_id))
+
+    def finish_handover(self, departed_id):
+        """ This function ends the handover of a departed adjacent server's hosts to its replacement, once 
+        they have all been reached through another link or HANDOVER_TIMEOUT has passed. The hosts that are 
+        still routed through the departed server are removed like the hosts behind a failed link.
+
+        Args:
+            departed_id (int): the ID of the server that left
+        Returns:
+            None        
+        """
+        departed = self.departed.pop(departed_id, None)
+        if departed is None:
+            return
+        connection, replacement_id, timer = departed
+        timer.cancel()
+        for server_id in self.adjacent_server_ids:
+            link = self.adjacent_connections.get(server_id)
+            if link is not None and link.replaces == departed_id:
+                link.replaces = None
+        self.prune_subtree(connection)
+
+    def flood_message(self, message, ignore_host_id=None):
+        """ This function broadcasts a message to the adjacent servers of a mesh. The adjacent mesh servers 
+        are sent the message wrapped in a flooded message. If the message is being handled because it was 
+        flooded to this server, the same flooded message is forwarded to every adjacent mesh server except the 
+        one it came from and its source; otherwise this server floods it under its own next sequence number. 
+        Adjacent servers that are not mesh servers are sent the message as it is, except ignore_host_id.
+
+        Args:
+            message (bytes): the packed message to be delivered
+            ignore_host_id (int): the ID of a host that this message should not be delievered to 
+        Returns:
+            None        
+        """
+        flood, arrival_id = self.current_flood or (None, None)
+        if flood is not None and not flood.seq:
+            # A host sent in a full-state sync, which is flooded on as a host reached through this server
+            flood = None
+        envelope = None
+        for server_id in self.adjacent_server_ids:
+            connection = self.adjacent_connections.get(server_id)
+            if connection is None:
+                continue
+            if 'mesh' not in connection.capabilities:
+                if server_id != ignore_host_id:
+                    self.queue_message(connection, message)
+            elif flood is not None:
+                if server_id != arrival_id and server_id != flood.source_id:
+                    self.queue_message(connection, flood.bytes)
+                    self.mesh_counters['floods_forwarded'] += 1
+            elif server_id != ignore_host_id:
+                if envelope is None:
+                    self.flood_seq += 1
+                    envelope = FloodMessage.bytes(self.id, self.flood_seq, message)
+                self.queue_message(connection, envelope)
+                self.mesh_counters['floods_sent'] += 1
+
+    def mesh_connections(self, ignore_host_id=None):
+        """ This function returns the connections of the adjacent servers that announced they are mesh 
+        servers.
+
+        Args:
+            ignore_host_id (int): the ID of a server that should be left out
+        Returns:
+            list: the connection data objects
+        """
+        adjacent_connections = self.adjacent_connections
+        return [adjacent_connections[host_id] for host_id in self.adjacent_server_ids if host_id != ignore_host_id
+                and host_id in adjacent_connections and 'mesh' in adjacent_connections[host_id].capabilities]
+
+    def mesh_link_up(self, connection):
+        """ This function adds a new link to an adjacent mesh server to this server's link state. The server 
+        is sent the link states known to this server first, so it can compute its routes right away.
+
+        Args:
+            connection (ServerConnectionData): the adjacent mesh server
+        Returns:
+            None        
+        """
+        self.queue_messages((connection,), [LinkStateMessage.bytes(server_id, seq, neighbours) for 
+                                            server_id, (seq, neighbours) in self.link_states.items() 
+                                            if server_id != self.id])
+        self.originate_link_state()
+
+    def mesh_link_down(self, connection):
+        """ This function removes the failed link to an adjacent mesh server from this server's link state. 
+        The server and the hosts behind it are rerouted through the rest of the mesh if they can be reached;
+        if the server cannot, its first_link_id is left as None and it is pruned like any failed link.
+
+        Args:
+            connection (ServerConnectionData): the adjacent mesh server whose link failed
+        Returns:
+            None        
+        """
+        self.adjacent_server_ids.discard(connection.id)
+        connection.first_link_id = None
+        self.originate_link_state()
+        if connection.first_link_id is not None:
+            self.print_info("Lost the link to Host ID #%s, rerouted through Host ID #%s" % (
+                connection.id, connection.first_link_id))
+
+    def originate_link_state(self):
+        """ This function floods this server's link state (the IDs of its adjacent mesh servers) under its 
+        next link state sequence number, and recomputes the routes.
+
+        Returns:
+            None        
+        """
+        neighbours = frozenset(connection.id for connection in self.mesh_connections())
+        self.link_state_seq += 1
+        self.link_states[self.id] = (self.link_state_seq, neighbours)
+        self.queue_messages(self.mesh_connections(), (LinkStateMessage.bytes(self.id, self.link_state_seq, 
+                                                                             neighbours),))
+        self.compute_mesh_routes()
+
+    def forget_mesh_servers(self, server_ids):
+        """ This function drops the flood windows and link states of mesh servers that left the network, so 
+        they start over if they join again, and recomputes the routes if any link state was dropped.
+
+        Args:
+            server_ids (iterable): the IDs of the servers
+        Returns:
+            None        
+        """
+        dropped = False
+        for server_id in server_ids:
+            self.flood_windows.pop(server_id, None)
+            self.mesh_homes.pop(server_id, None)
+            dropped = self.link_states.pop(server_id, None) is not None or dropped
+        if server_ids and set(server_ids) & self.link_states.get(self.id, NO_LINK_STATE)[1]:
+            self.originate_link_state()
+        elif dropped:
+            self.compute_mesh_routes()
+
+    def compute_mesh_routes(self):
+        """ This function computes the first hop of a shortest path (in hops) to every mesh server from the 
+        link states, with a breadth-first search over the links both ends report. Only the routes that change
+        are updated: every mesh server whose first hop changed is rerouted through its new one, together with 
+        the hosts that are not adjacent among those it flooded (see self.mesh_homes). Hosts that cannot be 
+        reached keep their routes.
+
+        Returns:
+            None        
+        """
+        link_states = self.link_states
+        next_hops = {}
+        queue = deque()
+        for server_id in link_states.get(self.id, NO_LINK_STATE)[1]:
+            if server_id in self.adjacent_connections and self.id in link_states.get(server_id, NO_LINK_STATE)[1]:
+                next_hops[server_id] = server_id
+                queue.append(server_id)
+        while queue:
+            server_id = queue.popleft()
+            next_hop = next_hops[server_id]
+            for neighbour_id in link_states.get(server_id, NO_LINK_STATE)[1]:
+                if neighbour_id != self.id and neighbour_id not in next_hops and \
+                        server_id in link_states.get(neighbour_id, NO_LINK_STATE)[1]:
+                    next_hops[neighbour_id] = next_hop
+                    queue.append(neighbour_id)
+        previous = self.mesh_next_hops
+        self.mesh_next_hops = next_hops
+
+        hosts_db = self.hosts_db
+        moved = 0
+        for server_id, next_hop in next_hops.items():
+            if previous.get(server_id) == next_hop:
+                continue
+            host_ids = [server_id]
+            host_ids.extend(host_id for host_id in self.mesh_homes.get(server_id, ()) if host_id not in next_hops)
+            moved += self.reroute_hosts([hosts_db[host_id] for host_id in host_ids if host_id in hosts_db and 
+                                         hosts_db[host_id].first_link_id != self.id], next_hop)
+        self.mesh_counters['route_updates'] += moved
+
+##############################################################################################################
+
+    def schedule_dispatch(self, connection):
+        """ This function gives a connection with received messages a turn in the dispatch phase, unless it 
+        already has one or reading from it is paused (resume_reading schedules it again).
+
+        Args:
+            connection (BaseConnectionData): the connection with messages in its inbox
+        Returns:
+            None
+        """
+        if connection.inbox and not connection.dispatch_scheduled and not connection.paused_by:
+            connection.dispatch_scheduled = True
+            self.ready_connections.append(connection)
+
+    def replace_ready_connection(self, previous, connection):
+        """ This function hands the dispatch turn of a data object that is being replaced to its successor. """
+        if previous.dispatch_scheduled:
+            self.ready_connections[self.ready_connections.index(previous)] = connection
+            connection.dispatch_scheduled, previous.dispatch_scheduled = True, False
+
+    def dispatch_ready_connections(self):
+        """ This function is the dispatch phase of the event loop. Every connection with received messages 
+        gets one turn, in round robin order, in which its messages are handed to the message handlers until its
+        budget is used up. A connection with messages left is moved to the back of the queue for the next 
+        iteration and is not read from until all of them have been dispatched.
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        ready = self.ready_connections
+        for _ in range(len(ready)):
+            connection = ready.popleft()
+            connection.dispatch_scheduled = False
+            if connection.paused_by:
+                continue
+
+            connection = self.dispatch_messages(connection)
+            if connection.inbox:
+                if not connection.read_throttled:
+                    self.throttle_reading(connection, True)
+                self.schedule_dispatch(connection)
+            elif connection.read_throttled:
+                self.throttle_reading(connection, False)
+
+    def dispatch_messages(self, connection):
+        """ This function dispatches the messages in a connection's inbox until the inbox is empty or the 
+        connection's budget for this turn is used up. If any of the messages were queued on a congested 
+        connection, reading from this connection is paused (see self.apply_backpressure).
+
+        Args:
+            connection (BaseConnectionData): the connection whose turn it is
+        Returns:
+            BaseConnectionData: the connection's data object, which a message handler may have replaced
+        """
+        messages_left = self.read_budget_messages
+        bytes_left = self.read_budget_bytes
+        latencies = self.dispatch_latencies[connection.connection_class]
+        self.congested_downstreams.clear()
+
+        relay_handlers = self.relay_handlers
+        presence = self.presence
+        inbox = connection.inbox
+        while inbox and messages_left > 0 and bytes_left > 0 and not connection.paused_by:
+            message_type, source_id, destination_id, data, received_at = inbox.popleft()
+            size = len(data)
+            connection.inbox_bytes -= size
+            messages_left -= 1
+            bytes_left -= size
+            latencies.append(time.monotonic() - received_at)
+
+            # Messages that are only passed on are forwarded without being parsed
+            relay = relay_handlers.get(message_type)
+            if relay is not None and relay(source_id, destination_id, data):
+                continue
+
+            # If we recognize the command, then process it using the assigned message handler
+            message = MessageParser.parse_message(data.tobytes())
+            # Client registrations and quits collected for the presence window are sent before any other message
+            # that changes the network (see self.collect_presence)
+            if presence.pending and message_type not in PRESENCE_MESSAGE_TYPES and relay is None:
+                self.flush_presence()
+            if message.message_type in self.message_handlers:
+                self.print_info("Received msg from Host ID #%s \"%s\"" % (message.source_id, message.bytes))
+                self.message_handlers[message.message_type](connection.io_device, message)
+            else:
+                raise Exception("Unrecognized command: " + str(message))
+
+            # A registration message replaces the connection's data object, which takes over the inbox
+            connection = connection.io_device.data
+            inbox = connection.inbox
+
+        self.apply_backpressure(connection)
+        return connection
+
+    def throttle_reading(self, connection, throttled):
+        """ This function stops reading from a connection while it has messages carried over to its next 
+        turn, or resumes reading once they have all been dispatched.
+
+        Args:
+            connection (BaseConnectionData): the connection to throttle
+            throttled (bool): whether reading should wait for the inbox to be dispatched
+        Returns:
+            None
+        """
+        connection.read_throttled = throttled
+
+    def dispatch_latency_percentiles(self, percentiles=(50, 90, 99, 99.9)):
+        """ This function computes percentiles of the time received messages waited to be dispatched, per 
+        connection class, over the most recent LATENCY_SAMPLE_COUNT messages of each class.
+
+        Args:
+            percentiles (tuple): the percentiles to compute
+        Returns:
+            dict: maps every connection class that received messages ('client', 'server' or 'unregistered') 
+                to a dictionary mapping each percentile to a latency in seconds
+        """
+        result = {}
+        for connection_class, latencies in self.dispatch_latencies.items():
+            if latencies:
+                ordered = sorted(latencies)
+                last = len(ordered) - 1
+                result[connection_class] = {percentile: ordered[min(last, int(len(ordered) * percentile / 100))]
+                                            for percentile in percentiles}
+        return result
+
+##############################################################################################################
+
+    def update_congestion(self, connection):
+        """ This function updates a connection's backpressure state after its write queue grew or shrank. It 
+        also moves spilled output back to the write queue once the queue has drained below the low watermark 
+        and lifts the slow consumer policy once all of the connection's output has been sent.
+
+        Args:
+            connection (BaseConnectionData): the connection whose write queue changed
+        Returns:
+            None        
+        """
+        pending = connection.pending_bytes
+        if connection.congested:
+            if pending <= self.write_low_watermark:
+                self.congestion_ended(connection)
+        elif pending > self.write_high_watermark:
+            self.congestion_started(connection)
+
+        if connection.spill is not None and pending <= self.write_low_watermark:
+            pending += connection.refill_from_spill(self.write_high_watermark - pending)
+
+        if connection.slow_consumer and not pending and (connection.spill is None or not len(connection.spill)):
+            self.print_info("Host ID #%s has caught up, lifting the slow consumer policy" % 
+                            getattr(connection, 'id', None))
+            connection.slow_consumer = False
+            connection.drop_chat = False
+            if connection.spill is not None:
+                connection.spill.close()
+                connection.spill = None
+
+    def congestion_started(self, connection):
+        connection.congested = True
+        self.backpressure_counters['congestion_events'] += 1
+        if not connection.slow_consumer:
+            connection.congestion_timer = self.call_later(self.slow_consumer_timeout, self.handle_slow_consumer,
+                                                          connection)
+
+    def congestion_ended(self, connection):
+        connection.congested = False
+        if connection.congestion_timer:
+            connection.congestion_timer.cancel()
+            connection.congestion_timer = None
+        self.resume_upstreams(connection)
+
+    def handle_slow_consumer(self, connection):
+        """ This function is called once a connection has been congested for slow_consumer_timeout seconds.
+        It applies the slow consumer policy to the connection and resumes reading from every connection that 
+        was paused on its account, so a single stuck host cannot stall the rest of the network.
+
+        Args:
+            connection (BaseConnectionData): the congested connection
+        Returns:
+            None        
+        """
+        connection.congestion_timer = None
+        if not connection.congested:
+            return
+
+        self.print_info("Host ID #%s is a slow consumer (%i bytes queued), applying policy '%s'" % 
+                        (getattr(connection, 'id', None), connection.pending_bytes, self.slow_consumer_policy))
+        self.backpressure_counters['slow_consumers'] += 1
+        connection.slow_consumer = True
+        self.resume_upstreams(connection)
+
+        if self.slow_consumer_policy == 'disconnect':
+            self.backpressure_counters['disconnected_slow_consumers'] += 1
+            self.disconnect(connection)
+            return
+        elif self.slow_consumer_policy == 'drop_chat':
+            connection.drop_chat = True
+            self.backpressure_counters['dropped_messages'] += connection.drop_queued_chat()
+        elif self.slow_consumer_policy == 'spill':
+            if connection.spill is None:
+                self.backpressure_counters['spilled_bytes'] += connection.spill_queued(SpillFile(self.spill_directory))
+        self.update_congestion(connection)
+
+    def apply_backpressure(self, upstream):
+        """ This function is called after handling the messages received in one read. If any of them were 
+        queued on a congested connection, reading from the connection they were received from is paused until
+        the congested connection drains. Only registered hosts are paused.
+
+        Args:
+            upstream (BaseConnectionData): the connection the messages were received from
         Returns:
             None        
         """
-        # Accept the connection
-        conn, addr = io_device.fileobj.accept()
-        conn.setblocking(False)
-        
-        # Register with selector using BaseConnectionData (we don't know if it's server or client yet)
-        connection_data = BaseConnectionData()
-        self.sel.register(conn, selectors.EVENT_READ | selectors.EVENT_WRITE, connection_data)
-
-    def handle_io_device_events(self, io_device, event_mask):
-        """ This function is responsible for handling READ and WRITE events for a given IO device. Incomming  
-        messages will be read and passed to the appropriate message handler here and the write buffer  
-        associated with this socket will be sent over the socket here.
+        downstreams = self.congested_downstreams
+        if not downstreams:
+            return
+        if upstream is not None and getattr(upstream, 'id', None) is not None:
+            for downstream in downstreams:
+                if downstream is not upstream and downstream.congested and not downstream.slow_consumer:
+                    self.pause_reading(upstream, downstream)
+        downstreams.clear()
+
+    def pause_reading(self, upstream, downstream):
+        if upstream in downstream.paused_upstreams:
+            return
+        downstream.paused_upstreams.append(upstream)
+        upstream.paused_by += 1
+        if upstream.paused_by == 1:
+            self.backpressure_counters['paused_reads'] += 1
+            self.set_reading(upstream, False)
+
+    def resume_upstreams(self, downstream):
+        upstreams, downstream.paused_upstreams = downstream.paused_upstreams, []
+        for upstream in upstreams:
+            self.resume_reading(upstream)
+
+    def resume_reading(self, upstream):
+        upstream.paused_by -= 1
+        if not upstream.paused_by:
+            self.set_reading(upstream, True)
+            self.schedule_dispatch(upstream)
+
+    def set_reading(self, connection, enabled):
+        """ This function subscribes a connection's socket to EVENT_READ or unsubscribes it.
 
         Args:
-            io_device (SelectorKey):
-            event_mask (int): 
+            connection (BaseConnectionData): the connection to pause or resume
+            enabled (bool): whether the connection should be read from
         Returns:
             None        
         """
-        # Handle READ events
-        if event_mask & selectors.EVENT_READ:
-            try:
-                recv_data = io_device.fileobj.recv(4096)
-                if recv_data:
-                    # We received data, handle it
-                    self.handle_messages(io_device, recv_data)
-                else:
-                    # No data means connection was closed by peer
-                    self.sel.unregister(io_device.fileobj)
-                    io_device.fileobj.close()
-                    return
-            except ConnectionResetError:
-                # Handle connection reset
-                self.sel.unregister(io_device.fileobj)
-                io_device.fileobj.close()
-                return
-                
-        # Handle WRITE events
-        if event_mask & selectors.EVENT_WRITE:
-            if io_device.data.write_buffer:
-                # We have data to send
-                try:
-                    sent = io_device.fileobj.send(io_device.data.write_buffer)
-                    # Clear the sent portion of the write buffer
-                    io_device.data.write_buffer = io_device.data.write_buffer[sent:]
-                except ConnectionResetError:
-                    # Handle connection reset
-                    self.sel.unregister(io_device.fileobj)
-                    io_device.fileobj.close()
-                    return
+        if connection.sock is None or connection.sock.fileno() == -1:
+            return
+        connection.reading_paused = not enabled
+        self.update_selector_events(connection)
 
     def handle_messages(self, io_device, recv_data):
         """ This function is responsible for parsing the received bytes into separate messages and then 
         passing each of the received messages to the appropriate message handler. Message parsing is offloaded
-        to the MessageParser class. Messages are passed to the appropriate message handler using the 
+        to the connection's MessageFrameDecoder, which keeps the bytes of a message that has only partially 
+        arrived until the rest of it is received. Messages are passed to the appropriate message handler using the 
         self.message_handlers dictionary which associates the appropriate message handler function with each
-        valid message type value.
+        valid message type value. The messages are queued in the connection's inbox and handed to the handlers 
+        in the dispatch phase of the event loop (see self.dispatch_ready_connections).
 
         You do not need to make any changes to this method.        
 
         Args:
             io_device (SelectorKey):
-            recv_data (bytes): 
+            recv_data (bytes-like): the received bytes, usually a memoryview of a pooled receive buffer that
+                is reused once this function returns
         Returns:
             None        
         """
-        messages = MessageParser.parse_messages(recv_data)
+        connection = io_device.data
+        connection.io_device = io_device
+        chunk, frames = connection.decoder.feed_frames(recv_data)
+        if not frames:
+            return
+        self.queue_received_messages(connection, chunk, frames, time.monotonic())
+        self.schedule_dispatch(connection)
 
-        for message in messages:
-             # If we recognize the command, then process it using the assigned message handler
-            if message.message_type in self.message_handlers:
-                self.print_info("Received msg from Host ID #%s \"%s\"" % (message.source_id, message.bytes))
-                self.message_handlers[message.message_type](io_device, message)
-            else:
-                raise Exception("Unrecognized command: " + str(message))
+    def queue_received_messages(self, connection, chunk, frames, received_at):
+        """ This function appends received messages to a connection's inbox. Only the headers are read here. 
+        The inbox holds (message type, source ID, destination ID, data, receive time) tuples, where data is a 
+        memoryview of the message within the chunk it was received in. The messages packed into batch and 
+        compressed messages are unpacked and queued as if they had been received one by one.
+
+        Args:
+            connection (BaseConnectionData): the connection the messages were received from
+            chunk (bytes): the received messages
+            frames (list): the index of the messages in chunk (see MessageParser.index_frames)
+            received_at (float): the time the messages were received at
+        Returns:
+            None
+        """
+        inbox = connection.inbox
+        view = memoryview(chunk)
+        for message_type, source_id, destination_id, offset, length in frames:
+            if message_type == 0x03:
+                batch = MessageParser.index_batch(chunk, offset)
+                inbox.extend((message_type, source_id, destination_id, view[offset:offset+length], received_at)
+                             for message_type, source_id, destination_id, offset, length in batch)
+                connection.inbox_bytes += sum(frame[4] for frame in batch)
+                continue
+            elif message_type == 0x04:
+                codec = chunk[offset+9]
+                if connection.decompressor is None:
+                    connection.decompressor = LinkDecompressor(codec, MAX_COMPRESSED_INPUT)
+                data = connection.decompressor.decompress(codec, view[offset+10:offset+length])
+                self.compression_counters['bytes_received'] += length
+                self.compression_counters['bytes_decompressed'] += len(data)
+                decompressed_frames, consumed = MessageParser.index_frames(data)
+                if consumed < len(data):
+                    raise Exception("Incomplete message!!")
+                self.queue_received_messages(connection, data, decompressed_frames, received_at)
+                continue
+            inbox.append((message_type, source_id, destination_id, view[offset:offset+length], received_at))
+            connection.inbox_bytes += length
 
 ##############################################################################################################
 
@@ -370,31 +2320,21 @@ class CRCServer(object):
         Returns:
             None        
         """
-        if destination_id in self.hosts_db:
+        connection = self.get_outbound_connection(destination_id)
+        if connection:
             self.print_info("Sending message to Host ID #%s \"%s\"" % (destination_id, message))
-            # Get the connection data for the destination host
-            dest_connection = self.hosts_db[destination_id]
-            
-            # Get the ID of the first server we need to send through
-            first_link_id = dest_connection.first_link_id
-            
-            # If first_link_id is our ID, this is an adjacent host - send directly to it
-            if first_link_id == self.id:
-                # Find the socket for the destination host itself
-                for key in self.sel.get_map().values():
-                    if (key.data and hasattr(key.data, 'id') and 
-                        key.data.id == destination_id):
-                        # Found the socket, add message to its write buffer
-                        key.data.write_buffer += message
-                        break
-            else:
-                # This is a non-adjacent host - route through the first link
-                for key in self.sel.get_map().values():
-                    if (key.data and hasattr(key.data, 'id') and 
-                        key.data.id == first_link_id):
-                        # Found the socket, add message to its write buffer
-                        key.data.write_buffer += message
-                        break
+            self.queue_message(connection, message)
+
+    def get_outbound_connection(self, destination_id):
+        """ This is a helper function that resolves the connection data of the adjacent host a message for 
+        destination_id must be written to, which is looked up in the routing table (see RouteTable.lookup).
+
+        Args:
+            destination_id (int): the ID of the destination machine
+        Returns:
+            BaseConnectionData: the connection of the next hop, or None if the destination is unreachable
+        """
+        return self.routes.lookup(destination_id)
 
     def broadcast_message_to_servers(self, message, ignore_host_id=None):
         """ This is a helper function meant to encapsulate the code needed to broadcast a message to the 
@@ -409,22 +2349,25 @@ class CRCServer(object):
         servers. Alternatively, if it is not None you should not broadcast the message to any adjacent 
         servers with the ID value included in the parameter.
 
+        In a mesh, the message is flooded to the adjacent mesh servers instead (see self.flood_message).
+
         Args:
             message (bytes): the packed message to be delivered
             ignore_host_id (int): the ID of a host that this message should not be delievered to 
         Returns:
             None        
         """
+        if self.mesh:
+            self.flood_message(message, ignore_host_id)
+            return
+
         # Loop through all adjacent server IDs
         for server_id in self.adjacent_server_ids:
             # Skip the server we want to ignore (if any)
             if server_id != ignore_host_id:
-                # Find the socket for this server and add message to write buffer
-                for key in self.sel.get_map().values():
-                    if (key.data and hasattr(key.data, 'id') and 
-                        key.data.id == server_id):
-                        key.data.write_buffer += message
-                        break
+                connection = self.adjacent_connections.get(server_id)
+                if connection:
+                    self.queue_message(connection, message)
 
     def broadcast_message_to_adjacent_clients(self, message, ignore_host_id=None):
         """ This is a helper function meant to encapsulate the code needed to broadcast a message to all 
@@ -442,12 +2385,109 @@ class CRCServer(object):
         """
         for client_id in self.adjacent_user_ids:
             if client_id != ignore_host_id:
-                # Find the socket for this client and add message to write buffer
-                for key in self.sel.get_map().values():
-                    if (key.data and hasattr(key.data, 'id') and 
-                        key.data.id == client_id):
-                        key.data.write_buffer += message
-                        break
+                connection = self.adjacent_connections.get(client_id)
+                if connection:
+                    self.queue_message(connection, message)
+
+    def collect_presence(self, host, message):
+        """ This function collects the registration or quit message of a client for the presence window 
+        instead of broadcasting it right away, unless this server has no presence window or the message was 
+        flooded through a mesh. The first message collected opens the window. A message that cancels a 
+        collected one (see PresenceAggregator.add) is dropped together with it.
+
+        Args:
+            host (ClientConnectionData): the connection data object of the client
+            message (bytes): the client's registration or quit message, as it is broadcast
+        Returns:
+            bool: False if the message should be broadcast right away, True otherwise
+        """
+        if not self.presence_window or self.current_flood is not None:
+            return False
+        presence = self.presence
+        counters = self.presence_counters
+        counters['joins' if message[0] == 0x80 else 'quits'] += 1
+        if not presence.add(host, message):
+            # Neither message is sent to any of the adjacent hosts it would have been broadcast to
+            fanout = len(self.adjacent_server_ids) - (host.first_link_id in self.adjacent_server_ids) + \
+                len(self.adjacent_user_ids) - (host.id in self.adjacent_user_ids)
+            counters['cancelled'] += 2
+            counters['frames_saved'] += 2 * fanout
+        elif presence.timer is None:
+            presence.timer = self.call_later(self.presence_window, self.flush_presence)
+        return True
+
+    def flush_presence(self):
+        """ This function closes the presence window and sends the client registrations and quits collected 
+        during it, in the order they were handled, to every adjacent host except the server each came from and
+        the client itself. Adjacent servers that accept batch messages are sent them packed into batch 
+        messages, and adjacent clients that did not register during the window share a single chunk. In a mesh
+        every message is flooded on its own (see self.flood_message).
+
+        Args:
+            None
+        Returns:
+            None
+        """
+        presence = self.presence
+        if presence.timer is not None:
+            presence.timer.cancel()
+            presence.timer = None
+        if not presence.pending:
+            return
+        entries = presence.take()
+        counters = self.presence_counters
+        counters['flushes'] += 1
+        adjacent_connections = self.adjacent_connections
+
+        if self.mesh:
+            for _, message, link_id in entries:
+                self.flood_message(message, link_id)
+        else:
+            for server_id in self.adjacent_server_ids:
+                connection = adjacent_connections.get(server_id)
+                messages = [message for _, message, link_id in entries if link_id != server_id]
+                if connection is None or not messages:
+                    continue
+                if len(messages) > 1 and self.batch_server_links and 'batch' in connection.capabilities:
+                    batches = self.queue_batches(connection, messages)
+                    counters['batches'] += batches
+                    counters['frames_saved'] += len(messages) - batches
+                else:
+                    self.queue_messages((connection,), messages)
+
+        host_ids = {host_id for host_id, _, _ in entries}
+        self.queue_messages([adjacent_connections[client_id] for client_id in self.adjacent_user_ids 
+                             if client_id not in host_ids and client_id in adjacent_connections], 
+                            [message for _, message, _ in entries])
+        for client_id in host_ids.intersection(self.adjacent_user_ids):
+            connection = adjacent_connections.get(client_id)
+            if connection is not None:
+                self.queue_messages((connection,), [message for host_id, message, _ in entries 
+                                                    if host_id != client_id])
+
+    def queue_batches(self, connection, messages):
+        """ This function queues messages on a server link packed into batch messages of at most 
+        MAX_BATCH_BYTES bytes of messages each.
+
+        Args:
+            connection (ServerConnectionData): the adjacent server, which must accept batch messages
+            messages (list): the packed messages, in the order they should be sent
+        Returns:
+            int: the number of batch messages queued
+        """
+        batches = 0
+        run = []
+        run_bytes = 0
+        for message in messages:
+            if run and run_bytes + len(message) > MAX_BATCH_BYTES:
+                self.queue_message(connection, BatchMessage.bytes(self.id, run))
+                batches += 1
+                run = []
+                run_bytes = 0
+            run.append(message)
+            run_bytes += len(message)
+        self.queue_message(connection, BatchMessage.bytes(self.id, run))
+        return batches + 1
 
     def send_message_to_unknown_io_device(self, io_device, message):
         """ The ID of a machine becomes known once it successfully registers with the network. In the event 
@@ -465,7 +2505,7 @@ class CRCServer(object):
             None        
         """
         self.print_info("Sending message to an unknown IO device \"%s\"" % (message))
-        io_device.data.write_buffer += message
+        self.queue_message(io_device.data, message)
 
 ##############################################################################################################
 
@@ -486,9 +2526,7 @@ class CRCServer(object):
         You will need to determine if this new server is adjacent to the server processing this message. If 
         the new server is adjacent, add its ID to self.adjacent_server_ids and modify the assocated io_device 
         to replace the associated data object with your new ServerConnectionData object. You can do this by
-        calling: self.sel.modify(io_device.fileobj, 
-                                 selectors.EVENT_READ | selectors.EVENT_WRITE, 
-                                 my_new_server_connection_data_obj)
+        calling: self.attach_connection_data(io_device, my_new_server_connection_data_obj)
 
         If this registration message came from a brand new adjacent server then it is the responsibility of 
         the server processing this message to inform the new server of all other connected servers and 
@@ -509,8 +2547,13 @@ class CRCServer(object):
         Returns:
             None        
         """
-        # Check for duplicate ID
+        # Check for duplicate ID (unless the server is moving over from an adjacent server that left, or this
+        # is a mesh and the server is linking up with us over a redundant link or its registration came around
+        # another path)
         if message.source_id in self.hosts_db:
+            if self.handle_handover_registration(io_device, message) or \
+                    self.handle_mesh_registration(io_device, message):
+                return
             error_msg = StatusUpdateMessage.bytes(
                 self.id, 0, 0x02,
                 f"A machine has already registered with ID {message.source_id}"
@@ -518,75 +2561,60 @@ class CRCServer(object):
             self.send_message_to_unknown_io_device(io_device, error_msg)
             return
 
-        # Create new server connection data
+        # Create new server connection data, keeping the registration message as it is forwarded by us
         new_server_connection = ServerConnectionData(
             message.source_id, 
             message.server_name, 
             message.server_info
         )
+        new_server_connection.registration = message.forwarded_bytes(self.id)
 
         # Determine if this is an adjacent server
         # If last_hop_id is 0, this server connected directly to us
         is_adjacent = (message.last_hop_id == 0)
         
         if is_adjacent:
-            # For adjacent servers, we are their first link
+            # For adjacent servers, we are their first link, and they are the first link of the hosts they 
+            # forward to us
             new_server_connection.first_link_id = self.id
-            # Add to adjacent servers list
+            # Add to adjacent servers list and to the routing index
             self.adjacent_server_ids.append(message.source_id)
-            # Update the socket's associated data
-            self.sel.modify(io_device.fileobj, 
-                           selectors.EVENT_READ | selectors.EVENT_WRITE, 
-                           new_server_connection)
+            self.routes.add_link(message.source_id, new_server_connection)
+            # Update the socket's associated data, keeping anything already queued on it (e.g. our own 
+            # registration if we connected to them)
+            self.attach_connection_data(io_device, new_server_connection)
         else:
             # For non-adjacent servers, we route through the last_hop_id
-            new_server_connection.first_link_id = message.last_hop_id
+            self.set_first_link(new_server_connection, message.last_hop_id)
 
-        # Add the new server to our database
+        # Add the new server to our database and routing table
         self.hosts_db[message.source_id] = new_server_connection
+        self.route_host(new_server_connection)
 
         # If this is an adjacent server, send it information about all existing hosts
         if is_adjacent:
-            # First, send our own registration to the new server
-            reg_msg = ServerRegistrationMessage.bytes(
-                self.id,
-                0,  # we are the source, so last_hop is 0
-                self.server_name,
-                self.server_info
-            )
-            new_server_connection.write_buffer += reg_msg
-
-            # Then send info about all other hosts
-            for host_id, host_data in self.hosts_db.items():
-                # Don't send info about the new server back to itself
-                if host_id != message.source_id:
-                    if isinstance(host_data, ServerConnectionData):
-                        # Create server registration message
-                        reg_msg = ServerRegistrationMessage.bytes(
-                            host_data.id,
-                            self.id,  # we are forwarding, so we are the last hop
-                            host_data.server_name,
-                            host_data.server_info
-                        )
-                        new_server_connection.write_buffer += reg_msg
-                    elif isinstance(host_data, ClientConnectionData):
-                        # Create client registration message
-                        reg_msg = ClientRegistrationMessage.bytes(
-                            host_data.id,
-                            self.id,  # we are forwarding, so we are the last hop
-                            host_data.client_name,
-                            host_data.client_info
-                        )
-                        new_server_connection.write_buffer += reg_msg
-
-        # Broadcast this new server to all other servers (except the one that just registered)
-        broadcast_msg = ServerRegistrationMessage.bytes(
-            message.source_id,
-            self.id,  # we are forwarding, so we are the last hop
-            message.server_name,
-            message.server_info
-        )
-        self.broadcast_message_to_servers(broadcast_msg, ignore_host_id=message.source_id)
+            # First, send our own registration to the new server (unless we connected to it and already did), 
+            # followed by our capability announcement
+            if not new_server_connection.sent_registration:
+                self.send_registration(new_server_connection)
+            elif not self.announce_on_connect:
+                self.send_capability_announcement(new_server_connection)
+
+            # Then send info about all other hosts (but not about the new server back to itself). Unless the new
+            # server already announced its capabilities or cannot announce them anymore, the hosts known now are
+            # sent once it has, so they can be sent in the form it prefers. Hosts learned in the meantime are 
+            # forwarded to it as usual.
+            hosts = [host_data for host_data in self.hosts_db.values() if host_data is not new_server_connection]
+            if self.announce_capabilities and self.announcement_expected(new_server_connection):
+                timer = self.call_later(self.capability_timeout, self.send_pending_sync, new_server_connection)
+                new_server_connection.pending_sync = (hosts, timer)
+            else:
+                self.send_full_state(new_server_connection, hosts)
+
+        # Broadcast this new server to all other servers (except the one that just registered, or the adjacent 
+        # server that forwarded the registration to us)
+        ignore_host_id = message.source_id if is_adjacent else message.last_hop_id
+        self.broadcast_message_to_servers(new_server_connection.registration, ignore_host_id=ignore_host_id)
 
 ##############################################################################################################
 
@@ -607,9 +2635,7 @@ class CRCServer(object):
         You will need to determine if this new client is adjacent to the server processing this message. If 
         the new client is adjacent, add its ID to self.adjacent_client_ids and modify the assocated io_device 
         to replace the associated data object with your new ClientConnectionData object. You can do this by
-        calling: self.sel.modify(io_device.fileobj, 
-                                 selectors.EVENT_READ | selectors.EVENT_WRITE, 
-                                 my_new_client_connection_data_obj)
+        calling: self.attach_connection_data(io_device, my_new_client_connection_data_obj)
         You should also send a Welcome status update to the newly connected adjacent client. The message code 
         should be 0x00 and the message content should be "Welcome to the Clemson Relay Chat network [X]", 
         where [X] is the client's name. 
@@ -632,8 +2658,12 @@ class CRCServer(object):
         Returns:
             None        
         """
-        # 1. Check for duplicate ID
+        # 1. Check for duplicate ID (unless the client is moving over from an adjacent server that left, or 
+        # this is a mesh and its registration came around another path)
         if message.source_id in self.hosts_db:
+            if self.handle_handover_registration(io_device, message) or \
+                    self.handle_mesh_registration(io_device, message):
+                return
             error_msg = StatusUpdateMessage.bytes(
                 self.id,  # from this server
                 0,        # to unknown client (use 0)
@@ -643,12 +2673,13 @@ class CRCServer(object):
             self.send_message_to_unknown_io_device(io_device, error_msg)
             return
 
-        # 2. Create new client connection data
+        # 2. Create new client connection data, keeping the registration message as it is forwarded by us
         new_client_connection = ClientConnectionData(
             message.source_id,
             message.client_name,
             message.client_info
         )
+        new_client_connection.registration = message.forwarded_bytes(self.id)
 
         # 3. Determine if this is an adjacent client
         is_adjacent = (message.last_hop_id == 0)
@@ -657,10 +2688,9 @@ class CRCServer(object):
             # This client connected directly to us
             new_client_connection.first_link_id = self.id
             self.adjacent_user_ids.append(message.source_id)
+            self.routes.add_link(message.source_id, new_client_connection)
             # Update socket's associated data
-            self.sel.modify(io_device.fileobj, 
-                           selectors.EVENT_READ | selectors.EVENT_WRITE, 
-                           new_client_connection)
+            self.attach_connection_data(io_device, new_client_connection)
             
             # Send welcome message to new adjacent client
             welcome_msg = StatusUpdateMessage.bytes(
@@ -669,38 +2699,233 @@ class CRCServer(object):
                 0x00,  # welcome status code
                 f"Welcome to the Clemson Relay Chat network {message.client_name}"
             )
-            new_client_connection.write_buffer += welcome_msg
+            self.queue_message(new_client_connection, welcome_msg)
         else:
             # Non-adjacent client, route through last_hop_id
-            new_client_connection.first_link_id = message.last_hop_id
+            self.set_first_link(new_client_connection, message.last_hop_id)
 
-        # 4. Add to hosts database
+        # 4. Add to hosts database and routing table
         self.hosts_db[message.source_id] = new_client_connection
+        self.route_host(new_client_connection)
 
         # 5. If adjacent, send information about existing clients
         if is_adjacent:
-            for host_id, host_data in self.hosts_db.items():
-                if host_id != message.source_id:  # Don't send info about the new client to itself
-                    if isinstance(host_data, ClientConnectionData):
-                        # Create client registration message
-                        reg_msg = ClientRegistrationMessage.bytes(
-                            host_data.id,
-                            self.id,  # we are forwarding, so we are the last hop
-                            host_data.client_name,
-                            host_data.client_info
-                        )
-                        new_client_connection.write_buffer += reg_msg
-
-        # 6. Broadcast new client to network (except back to source)
-        broadcast_msg = ClientRegistrationMessage.bytes(
-            message.source_id,
-            self.id,  # we are forwarding, so we are the last hop
-            message.client_name,
-            message.client_info
-        )
+            # Don't send info about the new client to itself, nor about the clients it will be sent with the
+            # registrations collected for the presence window
+            presence = self.presence
+            self.queue_messages((new_client_connection,), (
+                host_data.registration for host_data in self.hosts_db.values()
+                if host_data is not new_client_connection and isinstance(host_data, ClientConnectionData)
+                and not presence.joining(host_data.id)))
+
+        # 6. Broadcast new client to network (except back to source), unless it is collected for the presence
+        # window
+        broadcast_msg = new_client_connection.registration
+        if self.collect_presence(new_client_connection, broadcast_msg):
+            return
         self.broadcast_message_to_servers(broadcast_msg, ignore_host_id=message.last_hop_id)
         self.broadcast_message_to_adjacent_clients(broadcast_msg, ignore_host_id=message.source_id)
 
+##############################################################################################################
+
+    def handle_handover_registration(self, io_device, message):
+        """ This function handles the registration of a host that is already registered, which is part of 
+        the handover of a departed server's links to its replacement in three cases:
+
+        * A host that was adjacent to the departed server reconnects to this server, its replacement. Its 
+            registration names the departed server as its last hop. The host becomes adjacent to this server.
+        * The replacement answers the registration this server sent it after the departed server left (see 
+            self.start_handover). The replacement becomes adjacent to this server, and every host that was 
+            reached through the departed server is now reached through it.
+        * A server that moved over to this server sends the registrations of the hosts on its side. They are 
+            now reached through it.
+
+        Nothing is forwarded: the rest of the network reaches the moved hosts through the same links as 
+        before. The departed server's handover is finished as soon as all of its hosts have been reached again.
+
+        A host can reconnect before this server has handled the departed server's quit message, which is sent 
+        to the hosts that move over at the same time. A registration that names the adjacent server the host 
+        is reached through as its last hop is held until that server leaves (see 
+        self.hold_handover_registration).
+
+        Args:
+            io_device (SelectorKey): the key of the socket the registration was received over
+            message (RegistrationMessage): the registration message of the known host
+        Returns:
+            bool: whether the registration was part of a handover (otherwise it is a duplicate ID)
+        """
+        host = self.hosts_db[message.source_id]
+        link = io_device.data
+        departed_id = host.first_link_id
+        departed = self.departed.get(departed_id)
+
+        if isinstance(link, ServerConnectionData):
+            # A route update from a server that moved over to us
+            if link.replaces is None or departed_id != link.replaces or message.last_hop_id != link.id:
+                return False
+            self.reroute_hosts((host,), link.id)
+        elif isinstance(link, ClientConnectionData):
+            return False
+        elif departed is None:
+            if message.last_hop_id != departed_id or departed_id not in self.adjacent_server_ids:
+                return False
+            if link in self.expired_handovers:
+                self.expired_handovers.discard(link)
+                return False
+            self.hold_handover_registration(io_device, message, departed_id)
+            return True
+        elif message.last_hop_id == 0:
+            # The replacement we reconnected to answered
+            if departed[1] != host.id or not isinstance(host, ServerConnectionData):
+                return False
+            self.adopt_host(io_device, host, departed_id)
+            hosts_db = self.hosts_db
+            moved = self.routes.move_link(departed_id, host.id)
+            for host_id in moved:
+                hosts_db[host_id].first_link_id = host.id
+            moved = len(moved)
+            self.print_info("Moved %i hosts from Host ID #%s to Host ID #%s" % (moved, departed_id, host.id))
+        elif message.last_hop_id == departed_id and departed[1] == self.id:
+            # A host that was adjacent to the departed server reconnected to us
+            self.adopt_host(io_device, host, departed_id)
+            self.print_info("Host ID #%s moved over from Host ID #%s" % (host.id, departed_id))
+        else:
+            return False
+
+        if departed is not None and not self.routes.routed_through(departed_id):
+            self.finish_handover(departed_id)
+        return True
+
+    def hold_handover_registration(self, io_device, message, departed_id):
+        """ This function holds the registration of a known host that moved over from an adjacent server that
+        has not left yet. The registration is put back at the front of the connection's inbox and the 
+        connection is paused like an upstream of a congested connection, so it is handled again, in order with 
+        the messages received after it, once the server's quit message has been handled (see 
+        self.release_handover_registrations). If the server has not left after HANDOVER_TIMEOUT seconds, the 
+        registration is handled again as a duplicate ID.
+
+        Args:
+            io_device (SelectorKey): the key of the socket the registration was received over
+            message (RegistrationMessage): the registration message of the known host
+            departed_id (int): the ID of the adjacent server the host is reached through
+        Returns:
+            None        
+        """
+        link = io_device.data
+        data = message.bytes
+        link.inbox.appendleft((message.message_type, message.source_id, message.last_hop_id, memoryview(data),
+                               time.monotonic()))
+        link.inbox_bytes += len(data)
+        link.paused_by += 1
+        if link.paused_by == 1:
+            self.set_reading(link, False)
+
+        held = self.held_handovers.get(departed_id)
+        if held is None:
+            timer = self.call_later(HANDOVER_TIMEOUT, self.release_handover_registrations, departed_id, True)
+            held = self.held_handovers[departed_id] = ([], timer)
+        held[0].append(link)
+        self.print_info("Holding the registration of Host ID #%s until Host ID #%s leaves" % (message.source_id,
+                                                                                             departed_id))
+
+    def release_handover_registrations(self, departed_id, expired=False):
+        """ This function resumes the connections holding registrations of hosts that moved over from an 
+        adjacent server, once it has left or HANDOVER_TIMEOUT has passed (see self.hold_handover_registration).
+
+        Args:
+            departed_id (int): the ID of the server the hosts moved over from
+            expired (bool): whether the held registrations are duplicate IDs
+        Returns:
+            None        
+        """
+        held = self.held_handovers.pop(departed_id, None)
+        if held is None:
+            return
+        links, timer = held
+        timer.cancel()
+        for link in links:
+            if expired:
+                self.expired_handovers.add(link)
+            self.resume_reading(link)
+
+    def adopt_host(self, io_device, host, departed_id):
+        """ This function makes a known host that moved over from a departed server adjacent to this server,
+        keeping its connection data object (and cached registration).
+
+        Args:
+            io_device (SelectorKey): the key of the socket the host registered over
+            host (BaseConnectionData): the host's connection data object
+            departed_id (int): the ID of the server the host was reached through
+        Returns:
+            None        
+        """
+        self.routes.add_link(host.id, host)
+        self.reroute_hosts((host,), host.id)
+        self.attach_connection_data(io_device, host)
+        if isinstance(host, ServerConnectionData):
+            host.replaces = departed_id
+            self.adjacent_server_ids.append(host.id)
+            if not host.sent_registration:
+                self.send_registration(host)
+            else:
+                self.send_capability_announcement(host)
+        else:
+            self.adjacent_user_ids.append(host.id)
+
+    def handle_mesh_registration(self, io_device, message):
+        """ This function handles the registration of a host that is already registered, in a mesh:
+
+        * A copy of a registration that reached this server over another path (e.g. in the full-state sync 
+            of a new link, or flooded by another server) arrives over a server link. It is dropped if it 
+            matches the cached registration of the host apart from its last hop; a different host that 
+            registered with the same ID elsewhere is a duplicate ID.
+        * A mesh server this server reaches through another path links up with it directly. The server 
+            becomes adjacent over a redundant link, without a full-state sync or a broadcast, since both ends 
+            know the network already.
+
+        Args:
+            io_device (SelectorKey): the key of the socket the registration was received over
+            message (RegistrationMessage): the registration message of the known host
+        Returns:
+            bool: whether the registration was handled (otherwise it is a duplicate ID)
+        """
+        if not self.mesh:
+            return False
+        host = self.hosts_db[message.source_id]
+        link = io_device.data
+        if isinstance(link, ServerConnectionData):
+            return message.forwarded_bytes(self.id) == host.registration
+        if isinstance(link, ClientConnectionData) or message.last_hop_id != 0 or \
+                not isinstance(host, ServerConnectionData) or host.first_link_id == self.id:
+            return False
+        self.adopt_host(io_device, host, None)
+        self.print_info("Host ID #%s linked up over a redundant link" % host.id)
+        return True
+
+    def set_first_link(self, host, last_hop_id):
+        """ This function sets the first link of a new host that is not adjacent. It is the server that 
+        forwarded the host's registration, unless the registration was flooded through a mesh: the host is 
+        then reached through the mesh server that flooded it, and routed over the first hop of a shortest path
+        to it (or to the host itself, if it is a mesh server).
+
+        Args:
+            host (BaseConnectionData): the connection data object of the new host
+            last_hop_id (int): the ID of the server that forwarded the registration
+        Returns:
+            None        
+        """
+        if self.current_flood is None:
+            host.first_link_id = last_hop_id
+            return
+        flood, arrival_id = self.current_flood
+        host.home_id = flood.source_id
+        homed = self.mesh_homes.get(flood.source_id)
+        if homed is None:
+            homed = self.mesh_homes[flood.source_id] = set()
+        homed.add(host.id)
+        next_hops = self.mesh_next_hops
+        host.first_link_id = next_hops.get(host.id) or next_hops.get(flood.source_id) or arrival_id
+
 ##############################################################################################################
 
     def handle_status_message(self, io_device, message):
@@ -719,8 +2944,11 @@ class CRCServer(object):
         Returns:
             None        
         """
+        # Capability announcements are addressed to no host in particular
+        if CapabilityAnnouncement.is_announcement(message):
+            self.handle_capability_announcement(io_device, message)
         # Check if message is for us (our ID or broadcast 0)
-        if message.destination_id == self.id or message.destination_id == 0:
+        elif message.destination_id == self.id or message.destination_id == 0:
             # Log the status message
             self.status_updates_log.append(message.content)
         # If not for us and destination exists, forward it
@@ -760,6 +2988,67 @@ class CRCServer(object):
             )
             self.send_message_to_host(message.source_id, error_msg)
 
+##############################################################################################################
+
+    def relay_status_message(self, source_id, destination_id, data):
+        """ This function is the fast path of handle_status_message for status messages that are addressed 
+        to another host, which are forwarded without being parsed.
+
+        Args:
+            source_id (int): the ID of the host that sent the message
+            destination_id (int): the ID of the host the message is addressed to
+            data (memoryview): the message
+        Returns:
+            bool: False if the message is addressed to this server and must be handled by 
+                handle_status_message, True otherwise
+        """
+        if destination_id == self.id or destination_id == 0 or destination_id == CAPABILITIES_ID:
+            return False
+        if destination_id in self.hosts_db:
+            self.relay_message_to_host(source_id, destination_id, data)
+        return True
+
+    def relay_client_chat_message(self, source_id, destination_id, data):
+        """ This function is the fast path of handle_client_chat_message for chat messages addressed to a 
+        known client, which are forwarded without being parsed.
+
+        Args:
+            source_id (int): the ID of the client that sent the message
+            destination_id (int): the ID of the client the message is addressed to
+            data (memoryview): the message
+        Returns:
+            bool: False if the destination is unknown and handle_client_chat_message must answer the message, 
+                True otherwise
+        """
+        if not isinstance(self.hosts_db.get(destination_id), ClientConnectionData):
+            return False
+        self.relay_message_to_host(source_id, destination_id, data)
+        return True
+
+    def relay_message_to_host(self, source_id, destination_id, data):
+        """ This function queues a received message on the connection of the next hop to its destination. 
+        The message normally stays a view of the chunk it was received in until it is sent, which saves copying
+        it. If the connection is backing up the message is copied, so waiting output does not keep whole receive
+        chunks alive. The collected registration of a client that sends a message during the presence window
+        is sent first.
+
+        Args:
+            source_id (int): the ID of the host that sent the message
+            destination_id (int): the ID of the destination machine
+            data (memoryview): the message
+        Returns:
+            None
+        """
+        if self.presence.pending and self.presence.joining(source_id):
+            # The destination must hear of a client that just registered before it hears from it
+            self.flush_presence()
+        connection = self.get_outbound_connection(destination_id)
+        if connection:
+            self.print_info("Relaying msg from Host ID #%s to Host ID #%s" % (source_id, destination_id))
+            if connection.pending_bytes >= self.write_low_watermark:
+                data = data.tobytes()
+            self.queue_message(connection, data)
+
 ##############################################################################################################
 
     def handle_client_quit_message(self, io_device, message):
@@ -784,16 +3073,334 @@ class CRCServer(object):
             client_data = self.hosts_db[message.source_id]
             ignore_server_id = client_data.first_link_id
             
-            # Broadcast quit message to network (except back to quitting client's path)
-            self.broadcast_message_to_servers(message.bytes, ignore_host_id=ignore_server_id)
-            self.broadcast_message_to_adjacent_clients(message.bytes, ignore_host_id=message.source_id)
+            # Broadcast quit message to network (except back to quitting client's path), unless it is collected
+            # for the presence window
+            if not self.collect_presence(client_data, message.bytes):
+                self.broadcast_message_to_servers(message.bytes, ignore_host_id=ignore_server_id)
+                self.broadcast_message_to_adjacent_clients(message.bytes, ignore_host_id=message.source_id)
             
-            # Remove from adjacent_user_ids if it was adjacent
-            if message.source_id in self.adjacent_user_ids:
-                self.adjacent_user_ids.remove(message.source_id)
+            # Remove from adjacent_user_ids and the routing index if it was adjacent, and from the routing table
+            self.adjacent_user_ids.discard(message.source_id)
+            self.routes.remove_link(message.source_id)
+            self.unroute_host(client_data)
             
             # Remove from hosts database
             del self.hosts_db[message.source_id]
+
+##############################################################################################################
+
+    def handle_server_quit_message(self, io_device, message):
+        """ This function handles a server leaving the network (see self.depart). 
+
+        A server that is not adjacent is removed from hosts_db and the message is forwarded to the other 
+        adjacent servers; the hosts behind it are announced by the servers next to it. If an adjacent server 
+        leaves without a replacement, it is removed together with the hosts reached through it, like a failed
+        link. If it names a replacement, the hosts reached through it stay registered while this server 
+        reconnects to the replacement (unless it is the replacement), and the routes to them are rewritten 
+        once they are reached again (see self.handle_handover_registration). The hosts that are not reached 
+        again within HANDOVER_TIMEOUT seconds are removed.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (ServerQuitMessage): The server quit message that needs to be processed
+        Returns:
+            None        
+        """
+        server = self.hosts_db.get(message.source_id)
+        if not isinstance(server, ServerConnectionData):
+            return
+
+        if server.first_link_id != self.id:
+            self.unroute_host(server)
+            del self.hosts_db[server.id]
+            self.queue_messages(self.failover_connections(self.adjacent_server_ids, server.first_link_id), 
+                                (message.bytes,))
+            if self.mesh:
+                self.forget_mesh_servers((server.id,))
+            return
+
+        self.release_handover_registrations(server.id)
+        replacement_id = message.replacement_id
+        if not replacement_id or (replacement_id != self.id and replacement_id not in self.hosts_db):
+            self.print_info("Host ID #%s left without a replacement: %s" % (server.id, message.content))
+            self.prune_link(server)
+            return
+
+        self.print_info("Host ID #%s left, Host ID #%s replaces it" % (server.id, replacement_id))
+        del self.hosts_db[server.id]
+        self.adjacent_server_ids.discard(server.id)
+        self.routes.remove_link(server.id)
+        self.unroute_host(server)
+        if self.mesh:
+            self.forget_mesh_servers((server.id,))
+        self.queue_messages(self.failover_connections(self.adjacent_server_ids), (message.bytes,))
+        timer = self.call_later(HANDOVER_TIMEOUT, self.finish_handover, server.id)
+        self.departed[server.id] = (server, replacement_id, timer)
+        if replacement_id != self.id:
+            self.connect_to_replacement(server.id, message.content)
+        elif not self.routes.routed_through(server.id):
+            # Every host behind it already moved over to us
+            self.finish_handover(server.id)
+
+##############################################################################################################
+
+    def handle_roster_snapshot_message(self, io_device, message):
+        """ This function handles a roster snapshot sent by an adjacent server, which registers every host in 
+        it in one go. It is equivalent to handling a registration message for each of the hosts: every host 
+        whose ID is not known yet is added to self.hosts_db with the sending server as its first link and 
+        forwarded to the rest of the network (as a roster snapshot to the adjacent servers that accept them),
+        and a duplicate ID is reported the way handle_server_registration_message() and
+        handle_client_registration_message() report it.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (RosterSnapshotMessage): The roster snapshot to be processed
+        Returns:
+            None
+        """
+        hosts_db = self.hosts_db
+        routes = self.routes
+        registrations = []
+        for message_type, host_id, name_length, info_length, strings in message.hosts():
+            if host_id in hosts_db:
+                duplicate = "A machine" if message_type == 0x00 else "Someone"
+                error_msg = StatusUpdateMessage.bytes(self.id, 0, 0x02, 
+                                                      f"{duplicate} has already registered with ID {host_id}")
+                self.send_message_to_unknown_io_device(io_device, error_msg)
+                continue
+
+            name, info = str(strings[:name_length], 'utf-8'), str(strings[name_length:], 'utf-8')
+            if message_type == 0x00:
+                host = ServerConnectionData(host_id, name, info)
+            else:
+                host = ClientConnectionData(host_id, name, info)
+            host.first_link_id = message.source_id
+            host.registration = SERVER_REGISTRATION_HEADER.pack(message_type, host_id, self.id, name_length, 
+                                                                info_length) + strings
+            hosts_db[host_id] = host
+            routes.add(host_id, message.source_id)
+            registrations.append(host.registration)
+
+        for server_id in self.adjacent_server_ids:
+            connection = self.adjacent_connections.get(server_id)
+            if server_id != message.source_id and connection:
+                self.send_registrations(connection, registrations)
+        client_registrations = [registration for registration in registrations if registration[0] == 0x80]
+        if client_registrations:
+            for client_id in self.adjacent_user_ids:
+                connection = self.adjacent_connections.get(client_id)
+                if connection:
+                    self.queue_messages((connection,), client_registrations)
+
+    def handle_link_state_message(self, io_device, message):
+        """ This function handles the link state of a mesh server, flooded by it whenever one of its mesh 
+        links came up or went down. A link state newer than the one kept for the server replaces it, is 
+        forwarded to the other adjacent mesh servers and the routes are recomputed (see 
+        self.compute_mesh_routes); older ones are dropped. A link state of this server's own that is at least
+        as new as its current one (e.g. from before it rejoined) makes it flood its link state again under a
+        higher sequence number.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (LinkStateMessage): The link state to be processed
+        Returns:
+            None
+        """
+        link = io_device.data
+        if not self.mesh or not isinstance(link, ServerConnectionData):
+            return
+        if message.source_id == self.id:
+            if message.seq >= self.link_state_seq:
+                self.link_state_seq = message.seq
+                self.originate_link_state()
+            return
+        if self.link_states.get(message.source_id, NO_LINK_STATE)[0] >= message.seq:
+            return
+        self.link_states[message.source_id] = (message.seq, frozenset(message.neighbours))
+        self.mesh_counters['link_states'] += 1
+        self.queue_messages(self.mesh_connections(link.id), (message.bytes,))
+        self.compute_mesh_routes()
+
+    def handle_flood_message(self, io_device, message):
+        """ This function handles a message flooded through a mesh. Unless it is a copy of a message this 
+        server handled already (see FloodWindow) or one it flooded itself, the message inside is handled by 
+        its handler as if it had been received on its own, while self.current_flood holds the flooded message 
+        and the link it came in on: broadcasts are then forwarded as the same flooded message (see 
+        self.flood_message) and new hosts are reached through its source (see self.set_first_link). Flooded
+        messages with sequence number 0 are part of a full-state sync and are never copies.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (FloodMessage): The flooded message to be processed
+        Returns:
+            None
+        """
+        link = io_device.data
+        if not self.mesh or not isinstance(link, ServerConnectionData):
+            return
+        if message.seq:
+            window = self.flood_windows.get(message.source_id)
+            if window is None and message.source_id != self.id:
+                window = self.flood_windows[message.source_id] = FloodWindow()
+            if window is None or not window.add(message.seq):
+                self.mesh_counters['duplicate_floods'] += 1
+                return
+        inner = message.message
+        if inner.message_type not in FLOODED_MESSAGE_TYPES:
+            return
+        previous = self.current_flood
+        self.current_flood = (message, link.id)
+        try:
+            self.message_handlers[inner.message_type](io_device, inner)
+        finally:
+            self.current_flood = previous
+
+##############################################################################################################
+
+    def send_registration(self, connection, announce=True):
+        """ This function introduces this server to an adjacent server: it queues this server's registration 
+        message (with last_hop_id=0), by default followed right away by its capability announcement. Announcing 
+        without waiting for the other side lets the other server send its full state as soon as the registration
+        is handled. Servers that predate capabilities drop the announcement, since it is addressed to a host that
+        does not exist.
+
+        Args:
+            connection (BaseConnectionData): the connection to the adjacent server
+            announce (bool): whether to queue the capability announcement too
+        Returns:
+            None
+        """
+        reg_msg = ServerRegistrationMessage.bytes(self.id, 0, self.server_name, self.server_info)
+        self.queue_message(connection, reg_msg)
+        connection.sent_registration = True
+        if announce:
+            self.send_capability_announcement(connection)
+
+    def announcement_expected(self, connection):
+        """ This function tells whether a new adjacent server that just registered may still announce its 
+        capabilities. Servers announce right behind their registration, so once anything else was received 
+        behind it, the server predates capabilities and its full-state sync is not put off.
+
+        Args:
+            connection (ServerConnectionData): the new adjacent server
+        Returns:
+            bool: False if the server announced already or received messages show it will not
+        """
+        if connection.capabilities is not NO_CAPABILITIES:
+            return False
+        if not connection.inbox:
+            return True
+        message_type, source_id, destination_id, data, received_at = connection.inbox[0]
+        return message_type == 0x01 and destination_id == CAPABILITIES_ID
+
+    def send_capability_announcement(self, connection):
+        """ This function announces the optional protocol features this server supports to an adjacent host.
+        Servers are sent it right behind this server's registration, clients in reply to their own announcement.
+
+        Args:
+            connection (BaseConnectionData): the connection to the adjacent host
+        Returns:
+            None
+        """
+        if self.announce_capabilities:
+            self.queue_message(connection, CapabilityAnnouncement.bytes(self.id, self.capabilities))
+
+    def send_full_state(self, connection, hosts):
+        """ This function sends the registrations of the given hosts to a new adjacent server. A mesh server 
+        is sent each one in a flooded message with sequence number 0, naming the mesh server the host is 
+        reached through (this server for the hosts that were not flooded to it).
+
+        Args:
+            connection (ServerConnectionData): the new adjacent server
+            hosts (list): the connection data objects of the hosts to send
+        Returns:
+            None
+        """
+        if self.mesh and 'mesh' in connection.capabilities:
+            self.queue_messages((connection,), [FloodMessage.bytes(host_data.home_id or self.id, 0, 
+                                                                   host_data.registration) for host_data in hosts])
+            return
+        self.send_registrations(connection, [host_data.registration for host_data in hosts])
+
+    def send_registrations(self, connection, registrations):
+        """ This function sends cached registration messages to an adjacent server, packed into roster 
+        snapshots of at most MAX_SNAPSHOT_HOSTS hosts if the server accepts them.
+
+        Args:
+            connection (ServerConnectionData): the server to send the registrations to
+            registrations (list): the encoded registration messages
+        Returns:
+            None
+        """
+        if not registrations:
+            return
+        if self.roster_snapshots and 'snapshot' in connection.capabilities:
+            for start in range(0, len(registrations), MAX_SNAPSHOT_HOSTS):
+                snapshot = RosterSnapshotMessage.bytes(self.id, registrations[start:start+MAX_SNAPSHOT_HOSTS])
+                self.queue_message(connection, snapshot)
+        else:
+            self.queue_messages((connection,), registrations)
+
+    def send_pending_sync(self, connection):
+        """ This function sends the full-state sync that was put off until a new adjacent server announced its
+        capabilities, either because it did or because the capability timeout expired. Hosts that quit in the 
+        meantime are left out; their quit messages were forwarded to the server already.
+
+        Args:
+            connection (ServerConnectionData): the new adjacent server
+        Returns:
+            None
+        """
+        if connection.pending_sync is None:
+            return
+        hosts, timer = connection.pending_sync
+        connection.pending_sync = None
+        timer.cancel()
+        if self.hosts_db.get(connection.id) is not connection:
+            return
+        hosts_db = self.hosts_db
+        self.send_full_state(connection, [host_data for host_data in hosts 
+                                          if hosts_db.get(host_data.id) is host_data])
+
+    def handle_capability_announcement(self, io_device, message):
+        """ This function handles the capability announcement of an adjacent host. The announced capabilities
+        are stored on the host's connection data object and decide which optional features are used when 
+        sending to it from now on: batching (see self.batch_output) and compression with the first codec of 
+        self.compression the host accepts (see self.compress_output). Clients only receive this server's 
+        announcement in reply to their own, since only clients that announce capabilities know to expect one. 
+        Announcements are never forwarded.
+
+        Args:
+            io_device (SelectorKey): This object contains references to the socket (io_device.fileobj) and to 
+                the data associated with the socket on registering with the selector (io_device.data).
+            message (StatusUpdateMessage): The capability announcement to be processed
+        Returns:
+            None
+        """
+        connection = io_device.data
+        if (not self.announce_capabilities or connection.capabilities is not NO_CAPABILITIES or 
+                connection.connection_class == 'unregistered'):
+            # Announcements of hosts whose registration was rejected are ignored
+            return
+        connection.capabilities = CapabilityAnnouncement.capabilities(message)
+        self.print_info("Host ID #%s supports %s" % (message.source_id, ", ".join(connection.capabilities)))
+        if connection.connection_class == 'client':
+            self.send_capability_announcement(connection)
+        elif connection.pending_sync is not None:
+            self.send_pending_sync(connection)
+        if self.mesh and 'mesh' in connection.capabilities and connection.connection_class == 'server':
+            self.mesh_link_up(connection)
+
+        accepted = [COMPRESSION_CODECS[codec] for codec in connection.capabilities.get('compress', ()) 
+                    if codec in COMPRESSION_CODECS]
+        codec = next((codec for codec in self.compression if codec in accepted), None)
+        if codec is not None and connection.connection_class == 'server':
+            self.print_info("Compressing the link to Host ID #%s with codec %i" % (message.source_id, codec))
+            connection.compressor = LinkCompressor(self.id, codec, self.compression_level)
     
 ##############################################################################################################    
     
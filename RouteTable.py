@@ -0,0 +1,123 @@
+##############################################################################################################
+
+class RouteTable():
+    """ RouteTable maps the ID of every host a server can send messages to onto the ID of the adjacent host
+    (the link) the messages are written to, and every link onto its connection, so the connection for a
+    destination is found with two dictionary lookups (see lookup()). An adjacent host is its own link.
+
+    The table also keeps a reverse index from every link to the destinations routed through it (not counting
+    the link itself), so the hosts behind a link can be moved to another link or removed together in time
+    proportional to their number (see move_link() and pop_link_routes()). Removing a link's connection (see
+    remove_link()) leaves its routes in place: they are unreachable until they are moved or removed.
+
+    The table does not know about connection data objects or hosts_db beyond the connections of the links, so
+    any server engine can use it.
+    """
+    __slots__ = ('next_hops', 'links', 'routed')
+
+    def __init__(self):
+        self.next_hops = {}     # Destination IDs to the IDs of their links
+        self.links = {}         # Link IDs to the connections of the adjacent hosts
+        self.routed = {}        # Link IDs to the sets of destination IDs routed through them
+
+    def __len__(self):
+        return len(self.next_hops)
+
+    def __contains__(self, destination_id):
+        return destination_id in self.next_hops
+
+    def lookup(self, destination_id):
+        """ Returns the connection messages for destination_id are written to, or None if it is unreachable """
+        return self.links.get(self.next_hops.get(destination_id))
+
+    def next_hop(self, destination_id):
+        """ Returns the ID of the link of destination_id, or None if it has no route """
+        return self.next_hops.get(destination_id)
+
+    def routed_through(self, link_id):
+        """ Returns the IDs of the destinations routed through link_id, except link_id itself """
+        return self.routed.get(link_id) or frozenset()
+
+    def add_link(self, link_id, connection):
+        """ Adds (or replaces) the connection of an adjacent host and routes the host over it """
+        self.links[link_id] = connection
+        self.add(link_id, link_id)
+
+    def remove_link(self, link_id):
+        """ Removes the connection of an adjacent host; the routes through it stay until moved or removed """
+        self.links.pop(link_id, None)
+
+    def add(self, destination_id, link_id):
+        """ Routes destination_id through link_id, replacing the route it had """
+        previous = self.next_hops.get(destination_id)
+        if previous == link_id:
+            return
+        if previous is not None and previous != destination_id:
+            self.routed[previous].discard(destination_id)
+        self.next_hops[destination_id] = link_id
+        if link_id != destination_id:
+            routed = self.routed.get(link_id)
+            if routed is None:
+                routed = self.routed[link_id] = set()
+            routed.add(destination_id)
+
+    def remove(self, destination_id):
+        """ Removes the route of destination_id and returns the ID of its link, or None if it had none """
+        link_id = self.next_hops.pop(destination_id, None)
+        if link_id is not None and link_id != destination_id:
+            self.routed[link_id].discard(destination_id)
+        return link_id
+
+    def move(self, destination_ids, link_id):
+        """ Routes every destination in destination_ids through link_id """
+        for destination_id in destination_ids:
+            self.add(destination_id, link_id)
+
+    def move_link(self, old_link_id, new_link_id):
+        """ Routes every destination routed through old_link_id through new_link_id instead, and returns their
+        IDs. The route of old_link_id itself is left alone. """
+        moved = self.routed.pop(old_link_id, None)
+        if not moved:
+            return frozenset()
+        moved.discard(new_link_id)
+        next_hops = self.next_hops
+        for destination_id in moved:
+            next_hops[destination_id] = new_link_id
+        routed = self.routed.get(new_link_id)
+        if routed is None:
+            self.routed[new_link_id] = set(moved)
+        else:
+            routed |= moved
+        if next_hops.get(new_link_id) == old_link_id:
+            next_hops[new_link_id] = new_link_id
+        return moved
+
+    def pop_link_routes(self, link_id):
+        """ Removes the routes of every destination routed through link_id and returns their IDs. The route
+        of link_id itself is left alone. """
+        removed = self.routed.pop(link_id, None)
+        if not removed:
+            return frozenset()
+        next_hops = self.next_hops
+        for destination_id in removed:
+            del next_hops[destination_id]
+        return removed
+
+    def rebuild(self, routes):
+        """ Replaces every route with the (destination ID, link ID) pairs in routes, in one pass. The links
+        are kept. """
+        next_hops = dict(routes)
+        routed = {}
+        for destination_id, link_id in next_hops.items():
+            if link_id != destination_id:
+                destinations = routed.get(link_id)
+                if destinations is None:
+                    destinations = routed[link_id] = set()
+                destinations.add(destination_id)
+        self.next_hops = next_hops
+        self.routed = routed
+
+    def clear(self):
+        self.next_hops.clear()
+        self.links.clear()
+        self.routed.clear()
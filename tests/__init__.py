@@ -0,0 +1,58 @@
+import unittest, selectors
+from optparse import Values
+from ChatServer import CRCServer
+from ChatMessageParser import MessageParser
+
+class ServerTestCase(unittest.TestCase):
+    """ Base class of the tests that hand messages to servers directly instead of sending them over sockets.
+    A connection's data object stands in for its socket: received bytes are handed to the server with
+    self.deliver, and what the server sent is read from the connection's write queue. Tests that connect
+    several servers keep self.wires, a list of [server, connection, peer, peer connection] lists, which
+    self.pump delivers the output of. """
+
+    def start_server(self, id, name, port, **options):
+        """ Creates a server that is closed again after the test """
+        options = Values(dict({'id': id, 'servername': name, 'info': 'Test server', 'port': port,
+                               'connect_to_host': None, 'connect_to_port': None, 'log_file': None}, **options))
+        server = CRCServer(options, run_on_localhost=True)
+        self.addCleanup(server.sel.close)
+        self.addCleanup(server.wakeup.close)
+        return server
+
+    def deliver(self, server, connection, data):
+        """ Hands data to a server as if it was received over connection and dispatches all of it """
+        io_device = connection.io_device or selectors.SelectorKey(None, 0, selectors.EVENT_READ, connection)
+        server.handle_messages(io_device, memoryview(data))
+        while server.ready_connections:
+            server.dispatch_ready_connections()
+
+    def receive(self, connection, data):
+        """ Delivers data to self.server, in tests of a single server """
+        self.deliver(self.server, connection, data)
+
+    def received(self, connection):
+        """ Takes the messages queued on a connection """
+        data = b''.join(connection.write_queue)
+        connection.write_queue.clear()
+        connection.pending_bytes = 0
+        return MessageParser.parse_messages(data)
+
+    def current(self, connection):
+        """ The data object that replaced a connection's data object when it registered, if any """
+        return connection.io_device.data if connection.io_device else connection
+
+    def pump(self):
+        """ Delivers everything queued on the wires until the network is quiet """
+        moved = True
+        while moved:
+            moved = False
+            for wire in self.wires:
+                wire[1], wire[3] = self.current(wire[1]), self.current(wire[3])
+                for source, destination, link in ((1, 2, 3), (3, 0, 1)):
+                    connection = self.current(wire[source])
+                    data = b''.join(connection.write_queue)
+                    if data:
+                        connection.write_queue.clear()
+                        connection.pending_bytes = 0
+                        self.deliver(wire[destination], self.current(wire[link]), data)
+                        moved = True
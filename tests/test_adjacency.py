@@ -0,0 +1,55 @@
+from ChatServer import BaseConnectionData, AdjacentIds
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestAdjacency(ServerTestCase):
+    def setUp(self):
+        self.server = self.start_server(1, 'theshire', 47170, info='Home of the Hobbits')
+
+
+    def test_adjacent_ids_keep_the_list_operations(self):
+        ids = AdjacentIds([3, 1])
+        ids.append(2)
+        ids.append(3)
+        self.assertEqual(ids, [3, 1, 2])
+        self.assertEqual(ids, (3, 1, 2))
+        self.assertEqual(ids, AdjacentIds([3, 1, 2]))
+        self.assertNotEqual(ids, [1, 2, 3])
+        self.assertEqual((len(ids), list(ids)), (3, [3, 1, 2]))
+        self.assertIn(1, ids)
+        self.assertNotIn(4, ids)
+        self.assertEqual(repr(ids), "[3, 1, 2]")
+
+        ids.extend([4, 1, 5])
+        self.assertEqual(ids, [3, 1, 2, 4, 5])
+        ids.remove(1)
+        with self.assertRaises(ValueError):
+            ids.remove(1)
+        ids.discard(1)
+        ids.discard(4)
+        self.assertEqual(ids, [3, 2, 5])
+        ids.clear()
+        self.assertEqual((len(ids), ids), (0, []))
+
+    def test_adjacent_ids_have_no_positions(self):
+        ids = AdjacentIds([3, 1])
+        with self.assertRaises(TypeError):
+            ids[0]
+        with self.assertRaises(TypeError):
+            ids[0] = 2
+        with self.assertRaises(AttributeError):
+            ids.insert(0, 2)
+        with self.assertRaises(TypeError):
+            ids + [2]
+
+    def test_quits_remove_adjacent_clients(self):
+        for client_id in range(101, 111):
+            self.receive(BaseConnectionData(), ClientRegistrationMessage.bytes(client_id, 0, "hobbit%i" % client_id,
+                                                                               "Lives in the Shire"))
+        self.assertIsInstance(self.server.adjacent_user_ids, AdjacentIds)
+        self.assertEqual(self.server.adjacent_user_ids, list(range(101, 111)))
+
+        for client_id in range(101, 111, 2):
+            self.receive(self.server.hosts_db[client_id], ClientQuitMessage.bytes(client_id, "Bye"))
+        self.assertEqual(self.server.adjacent_user_ids, list(range(102, 111, 2)))
+        self.assertEqual(set(self.server.adjacent_connections), set(range(102, 111, 2)))
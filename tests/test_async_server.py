@@ -0,0 +1,46 @@
+import unittest
+from CRCTestManager import CRCTestManager
+from AsyncChatServer import AsyncCRCServer
+
+class TestAsyncServer(unittest.TestCase):
+    def setUp(self):
+        pass
+    
+    def tearDown(self):
+        pass
+
+
+    def test_three_servers_four_clients(self):
+        test_manager = CRCTestManager(AsyncCRCServer)
+    
+        CRC_connection_tests = {
+            # Tests client registration with the asyncio engine
+            '3_3_ThreeServers_FourClients':1,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
+
+
+    def test_message_three_hops(self):
+        test_manager = CRCTestManager(AsyncCRCServer)
+    
+        CRC_connection_tests = {
+            # Tests chat message routing with the asyncio engine
+            '4_3_Message_Three_Hops':1,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
+
+
+    def test_client_quit_three_servers(self):
+        test_manager = CRCTestManager(AsyncCRCServer)
+    
+        CRC_connection_tests = {
+            # Tests client quit messages with the asyncio engine
+            '6_2_ClientQuit_ThreeServers':1,
+        }
+
+        result = test_manager.run_tests(CRC_connection_tests)
+        self.assertTrue(result[1][0]['passed'], result[1][0]['errors'])
@@ -0,0 +1,117 @@
+import unittest, threading, time, socket
+from optparse import Values
+from ChatServer import CRCServer
+from AsyncChatServer import AsyncCRCServer
+from ChatMessageParser import *
+
+MESSAGE_COUNT = 4000
+
+class TestBackpressure(unittest.TestCase):
+    def setUp(self):
+        self.sockets = []
+
+    def tearDown(self):
+        for sock in self.sockets:
+            sock.close()
+
+
+    def start_server(self, server_class, policy):
+        options = Values({'id': 1, 'servername': 'theshire', 'info': 'Home of the Hobbits', 'port': 47060,
+                          'connect_to_host': None, 'connect_to_port': None, 'log_file': None,
+                          'write_high_watermark': 64 * 1024, 'write_low_watermark': 16 * 1024,
+                          'slow_consumer_timeout': 0.3, 'slow_consumer_policy': policy})
+        server = server_class(options, run_on_localhost=True)
+        thread = threading.Thread(target=server.run)
+        thread.start()
+        time.sleep(0.2)
+        return server, thread
+
+    def connect_client(self, client_id, name, receive_buffer=None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if receive_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+        sock.connect(('127.0.0.1', 47060))
+        sock.sendall(ClientRegistrationMessage.bytes(client_id, 0, name, 'Test info'))
+        self.sockets.append(sock)
+        return sock
+
+    def receive_chat(self, sock, count, received, timeout=10):
+        """ Reads until count chat messages have arrived, the connection closes or the timeout expires """
+        sock.settimeout(timeout)
+        decoder = MessageFrameDecoder()
+        try:
+            while len(received) < count:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                received.extend(m.content for m in decoder.feed(data) if m.message_type == 0x81)
+        except OSError:
+            pass
+
+    def blast(self, sender):
+        """ Sends MESSAGE_COUNT chat messages each to the stuck (102) and the healthy (103) client """
+        for index in range(MESSAGE_COUNT):
+            content = "%06i" % index + "x" * 2000
+            sender.sendall(ClientChatMessage.bytes(101, 102, content) + ClientChatMessage.bytes(101, 103, content))
+
+    def run_stuck_client(self, server_class, policy):
+        server, thread = self.start_server(server_class, policy)
+        try:
+            sender = self.connect_client(101, 'sender')
+            stuck = self.connect_client(102, 'stuck', receive_buffer=4096)
+            healthy = self.connect_client(103, 'healthy')
+            time.sleep(0.2)
+
+            received = []
+            reader = threading.Thread(target=self.receive_chat, args=(healthy, MESSAGE_COUNT, received))
+            reader.start()
+            blaster = threading.Thread(target=self.blast, args=(sender,))
+            blaster.start()
+
+            # The stuck client must not hold up the healthy one for more than the slow consumer timeout
+            reader.join(timeout=15)
+            self.assertEqual(len(received), MESSAGE_COUNT)
+            blaster.join(timeout=15)
+            self.assertGreaterEqual(server.backpressure_counters['paused_reads'], 1)
+            self.assertEqual(server.backpressure_counters['slow_consumers'], 1)
+            return server, stuck
+        finally:
+            server.request_terminate = True
+            thread.join()
+
+
+    def test_disconnect_policy(self):
+        server, stuck = self.run_stuck_client(CRCServer, 'disconnect')
+        self.assertEqual(server.backpressure_counters['disconnected_slow_consumers'], 1)
+
+    def test_drop_chat_policy(self):
+        server, stuck = self.run_stuck_client(CRCServer, 'drop_chat')
+        self.assertGreater(server.backpressure_counters['dropped_messages'], 0)
+
+    def test_spill_policy_delivers_everything_in_order(self):
+        server, thread = self.start_server(CRCServer, 'spill')
+        try:
+            sender = self.connect_client(101, 'sender')
+            stuck = self.connect_client(102, 'stuck', receive_buffer=4096)
+            healthy = self.connect_client(103, 'healthy')
+            time.sleep(0.2)
+
+            received = []
+            reader = threading.Thread(target=self.receive_chat, args=(healthy, MESSAGE_COUNT, received))
+            reader.start()
+            self.blast(sender)
+            reader.join(timeout=15)
+            self.assertEqual(len(received), MESSAGE_COUNT)
+            self.assertGreater(server.backpressure_counters['spilled_bytes'], 0)
+
+            # Once the stuck client starts reading it receives every message, in order
+            spilled = []
+            self.receive_chat(stuck, MESSAGE_COUNT, spilled)
+            self.assertEqual([int(content[:6]) for content in spilled], list(range(MESSAGE_COUNT)))
+        finally:
+            server.request_terminate = True
+            thread.join()
+
+    def test_asyncio_drop_chat_policy(self):
+        server, stuck = self.run_stuck_client(AsyncCRCServer, 'drop_chat')
+        self.assertGreater(server.backpressure_counters['dropped_messages'], 0)
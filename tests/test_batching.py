@@ -0,0 +1,72 @@
+from ChatServer import BaseConnectionData, BATCH_MESSAGE_LIMIT
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestBatching(ServerTestCase):
+    def setUp(self):
+        self.server = self.start_server(1, 'theshire', 47120, info='Home of the Hobbits')
+        self.rivendell = self.register(ServerRegistrationMessage.bytes(2, 0, "rivendell", "Home of the Elves"))
+        self.receive(self.rivendell, CapabilityAnnouncement.bytes(2, {'batch': ()}))
+        self.frodo = self.register(ClientRegistrationMessage.bytes(101, 0, "frodobaggins", "Test info"))
+        self.receive(self.rivendell, ClientRegistrationMessage.bytes(102, 2, "arwen", "Test info"))
+        for connection in (self.rivendell, self.frodo):
+            connection.write_queue.clear()
+            connection.pending_bytes = 0
+
+
+    def register(self, registration):
+        self.receive(BaseConnectionData(), registration)
+        return self.server.hosts_db[FRAME_HEADER.unpack_from(registration)[1]]
+
+
+    def test_batch_message(self):
+        messages = [ClientChatMessage.bytes(101, 102, "Hello"), StatusUpdateMessage.bytes(1, 102, 0x00, "Hi")]
+        data = BatchMessage.bytes(1, messages)
+        message = MessageParser.parse_messages(data)[0]
+        self.assertIsInstance(message, BatchMessage)
+        self.assertEqual((message.source_id, message.message_count), (1, 2))
+        self.assertEqual(message.messages, messages)
+        self.assertEqual(MessageParser.index_batch(b'x' + data, 1), 
+                         [(0x81, 101, 102, 22, 18), (0x01, 1, 102, 40, 17)])
+
+        with self.assertRaises(Exception):
+            MessageParser.index_batch(data[:13] + (100).to_bytes(4, 'big') + data[17:])
+
+    def test_server_links_send_batches(self):
+        chats = [ClientChatMessage.bytes(101, 102, "Message %i" % index) for index in range(3)]
+        large = ClientChatMessage.bytes(101, 102, "x" * BATCH_MESSAGE_LIMIT)
+        self.receive(self.frodo, b''.join(chats) + large + chats[0])
+        self.server.batch_output(self.rivendell, 0)
+
+        # The run of small messages is packed, the large message and the one after it are sent as they are
+        queue = list(self.rivendell.write_queue)
+        self.assertEqual([chunk[0] for chunk in queue], [0x03, 0x81, 0x81])
+        self.assertEqual(BatchMessage(bytes(queue[0])).messages, chats)
+        self.assertEqual(self.rivendell.pending_bytes, sum(len(chunk) for chunk in queue))
+        self.assertEqual(self.server.write_counters['batched_messages'], 3)
+
+    def test_partially_sent_head_is_not_batched(self):
+        self.receive(self.frodo, b''.join(ClientChatMessage.bytes(101, 102, "Message %i" % index) 
+                                          for index in range(3)))
+        self.server.batch_output(self.rivendell, 1)
+        self.assertEqual([chunk[0] for chunk in self.rivendell.write_queue], [0x81, 0x03])
+
+    def test_servers_that_did_not_announce_batching_do_not_receive_batches(self):
+        self.rivendell.capabilities = {}
+        self.receive(self.frodo, b''.join(ClientChatMessage.bytes(101, 102, "Hello") for _ in range(3)))
+        self.server.batch_output(self.rivendell, 0)
+        self.assertEqual([chunk[0] for chunk in self.rivendell.write_queue], [0x81, 0x81, 0x81])
+
+    def test_clients_do_not_receive_batches(self):
+        self.receive(self.rivendell, b''.join(ClientChatMessage.bytes(102, 101, "Hello") for _ in range(3)))
+        self.server.batch_output(self.frodo, 0)
+        self.assertEqual([chunk[0] for chunk in self.frodo.write_queue], [0x81, 0x81, 0x81])
+
+    def test_received_batches_are_dispatched_message_by_message(self):
+        self.server.read_budget_messages = 2
+        messages = [ClientChatMessage.bytes(102, 101, "Hello %i" % index) for index in range(3)]
+        self.receive(self.rivendell, BatchMessage.bytes(2, messages) + 
+                     StatusUpdateMessage.bytes(102, 1, 0x00, "Hi"))
+        self.assertEqual(b''.join(self.frodo.write_queue), b''.join(messages))
+        self.assertEqual(self.server.status_updates_log, ["Hi"])
+        self.assertEqual(self.rivendell.inbox_bytes, 0)
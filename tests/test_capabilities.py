@@ -0,0 +1,58 @@
+from optparse import Values
+from ChatServer import BaseConnectionData, NO_CAPABILITIES
+from ChatClient import CRCClient
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestCapabilities(ServerTestCase):
+    def setUp(self):
+        self.server = self.start_server(1, 'theshire', 47140, info='Home of the Hobbits')
+
+
+    def test_announcement(self):
+        data = CapabilityAnnouncement.bytes(7, {'batch': (), 'compress': ('zlib', 'lzma')})
+        message = MessageParser.parse_message(data)
+        self.assertIsInstance(message, StatusUpdateMessage)
+        self.assertEqual(message.content, "batch,compress=zlib+lzma")
+        self.assertTrue(CapabilityAnnouncement.is_announcement(message))
+        self.assertEqual(CapabilityAnnouncement.capabilities(message), {'batch': (), 'compress': ('zlib', 'lzma')})
+
+    def test_servers_announce_after_registering(self):
+        link = BaseConnectionData()
+        self.receive(link, ServerRegistrationMessage.bytes(2, 0, "rivendell", "Home of the Elves"))
+        rivendell = self.server.hosts_db[2]
+        registration, announcement = self.received(rivendell)
+        self.assertIsInstance(registration, ServerRegistrationMessage)
+        self.assertTrue(CapabilityAnnouncement.is_announcement(announcement))
+        self.assertIs(rivendell.capabilities, NO_CAPABILITIES)
+
+        # Capabilities the server does not know are stored but not used
+        self.receive(rivendell, CapabilityAnnouncement.bytes(2, {'batch': (), 'telepathy': ('palantir',)}))
+        self.assertEqual(rivendell.capabilities, {'batch': (), 'telepathy': ('palantir',)})
+        self.assertEqual(self.received(rivendell), [])
+        self.assertEqual(self.server.status_updates_log, [])
+
+    def test_clients_only_get_an_announcement_if_they_announce(self):
+        self.receive(BaseConnectionData(), ClientRegistrationMessage.bytes(101, 0, "frodobaggins", "Ring bearer"))
+        frodo = self.server.hosts_db[101]
+        self.assertEqual([message.status_code for message in self.received(frodo)], [0x00])
+
+        self.receive(frodo, CapabilityAnnouncement.bytes(101, {'snapshot': ()}))
+        self.assertEqual(frodo.capabilities, {'snapshot': ()})
+        announcement, = self.received(frodo)
+
+        client = CRCClient(Values({'serverhost': None, 'serverport': None, 'id': 101, 'username': 'frodobaggins', 
+                                   'info': 'Ring bearer', 'log_file': None}))
+        client.handle_messages(announcement.bytes)
+        self.assertEqual(client.server_capabilities, self.server.capabilities)
+        self.assertEqual(client.status_updates_log, [])
+
+    def test_servers_without_capabilities_ignore_announcements(self):
+        self.server.announce_capabilities = False
+        self.receive(BaseConnectionData(), ServerRegistrationMessage.bytes(2, 0, "rivendell", "Home of the Elves"))
+        rivendell = self.server.hosts_db[2]
+        self.assertEqual(len(self.received(rivendell)), 1)
+
+        self.receive(rivendell, CapabilityAnnouncement.bytes(2, {'batch': ()}))
+        self.assertIs(rivendell.capabilities, NO_CAPABILITIES)
+        self.assertEqual(self.server.status_updates_log, [])
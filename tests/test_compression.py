@@ -0,0 +1,108 @@
+from ChatServer import BaseConnectionData
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestCompression(ServerTestCase):
+    def setUp(self):
+        self.theshire = self.start_server(1, 'theshire', 47130, compression='zlib')
+        self.rivendell = self.start_server(2, 'rivendell', 47131, compression='lzma,zlib', announce_on_connect=True)
+        self.register_hobbits(range(101, 151))
+
+
+    def register_hobbits(self, client_ids):
+        for client_id in client_ids:
+            self.deliver(self.theshire, BaseConnectionData(), 
+                         ClientRegistrationMessage.bytes(client_id, 0, "hobbit%i" % client_id, "Lives in the Shire"))
+
+    def transfer(self, source, link, destination, destination_link):
+        """ Flushes a link's output into the server at the other end of it, returns the bytes sent """
+        source.batch_output(link, 0)
+        source.compress_output(link, 0)
+        data = b''.join(link.write_queue)
+        link.write_queue.clear()
+        link.pending_bytes = 0
+        self.deliver(destination, destination_link, data)
+        return data
+
+    def link_up(self):
+        """ Rivendell connects to the Shire and both send their full state, returns the data the Shire sent 
+        first """
+        link = BaseConnectionData()
+        self.rivendell.send_registration(link)
+        self.transfer(self.rivendell, link, self.theshire, BaseConnectionData())
+        self.shire_link = self.theshire.hosts_db[2]
+        data = self.transfer(self.theshire, self.shire_link, self.rivendell, link)
+        self.rivendell_link = self.rivendell.hosts_db[1]
+        self.transfer(self.rivendell, self.rivendell_link, self.theshire, self.shire_link)
+        self.transfer(self.theshire, self.shire_link, self.rivendell, self.rivendell_link)
+        return data
+
+
+    def test_codecs(self):
+        messages = [ClientRegistrationMessage.bytes(client_id, 1, "hobbit%i" % client_id, "Lives in the Shire") 
+                    for client_id in range(100)]
+        for codec in COMPRESSION_CODECS.values():
+            compressor, decompressor = LinkCompressor(1, codec), LinkDecompressor(codec, 64 * 1024)
+            for _ in range(2):
+                message = MessageParser.parse_messages(compressor.compress(messages))[0]
+                self.assertEqual((message.source_id, message.codec), (1, codec))
+                self.assertLess(message.payload_length, len(b''.join(messages)) // 4)
+                self.assertEqual(decompressor.decompress(codec, message.payload), b''.join(messages))
+
+    def test_decompression_limit(self):
+        messages = [ClientChatMessage.bytes(101, 201, "x" * 1000) for _ in range(100)]
+        size = len(b''.join(messages))
+        for codec in COMPRESSION_CODECS.values():
+            message = MessageParser.parse_messages(LinkCompressor(1, codec).compress(messages))[0]
+            self.assertEqual(len(LinkDecompressor(codec, size).decompress(codec, message.payload)), size)
+            with self.assertRaises(Exception):
+                LinkDecompressor(codec, size - 1).decompress(codec, message.payload)
+
+    def test_link_compression(self):
+        # Rivendell announced its capabilities right behind its registration, so all of the Shire's reply is 
+        # compressed
+        data = self.link_up()
+        self.assertEqual([frame[0] for frame in MessageParser.index_frames(data)[0]], [0x04])
+        self.assertEqual(set(self.rivendell.hosts_db), {1} | set(range(101, 151)))
+
+        # Each side compresses with the first of its own codecs the other side accepts
+        self.assertEqual(self.shire_link.compressor.codec, COMPRESSION_CODECS['zlib'])
+        self.assertEqual(self.rivendell_link.compressor.codec, COMPRESSION_CODECS['lzma'])
+
+        self.register_hobbits(range(151, 201))
+        data = self.transfer(self.theshire, self.shire_link, self.rivendell, self.rivendell_link)
+        self.assertEqual([frame[0] for frame in MessageParser.index_frames(data)[0]], [0x04])
+        self.assertLess(len(data), self.theshire.compression_counters['bytes_in'] // 4)
+        self.assertEqual(set(self.rivendell.hosts_db), {1} | set(range(101, 201)))
+        self.assertEqual(self.rivendell.compression_counters['bytes_decompressed'], 
+                         self.theshire.compression_counters['bytes_in'])
+
+        self.deliver(self.rivendell, BaseConnectionData(), 
+                     ClientRegistrationMessage.bytes(201, 0, "elrond", "x" * 600))
+        data = self.transfer(self.rivendell, self.rivendell_link, self.theshire, self.shire_link)
+        self.assertEqual(data[0], 0x04)
+        self.assertEqual(self.theshire.hosts_db[201].client_info, "x" * 600)
+
+    def test_small_flushes_are_not_compressed(self):
+        self.link_up()
+        self.deliver(self.rivendell, BaseConnectionData(), 
+                     ClientRegistrationMessage.bytes(201, 0, "elrond", "Lord of Rivendell"))
+        data = self.transfer(self.rivendell, self.rivendell_link, self.theshire, self.shire_link)
+        self.assertEqual(data, ClientRegistrationMessage.bytes(201, 2, "elrond", "Lord of Rivendell"))
+
+        chat = ClientChatMessage.bytes(101, 201, "Hi")
+        self.deliver(self.theshire, self.theshire.hosts_db[101], chat)
+        self.assertEqual(self.transfer(self.theshire, self.shire_link, self.rivendell, self.rivendell_link), chat)
+
+    def test_each_direction_is_negotiated_separately(self):
+        # Rivendell does not compress, but accepts compressed messages
+        self.rivendell.compression = []
+        self.link_up()
+        self.assertIsNone(self.rivendell_link.compressor)
+        self.assertIsNotNone(self.shire_link.compressor)
+
+    def test_compression_is_only_used_if_accepted(self):
+        del self.rivendell.capabilities['compress']
+        self.link_up()
+        self.assertIsNotNone(self.rivendell_link.compressor)
+        self.assertIsNone(self.shire_link.compressor)
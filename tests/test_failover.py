@@ -0,0 +1,173 @@
+import time
+from ChatServer import BaseConnectionData
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestFailover(ServerTestCase):
+    def setUp(self):
+        # Rivendell connects to the Shire, Gondor to Rivendell and Rohan to Gondor; every server has a client
+        self.wires = []
+        self.theshire = self.server(1, 'theshire', 47200)
+        self.rivendell = self.server(2, 'rivendell', 47201)
+        self.gondor = self.server(3, 'gondor', 47202)
+        self.rohan = self.server(4, 'rohan', 47203)
+        self.connect(self.rivendell, self.theshire)
+        self.connect(self.gondor, self.rivendell)
+        self.connect(self.rohan, self.gondor)
+        self.frodo = self.client(self.theshire, 101, "frodobaggins")
+        self.elrond = self.client(self.rivendell, 201, "elrond")
+        self.aragorn = self.client(self.gondor, 301, "aragorn")
+        self.eomer = self.client(self.rohan, 401, "eomer")
+        for client in (self.frodo, self.elrond, self.aragorn):
+            self.received(client)
+
+
+    def server(self, id, name, port):
+        return self.start_server(id, name, port, connect_to_host='127.0.0.1', connect_to_port=port - 1,
+                                 announce_on_connect=True)
+
+    def connect(self, server, peer, departed_id=None):
+        connection = BaseConnectionData()
+        self.wires.append([server, connection, peer, BaseConnectionData()])
+        if departed_id is None:
+            server.send_registration(connection, announce=server.announce_on_connect)
+        else:
+            server.start_handover(connection, departed_id)
+        self.pump()
+
+    def client(self, server, client_id, name, last_hop_id=0):
+        connection = BaseConnectionData()
+        self.deliver(server, connection, ClientRegistrationMessage.bytes(client_id, last_hop_id, name, "Test info") +
+                     CapabilityAnnouncement.bytes(client_id, {'failover': ()}))
+        self.pump()
+        connection = self.current(connection)
+        self.received(connection)
+        return connection
+
+    def close_links(self, server):
+        """ Closes every wire of a server that left """
+        for wire in [wire for wire in self.wires if server in (wire[0], wire[2])]:
+            self.wires.remove(wire)
+            for peer, connection in ((wire[0], wire[1]), (wire[2], wire[3])):
+                if peer is not server:
+                    peer.forget_connection(self.current(connection))
+
+    def routes(self, server):
+        return {host_id: host.first_link_id for host_id, host in server.hosts_db.items()}
+
+
+    def test_departure_with_replacement(self):
+        self.gondor.connect_to_replacement = lambda departed_id, address: self.connect(self.gondor, self.theshire,
+                                                                                      departed_id)
+        self.rivendell.depart(1)
+        self.pump()
+        # Elrond was told where to go, and moves over like a client would
+        quit, = [m for m in self.received(self.elrond) if m.message_type == 0x02]
+        self.assertEqual((quit.source_id, quit.replacement_id, quit.content), (2, 1, "127.0.0.1:47200"))
+        self.client(self.theshire, 201, "elrond", last_hop_id=2)
+        self.close_links(self.rivendell)
+
+        self.assertEqual(self.routes(self.theshire), {3: 1, 4: 3, 101: 1, 201: 1, 301: 3, 401: 3})
+        self.assertEqual(self.routes(self.gondor), {1: 3, 4: 3, 101: 1, 201: 1, 301: 3, 401: 4})
+        self.assertEqual(self.routes(self.rohan), {1: 3, 3: 4, 101: 3, 201: 3, 301: 3, 401: 4})
+        self.assertEqual(self.theshire.routes.routed_through(3), {4, 301, 401})
+        self.assertEqual(self.gondor.routes.routed_through(1), {101, 201})
+        for server in (self.theshire, self.gondor):
+            self.assertEqual(server.departed, {})
+            self.assertTrue(all(timer.cancelled for timer in server.timers))
+
+        # Nobody saw a quit or a registration, and chat is routed over the new link
+        for client in (self.frodo, self.aragorn, self.eomer):
+            self.assertEqual(self.received(client), [])
+        self.deliver(self.theshire, self.frodo, ClientChatMessage.bytes(101, 401, "Hello Eomer"))
+        self.pump()
+        self.assertEqual([m.content for m in self.received(self.eomer)], ["Hello Eomer"])
+
+    def test_hosts_move_over_before_the_quit_is_handled(self):
+        handovers = []
+        self.gondor.connect_to_replacement = lambda departed_id, address: handovers.append(departed_id)
+        self.rivendell.depart(1)
+        # Only Gondor handles Rivendell's quit, and its handover and Elrond reach the Shire before the quit does
+        wire, = [wire for wire in self.wires if wire[0] is self.gondor and wire[2] is self.rivendell]
+        self.deliver(self.gondor, self.current(wire[1]), self.rivendell.hosts_db[3].write_queue.popleft())
+        self.assertEqual(handovers, [2])
+        connection = BaseConnectionData()
+        self.wires.insert(0, [self.gondor, connection, self.theshire, BaseConnectionData()])
+        self.gondor.start_handover(connection, 2)
+        elrond = BaseConnectionData()
+        self.deliver(self.theshire, elrond, ClientRegistrationMessage.bytes(201, 2, "elrond", "Test info"))
+        self.assertEqual(self.theshire.held_handovers[2][0], [elrond])
+        self.pump()
+        self.close_links(self.rivendell)
+
+        statuses = [m.status_code for m in self.received(self.current(elrond)) if m.message_type == 0x01]
+        self.assertNotIn(0x02, statuses)
+        self.assertIn(201, self.theshire.adjacent_user_ids)
+        self.assertEqual(self.routes(self.theshire), {3: 1, 4: 3, 101: 1, 201: 1, 301: 3, 401: 3})
+        self.assertEqual(self.routes(self.gondor), {1: 3, 4: 3, 101: 1, 201: 1, 301: 3, 401: 4})
+        for server in (self.theshire, self.gondor):
+            self.assertEqual(server.departed, {})
+        for client in (self.frodo, self.aragorn, self.eomer):
+            self.assertEqual(self.received(client), [])
+
+    def test_unreachable_replacement(self):
+        # Nothing listens where Rivendell sends Gondor, and the connection is opened off the event loop
+        self.rivendell.depart(1, ('127.0.0.1', 47209))
+        self.pump()
+        self.assertIn(2, self.gondor.departed)
+        wakeup = self.gondor.wakeup
+        deadline = time.monotonic() + 10
+        while not wakeup.inbox and time.monotonic() < deadline:
+            time.sleep(0.01)
+        wakeup.run_pending()
+        self.pump()
+
+        self.assertNotIn(2, self.gondor.departed)
+        self.assertEqual(set(self.gondor.hosts_db), {4, 301, 401})
+        self.assertEqual(sorted(m.source_id for m in self.received(self.aragorn)), [101, 201])
+
+    def test_departure_without_replacement(self):
+        self.rivendell.depart(reason="Closing")
+        self.pump()
+        self.close_links(self.rivendell)
+
+        self.assertEqual(set(self.theshire.hosts_db), {101})
+        self.assertEqual(set(self.gondor.hosts_db), {4, 301, 401})
+        self.assertEqual(set(self.rohan.hosts_db), {3, 301, 401})
+        self.assertEqual(sorted(m.source_id for m in self.received(self.frodo)), [201, 301, 401])
+        self.assertEqual(sorted(m.source_id for m in self.received(self.eomer)), [101, 201])
+
+    def test_hosts_that_do_not_come_back_are_removed(self):
+        self.gondor.connect_to_replacement = lambda departed_id, address: self.connect(self.gondor, self.theshire,
+                                                                                      departed_id)
+        self.rivendell.depart(1)
+        self.pump()
+        self.close_links(self.rivendell)
+        self.assertIn(2, self.theshire.departed)
+
+        self.theshire.finish_handover(2)
+        self.pump()
+        for server in (self.theshire, self.gondor, self.rohan):
+            self.assertNotIn(201, server.hosts_db)
+        self.assertEqual([(m.message_type, m.source_id) for m in self.received(self.frodo)], [(0x82, 201)])
+
+    def test_link_failure_announces_lost_servers(self):
+        self.close_links(self.rivendell)
+        for timer in list(self.gondor.timers):
+            timer.callback(*timer.args)
+        self.pump()
+        self.assertEqual(set(self.rohan.hosts_db), {3, 301, 401})
+        self.assertEqual(sorted(m.source_id for m in self.received(self.eomer)), [101, 201])
+
+    def test_duplicate_ids_are_still_rejected(self):
+        connection = BaseConnectionData()
+        self.deliver(self.theshire, connection, ServerRegistrationMessage.bytes(3, 2, "impostor", "Not Gondor"))
+        # It names Rivendell as its last hop, so it is held in case Rivendell is about to leave
+        self.assertEqual(self.received(connection), [])
+        links, timer = self.theshire.held_handovers[2]
+        self.assertEqual(links, [connection])
+        timer.callback(*timer.args)
+        self.theshire.dispatch_ready_connections()
+        self.assertEqual([m.status_code for m in self.received(connection)], [0x02])
+        self.assertEqual(self.theshire.expired_handovers, set())
+        self.assertEqual(self.theshire.hosts_db[3].first_link_id, 2)
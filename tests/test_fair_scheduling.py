@@ -0,0 +1,93 @@
+import unittest, selectors, socket
+from optparse import Values
+from ChatServer import CRCServer, BaseConnectionData, ClientConnectionData
+from ChatMessageParser import *
+
+class TestFairScheduling(unittest.TestCase):
+    def setUp(self):
+        options = Values({'id': 1, 'servername': 'theshire', 'info': 'Home of the Hobbits', 'port': 47080,
+                          'connect_to_host': None, 'connect_to_port': None, 'log_file': None,
+                          'read_budget_messages': 4})
+        self.server = CRCServer(options, run_on_localhost=True)
+        self.dispatched = []
+        self.server.message_handlers[0x01] = self.record
+
+    def tearDown(self):
+        self.server.wakeup.close()
+        self.server.sel.close()
+
+
+    def record(self, io_device, message):
+        self.dispatched.append(message.content)
+
+    def receive(self, connection, *messages):
+        io_device = selectors.SelectorKey(None, 0, selectors.EVENT_READ, connection)
+        self.server.handle_messages(io_device, b''.join(messages))
+
+    def status(self, content):
+        return StatusUpdateMessage.bytes(101, 1, 0x00, content)
+
+
+    def test_turns_are_round_robin(self):
+        firehose, chat = BaseConnectionData(), BaseConnectionData()
+        self.receive(firehose, *[self.status("bulk %i" % index) for index in range(10)])
+        self.receive(chat, self.status("hello"))
+
+        # Nothing is handled while reading
+        self.assertEqual(self.dispatched, [])
+
+        self.server.dispatch_ready_connections()
+        self.assertEqual(self.dispatched, ["bulk 0", "bulk 1", "bulk 2", "bulk 3", "hello"])
+        self.assertTrue(firehose.read_throttled)
+        self.assertFalse(chat.read_throttled)
+
+        self.server.dispatch_ready_connections()
+        self.server.dispatch_ready_connections()
+        self.assertEqual(self.dispatched[5:], ["bulk %i" % index for index in range(4, 10)])
+        self.assertFalse(firehose.read_throttled)
+        self.assertEqual(len(self.server.ready_connections), 0)
+        self.assertEqual(firehose.inbox_bytes, 0)
+
+    def test_byte_budget(self):
+        self.server.read_budget_bytes = 100
+        connection = BaseConnectionData()
+        self.receive(connection, *[self.status("x" * 40) for _ in range(3)])
+
+        # A turn ends once its budget is used up, after the message that crossed it
+        self.server.dispatch_ready_connections()
+        self.assertEqual(len(self.dispatched), 2)
+        self.server.dispatch_ready_connections()
+        self.assertEqual(len(self.dispatched), 3)
+
+    def test_paused_connections_wait_for_resume(self):
+        connection = BaseConnectionData()
+        connection.sock, peer = socket.socketpair()
+        self.receive(connection, self.status("paused"))
+        connection.paused_by = 1
+        connection.reading_paused = True
+
+        self.server.dispatch_ready_connections()
+        self.assertEqual(self.dispatched, [])
+        self.server.resume_reading(connection)
+        self.server.dispatch_ready_connections()
+        self.assertEqual(self.dispatched, ["paused"])
+        connection.sock.close()
+        peer.close()
+
+    def test_registration_hands_inbox_to_new_connection_data(self):
+        self.server.message_handlers[0x01] = self.server.handle_status_message
+        connection = BaseConnectionData()
+        self.receive(connection, ClientRegistrationMessage.bytes(101, 0, "frodobaggins", "Test info"),
+                     *[self.status("status %i" % index) for index in range(6)])
+
+        self.server.dispatch_ready_connections()
+        client = self.server.hosts_db[101]
+        self.assertIsInstance(client, ClientConnectionData)
+        self.assertEqual(len(client.inbox), 3)
+        self.assertIs(self.server.ready_connections[0], client)
+
+        self.server.dispatch_ready_connections()
+        self.assertEqual(self.server.status_updates_log, ["status %i" % index for index in range(6)])
+        percentiles = self.server.dispatch_latency_percentiles()
+        self.assertEqual(set(percentiles), {'client', 'unregistered'})
+        self.assertEqual(set(percentiles['client']), {50, 90, 99, 99.9})
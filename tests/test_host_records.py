@@ -0,0 +1,61 @@
+from ChatServer import BaseConnectionData
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestHostRecords(ServerTestCase):
+    def setUp(self):
+        self.server = self.start_server(1, 'theshire', 47100, info='Home of the Hobbits')
+
+
+    def test_remote_hosts_have_no_buffers(self):
+        self.receive(BaseConnectionData(), ClientRegistrationMessage.bytes(101, 0, "frodobaggins", "Test info"))
+        frodo = self.server.hosts_db[101]
+        self.receive(frodo, ClientRegistrationMessage.bytes(102, 7, "samwisegamgee", "Test info"))
+        sam = self.server.hosts_db[102]
+
+        self.assertFalse(hasattr(sam, '__dict__'))
+        self.assertIsNone(sam.write_queue)
+        self.assertIsNone(sam.decoder)
+        self.assertIsNone(sam.inbox)
+        self.assertEqual(sam.connection_class, 'client')
+
+        # The adjacent client took over the buffers of the object its socket was registered with
+        self.assertIsNotNone(frodo.write_queue)
+        self.assertIsNotNone(frodo.decoder)
+
+    def test_messages_are_slotted(self):
+        message = ClientChatMessage(ClientChatMessage.bytes(101, 102, "Hello Sam"))
+        self.assertFalse(hasattr(message, '__dict__'))
+        self.assertEqual(message.bytes, ClientChatMessage.bytes(101, 102, "Hello Sam"))
+        self.assertEqual(message.content, "Hello Sam")
+
+    def test_registrations_are_cached_as_forwarded(self):
+        self.receive(BaseConnectionData(), ClientRegistrationMessage.bytes(101, 0, "frodobaggins", "Test info"))
+        frodo = self.server.hosts_db[101]
+        self.receive(frodo, ClientRegistrationMessage.bytes(102, 7, "samwisegamgee", "Test info"))
+        self.assertEqual(frodo.registration, ClientRegistrationMessage.bytes(101, 1, "frodobaggins", "Test info"))
+        self.assertEqual(self.server.hosts_db[102].registration,
+                         ClientRegistrationMessage.bytes(102, 1, "samwisegamgee", "Test info"))
+
+    def test_full_state_sync_is_one_chunk(self):
+        clients = [ClientRegistrationMessage.bytes(client_id, 0, "hobbit%i" % client_id, "Lives in the Shire")
+                   for client_id in range(101, 301)]
+        for client in clients:
+            self.receive(BaseConnectionData(), client)
+        self.receive(BaseConnectionData(), ServerRegistrationMessage.bytes(2, 0, "rivendell", "Home of the Elves"))
+
+        # Rivendell is synced once it announced it does not accept roster snapshots
+        rivendell = self.server.hosts_db[2]
+        self.assertEqual(len(rivendell.write_queue), 2)
+        self.receive(rivendell, CapabilityAnnouncement.bytes(2, {'batch': ()}))
+        registration, announcement, sync = rivendell.write_queue
+        self.assertEqual(sync, b''.join(ClientRegistrationMessage.bytes(client_id, 1, "hobbit%i" % client_id,
+                                                                         "Lives in the Shire")
+                                        for client_id in range(101, 301)))
+
+    def test_small_syncs_are_queued_message_by_message(self):
+        self.receive(BaseConnectionData(), ClientRegistrationMessage.bytes(101, 0, "frodobaggins", "Test info"))
+        self.receive(BaseConnectionData(), ClientRegistrationMessage.bytes(102, 0, "samwisegamgee", "Test info"))
+        sam = self.server.hosts_db[102]
+        welcome, frodo = sam.write_queue
+        self.assertEqual(frodo, ClientRegistrationMessage.bytes(101, 1, "frodobaggins", "Test info"))
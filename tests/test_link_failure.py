@@ -0,0 +1,83 @@
+from ChatServer import BaseConnectionData, ClientConnectionData
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestLinkFailure(ServerTestCase):
+    def setUp(self):
+        self.server = self.start_server(1, 'theshire', 47180, info='Home of the Hobbits')
+        self.rivendell = self.register(ServerRegistrationMessage.bytes(2, 0, "rivendell", "Home of the Elves"))
+        self.gondor = self.register(ServerRegistrationMessage.bytes(3, 0, "gondor", "Home of Men"))
+        self.frodo = self.register(ClientRegistrationMessage.bytes(101, 0, "frodobaggins", "Ring bearer"))
+        # Lothlorien and the elves are reached through Rivendell, Aragorn through Gondor
+        self.receive(self.rivendell, ServerRegistrationMessage.bytes(4, 2, "lothlorien", "Golden Wood") + 
+                     b''.join(ClientRegistrationMessage.bytes(client_id, 2, "elf%i" % client_id, "Immortal")
+                              for client_id in range(201, 501)))
+        self.receive(self.gondor, ClientRegistrationMessage.bytes(601, 3, "aragorn", "Ranger"))
+        self.clear()
+
+
+    def register(self, registration):
+        self.receive(BaseConnectionData(), registration)
+        return self.server.hosts_db[MessageParser.parse_message(registration).source_id]
+
+    def clear(self):
+        for connection in (self.rivendell, self.gondor, self.frodo):
+            connection.write_queue.clear()
+            connection.pending_bytes = 0
+
+    def lose(self, connection):
+        """ Closes a link and runs the prune it schedules, without waiting for the grace period """
+        timers = len(self.server.timers)
+        self.server.forget_connection(connection)
+        self.assertEqual(len(self.server.timers), timers + 1)
+        timer = self.server.timers[-1]
+        self.assertEqual(timer.callback, self.server.prune_link)
+        timer.callback(*timer.args)
+
+    def quits(self, connection):
+        return sorted(message.source_id for message in MessageParser.parse_messages(b''.join(connection.write_queue))
+                      if message.message_type == 0x82)
+
+
+    def test_subtree_index(self):
+        routes = self.server.routes
+        self.assertEqual(routes.routed_through(2), {4} | set(range(201, 501)))
+        self.assertEqual(routes.routed_through(3), {601})
+        self.assertEqual(routes.routed_through(4), set())
+
+        self.receive(self.rivendell, ClientQuitMessage.bytes(205, "Sailed west"))
+        self.assertNotIn(205, routes.routed_through(2))
+        self.assertIsNone(routes.lookup(205))
+
+    def test_lost_server_takes_its_subtree(self):
+        self.lose(self.rivendell)
+        self.assertEqual(set(self.server.hosts_db), {3, 101, 601})
+        self.assertEqual(self.server.adjacent_server_ids, [3])
+
+        # The lost clients' quits reach the rest of the network as a single chunk
+        self.assertEqual(self.quits(self.gondor), list(range(201, 501)))
+        self.assertEqual(self.quits(self.frodo), list(range(201, 501)))
+        self.assertEqual(len(self.gondor.write_queue), 1)
+
+    def test_lost_client_quits(self):
+        self.lose(self.frodo)
+        self.assertNotIn(101, self.server.hosts_db)
+        self.assertEqual(self.server.adjacent_user_ids, [])
+        self.assertEqual(self.quits(self.rivendell), [101])
+
+    def test_prune_is_idempotent(self):
+        self.server.prune_link(self.rivendell)
+        self.clear()
+        self.server.prune_link(self.rivendell)
+        self.assertEqual(self.quits(self.gondor), [])
+
+    def test_hosts_that_moved_are_kept(self):
+        self.server.forget_connection(self.rivendell)
+        timer = self.server.timers[-1]
+        # An elf reconnects through Gondor during the grace period
+        self.receive(self.gondor, ClientQuitMessage.bytes(201, "Moving") + 
+                     ClientRegistrationMessage.bytes(201, 3, "elf201", "Immortal"))
+        self.clear()
+        timer.callback(*timer.args)
+        self.assertIsInstance(self.server.hosts_db[201], ClientConnectionData)
+        self.assertEqual(self.quits(self.gondor), list(range(202, 501)))
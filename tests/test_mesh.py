@@ -0,0 +1,149 @@
+from ChatServer import BaseConnectionData, FloodWindow, FLOOD_WINDOW
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestMesh(ServerTestCase):
+    def setUp(self):
+        # Rivendell connects to the Shire, Gondor to Rivendell and Rohan to Gondor, and Rohan also links up with
+        # the Shire, closing the ring; every server has a client
+        self.wires = []
+        self.errors = []
+        self.theshire = self.server(1, 'theshire', 47220)
+        self.rivendell = self.server(2, 'rivendell', 47221)
+        self.gondor = self.server(3, 'gondor', 47222)
+        self.rohan = self.server(4, 'rohan', 47223)
+        self.servers = (self.theshire, self.rivendell, self.gondor, self.rohan)
+        self.connect(self.rivendell, self.theshire)
+        self.connect(self.gondor, self.rivendell)
+        self.connect(self.rohan, self.gondor)
+        self.connect(self.rohan, self.theshire)
+        self.frodo = self.client(self.theshire, 101, "frodobaggins")
+        self.elrond = self.client(self.rivendell, 201, "elrond")
+        self.aragorn = self.client(self.gondor, 301, "aragorn")
+        self.eomer = self.client(self.rohan, 401, "eomer")
+        self.clients = (self.frodo, self.elrond, self.aragorn, self.eomer)
+        for client in self.clients:
+            self.received(client)
+
+
+    def server(self, id, name, port):
+        server = self.start_server(id, name, port, mesh=True, announce_on_connect=True)
+        server.send_message_to_unknown_io_device = lambda io_device, message: self.errors.append(message)
+        return server
+
+    def connect(self, server, peer):
+        connection = BaseConnectionData()
+        self.wires.append([server, connection, peer, BaseConnectionData()])
+        server.send_registration(connection, announce=server.announce_on_connect)
+        self.pump()
+
+    def cut(self, server, peer):
+        """ Closes the wire between two servers """
+        wire, = [wire for wire in self.wires if {wire[0], wire[2]} == {server, peer}]
+        self.wires.remove(wire)
+        wire[0].forget_connection(self.current(wire[1]))
+        wire[2].forget_connection(self.current(wire[3]))
+        self.pump()
+
+    def expire_timers(self, server):
+        for timer in list(server.timers):
+            if not timer.cancelled:
+                timer.cancel()
+                timer.callback(*timer.args)
+        self.pump()
+
+    def client(self, server, client_id, name):
+        connection = BaseConnectionData()
+        self.deliver(server, connection, ClientRegistrationMessage.bytes(client_id, 0, name, "Test info"))
+        self.pump()
+        return self.current(connection)
+
+    def routes(self, server):
+        return {host_id: host.first_link_id for host_id, host in server.hosts_db.items()}
+
+
+    def test_redundant_link(self):
+        self.assertEqual(self.errors, [])
+        self.assertEqual(list(self.theshire.adjacent_server_ids), [2, 4])
+        self.assertEqual(list(self.rohan.adjacent_server_ids), [3, 1])
+        for server in self.servers:
+            self.assertEqual(set(server.hosts_db), {1, 2, 3, 4, 101, 201, 301, 401} - {server.id})
+            self.assertEqual(server.link_states[1][1], {2, 4})
+            self.assertEqual(server.link_states[3][1], {2, 4})
+
+    def test_routes_use_shortest_paths(self):
+        routes = self.routes(self.theshire)
+        self.assertEqual((routes[2], routes[4], routes[201], routes[401]), (1, 1, 2, 4))
+        self.assertIn(routes[3], (2, 4))
+        self.assertEqual(routes[301], routes[3])
+        routes = self.routes(self.rohan)
+        self.assertEqual((routes[1], routes[3], routes[101], routes[301]), (4, 4, 1, 3))
+        self.assertEqual(self.rohan.mesh_next_hops, {1: 1, 3: 3, 2: routes[2]})
+
+        self.deliver(self.rohan, self.eomer, ClientChatMessage.bytes(401, 101, "Hello Frodo"))
+        self.assertEqual(len(self.theshire.hosts_db[4].write_queue), 0)
+        self.pump()
+        self.assertEqual([m.content for m in self.received(self.frodo)], ["Hello Frodo"])
+
+    def test_broadcasts_are_handled_once(self):
+        duplicates = self.rohan.mesh_counters['duplicate_floods']
+        sam = self.client(self.theshire, 102, "samwisegamgee")
+        for client in (self.frodo, self.elrond, self.aragorn, self.eomer):
+            self.assertEqual([m.source_id for m in self.received(client)], [102])
+        for server in (self.rivendell, self.gondor, self.rohan):
+            self.assertEqual(server.hosts_db[102].home_id, 1)
+            self.assertEqual(server.hosts_db[102].first_link_id, server.mesh_next_hops[1])
+        # Rohan got the registration from both the Shire and Gondor, and dropped the second copy
+        self.assertEqual(self.rohan.mesh_counters['duplicate_floods'], duplicates + 1)
+
+        self.deliver(self.theshire, sam, ClientQuitMessage.bytes(102, "Bye"))
+        self.pump()
+        for client in (self.frodo, self.elrond, self.aragorn, self.eomer):
+            self.assertEqual([(m.message_type, m.source_id) for m in self.received(client)], [(0x82, 102)])
+        self.assertEqual(self.errors, [])
+
+    def test_duplicate_ids_over_server_links(self):
+        # Another client registers as Elrond behind Gondor, and Gondor forwards it to Rohan
+        wire, = [wire for wire in self.wires if wire[0] is self.rohan and wire[2] is self.gondor]
+        self.deliver(self.rohan, self.current(wire[1]),
+                     ClientRegistrationMessage.bytes(201, 3, "impostor", "Not Elrond"))
+        self.assertEqual([MessageParser.parse_message(message).status_code for message in self.errors], [0x02])
+        self.assertEqual(self.rohan.hosts_db[201].client_name, "elrond")
+
+    def test_link_failure_reroutes(self):
+        self.cut(self.theshire, self.rohan)
+        self.assertEqual(self.routes(self.theshire), {2: 1, 3: 2, 4: 2, 101: 1, 201: 2, 301: 2, 401: 2})
+        self.assertEqual(self.routes(self.rohan), {1: 3, 2: 3, 3: 4, 101: 3, 201: 3, 301: 3, 401: 4})
+        self.assertEqual(self.theshire.routes.routed_through(2), {3, 4, 201, 301, 401})
+
+        # Nothing is removed once the grace period is over, and nobody was told anybody quit
+        for server in self.servers:
+            self.expire_timers(server)
+            self.assertEqual(len(server.hosts_db), 7)
+        for client in self.clients:
+            self.assertEqual(self.received(client), [])
+        self.deliver(self.theshire, self.frodo, ClientChatMessage.bytes(101, 401, "Hello Eomer"))
+        self.pump()
+        self.assertEqual([m.content for m in self.received(self.eomer)], ["Hello Eomer"])
+
+    def test_partition_is_pruned(self):
+        self.cut(self.theshire, self.rohan)
+        self.cut(self.theshire, self.rivendell)
+        for server in self.servers:
+            self.expire_timers(server)
+
+        self.assertEqual(set(self.theshire.hosts_db), {101})
+        for server in (self.rivendell, self.gondor, self.rohan):
+            self.assertEqual(set(server.hosts_db), {2, 3, 4, 201, 301, 401} - {server.id})
+            self.assertNotIn(1, server.link_states)
+        self.assertEqual(sorted(m.source_id for m in self.received(self.frodo)), [201, 301, 401])
+        for client in (self.elrond, self.aragorn, self.eomer):
+            self.assertEqual([m.source_id for m in self.received(client)], [101])
+
+    def test_flood_window(self):
+        window = FloodWindow()
+        self.assertEqual([window.add(seq) for seq in (1, 3, 2, 3, 1)], [True, True, True, False, False])
+        window.add(3 * FLOOD_WINDOW)
+        self.assertFalse(window.add(FLOOD_WINDOW))
+        self.assertTrue(window.add(2 * FLOOD_WINDOW + 1))
+        self.assertLessEqual(len(window.seen), 2 * FLOOD_WINDOW)
@@ -0,0 +1,92 @@
+import unittest
+from ChatMessageParser import *
+
+class TestMessageParser(unittest.TestCase):
+    def setUp(self):
+        self.stream = b''.join([
+            ServerRegistrationMessage.bytes(1, 0, "theshire", "Home of the Hobbits"),
+            ClientRegistrationMessage.bytes(101, 1, "frodobaggins", "Test info"),
+            StatusUpdateMessage.bytes(1, 101, 0x00, "Welcome to the Clemson Relay Chat network frodobaggins"),
+            ClientChatMessage.bytes(101, 102, "x" * 5000),
+            ClientQuitMessage.bytes(101, "Bye"),
+        ])
+    
+    def tearDown(self):
+        pass
+
+
+    def check_messages(self, messages):
+        self.assertEqual([m.message_type for m in messages], [0x00, 0x80, 0x01, 0x81, 0x82])
+        self.assertEqual(messages[0].server_name, "theshire")
+        self.assertEqual(messages[1].client_info, "Test info")
+        self.assertEqual(messages[3].content, "x" * 5000)
+        self.assertEqual(messages[4].content, "Bye")
+        self.assertEqual(b''.join(m.bytes for m in messages), self.stream)
+
+
+    def test_decoder_coalesced_messages(self):
+        decoder = MessageFrameDecoder()
+        self.check_messages(decoder.feed(self.stream))
+        self.assertEqual(decoder.pending(), 0)
+
+
+    def test_decoder_split_messages(self):
+        for chunk_size in [1, 7, 13, 4096]:
+            decoder = MessageFrameDecoder()
+            messages = []
+            for i in range(0, len(self.stream), chunk_size):
+                messages += decoder.feed(self.stream[i:i+chunk_size])
+            self.check_messages(messages)
+            self.assertEqual(decoder.pending(), 0)
+
+
+    def test_decoder_keeps_partial_message(self):
+        decoder = MessageFrameDecoder()
+        cut = len(self.stream) - 2
+        self.assertEqual(len(decoder.feed(self.stream[:cut])), 4)
+        self.assertEqual(decoder.pending(), len(ClientQuitMessage.bytes(101, "Bye")) - 2)
+        self.assertEqual(len(decoder.feed(self.stream[cut:])), 1)
+
+
+    def test_non_ascii_strings(self):
+        # Lengths are counted in encoded bytes, not in characters
+        messages = MessageFrameDecoder().feed(
+            ServerRegistrationMessage.bytes(1, 0, "Hobbingen", "Heimat der Hobbits äöü") + 
+            ClientRegistrationMessage.bytes(101, 1, "frödö", "☃") + 
+            StatusUpdateMessage.bytes(1, 101, 0x00, "Grüße") + 
+            ClientChatMessage.bytes(101, 102, "💍" * 3) + 
+            ClientQuitMessage.bytes(101, "Tschüss"))
+        self.assertEqual(messages[0].server_info, "Heimat der Hobbits äöü")
+        self.assertEqual((messages[1].client_name, messages[1].client_info), ("frödö", "☃"))
+        self.assertEqual(messages[2].content, "Grüße")
+        self.assertEqual(messages[3].content, "💍" * 3)
+        self.assertEqual(messages[4].content, "Tschüss")
+
+    def test_server_quit_message(self):
+        message = ServerQuitMessage(ServerQuitMessage.bytes(2, 3, "Shutting down"))
+        self.assertEqual((message.source_id, message.replacement_id, message.content), (2, 3, "Shutting down"))
+
+    def test_server_quit_message_round_trip(self):
+        data = ServerQuitMessage.bytes(2, 3, "127.0.0.1:8100")
+        self.assertEqual(data[0], 0x02)
+        self.assertEqual(MessageParser.frame_length(data), len(data))
+        message = MessageParser.parse_message(data)
+        self.assertIsInstance(message, ServerQuitMessage)
+        self.assertEqual((message.source_id, message.replacement_id, message.content), (2, 3, "127.0.0.1:8100"))
+
+    def test_link_state_message(self):
+        data = LinkStateMessage.bytes(1, 5, [4, 2])
+        self.assertEqual(MessageParser.frame_length(data), len(data))
+        message = MessageParser.parse_message(data)
+        self.assertIsInstance(message, LinkStateMessage)
+        self.assertEqual((message.source_id, message.seq, message.neighbours), (1, 5, (2, 4)))
+
+    def test_flood_message(self):
+        inner = ClientQuitMessage.bytes(101, "Bye")
+        data = FloodMessage.bytes(1, 7, inner)
+        decoder = MessageFrameDecoder()
+        self.assertEqual(decoder.feed(data[:10]), [])
+        message, = decoder.feed(data[10:] + inner)[:1]
+        self.assertIsInstance(message, FloodMessage)
+        self.assertEqual((message.source_id, message.seq, message.bytes), (1, 7, data))
+        self.assertEqual((message.message.source_id, message.message.content), (101, "Bye"))
@@ -0,0 +1,115 @@
+from ChatServer import BaseConnectionData
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestPresence(ServerTestCase):
+    def setUp(self):
+        self.server = self.start_server(1, 'theshire', 47230, info='Home of the Hobbits', presence_window=0.5)
+        self.rivendell = self.register(ServerRegistrationMessage.bytes(2, 0, "rivendell", "Home of the Elves"))
+        self.gondor = self.register(ServerRegistrationMessage.bytes(3, 0, "gondor", "Home of Men"))
+        self.frodo = self.register(ClientRegistrationMessage.bytes(101, 0, "frodobaggins", "Ring bearer"))
+        self.receive(self.rivendell, ClientRegistrationMessage.bytes(201, 2, "elrond", "Lord of Rivendell"))
+        self.receive(self.gondor, ClientRegistrationMessage.bytes(301, 3, "aragorn", "Ranger"))
+        # Rivendell accepts batch messages, Gondor predates them
+        self.rivendell.capabilities = {'batch': ()}
+        self.server.flush_presence()
+        self.clear(self.rivendell, self.gondor, self.frodo)
+        self.server.presence_counters.clear()
+
+
+    def register(self, registration):
+        self.receive(BaseConnectionData(), registration)
+        return self.server.hosts_db[MessageParser.parse_message(registration).source_id]
+
+    def clear(self, *connections):
+        for connection in connections:
+            connection.write_queue.clear()
+            connection.pending_bytes = 0
+
+    def sent(self, connection):
+        """ The messages queued on a connection, as (type, source ID) pairs with batches unpacked """
+        messages = []
+        for message in MessageParser.parse_messages(b''.join(connection.write_queue)):
+            if message.message_type == 0x03:
+                messages.extend(('batch', MessageParser.parse_message(bytes(inner)).source_id)
+                                for inner in message.messages)
+            else:
+                messages.append((message.message_type, message.source_id))
+        return messages
+
+    def close_window(self):
+        timer = self.server.presence.timer
+        self.assertEqual(timer.callback, self.server.flush_presence)
+        timer.callback(*timer.args)
+
+
+    def test_joins_are_sent_together(self):
+        sam = self.register(ClientRegistrationMessage.bytes(102, 0, "samwisegamgee", "Gardener"))
+        self.receive(self.gondor, ClientRegistrationMessage.bytes(302, 3, "boromir", "Captain of Gondor"))
+        merry = self.register(ClientRegistrationMessage.bytes(103, 0, "meriadoc", "Esquire of Rohan"))
+        for connection in (self.rivendell, self.gondor, self.frodo):
+            self.assertEqual(self.sent(connection), [])
+        # Merry's roster leaves out Sam and Boromir, who are still to be announced
+        self.assertEqual([message for message in self.sent(merry) if message[0] == 0x80],
+                         [(0x80, 101), (0x80, 201), (0x80, 301)])
+        self.clear(sam, merry)
+
+        self.close_window()
+        self.assertIsNone(self.server.presence.timer)
+        self.assertEqual(self.sent(self.rivendell), [('batch', 102), ('batch', 302), ('batch', 103)])
+        self.assertEqual(self.sent(self.gondor), [(0x80, 102), (0x80, 103)])
+        self.assertEqual(self.sent(self.frodo), [(0x80, 102), (0x80, 302), (0x80, 103)])
+        self.assertEqual(self.sent(sam), [(0x80, 302), (0x80, 103)])
+        self.assertEqual(self.sent(merry), [(0x80, 102), (0x80, 302)])
+        counters = self.server.presence_counters
+        self.assertEqual((counters['joins'], counters['flushes'], counters['batches'], counters['frames_saved']),
+                         (3, 1, 1, 2))
+
+    def test_join_and_quit_cancel(self):
+        sam = self.register(ClientRegistrationMessage.bytes(102, 0, "samwisegamgee", "Gardener"))
+        self.receive(sam, ClientQuitMessage.bytes(102, "Back to the Shire"))
+        self.assertNotIn(102, self.server.hosts_db)
+        self.assertEqual(len(self.server.presence), 0)
+
+        self.close_window()
+        for connection in (self.rivendell, self.gondor, self.frodo):
+            self.assertEqual(self.sent(connection), [])
+        # Both messages would have gone to Rivendell, Gondor and Frodo
+        counters = self.server.presence_counters
+        self.assertEqual((counters['cancelled'], counters['frames_saved'], counters['flushes']), (2, 6, 0))
+
+    def test_rejoin_cancels_quit(self):
+        self.receive(self.rivendell, ClientQuitMessage.bytes(201, "Reconnecting") +
+                     ClientRegistrationMessage.bytes(201, 2, "elrond", "Lord of Rivendell"))
+        self.assertIn(201, self.server.hosts_db)
+        self.assertEqual(self.server.routes.next_hop(201), 2)
+        self.assertEqual(len(self.server.presence), 0)
+
+        # Coming back another way is announced
+        self.receive(self.rivendell, ClientQuitMessage.bytes(201, "Moving"))
+        self.receive(self.gondor, ClientRegistrationMessage.bytes(201, 3, "elrond", "Lord of Rivendell"))
+        self.close_window()
+        self.assertEqual(self.sent(self.rivendell), [(0x80, 201)])
+        self.assertEqual(self.sent(self.gondor), [(0x82, 201)])
+        self.assertEqual(self.sent(self.frodo), [(0x82, 201), (0x80, 201)])
+
+    def test_messages_wait_for_collected_joins(self):
+        sam = self.register(ClientRegistrationMessage.bytes(102, 0, "samwisegamgee", "Gardener"))
+        self.receive(sam, ClientChatMessage.bytes(102, 301, "Hello Aragorn"))
+        self.assertEqual(self.sent(self.gondor), [(0x80, 102), (0x81, 102)])
+        self.assertEqual(len(self.server.presence), 0)
+
+        # A new server is sent the network's state, so the joins collected before it registered go out first
+        self.register(ClientRegistrationMessage.bytes(103, 0, "meriadoc", "Esquire of Rohan"))
+        lothlorien = self.register(ServerRegistrationMessage.bytes(4, 0, "lothlorien", "Golden Wood"))
+        self.assertEqual(len(self.server.presence), 0)
+        self.assertIn((0x80, 103), self.sent(self.gondor))
+        self.assertIn((0x00, 4), self.sent(self.gondor))
+        self.server.send_pending_sync(lothlorien)
+        self.assertEqual(self.sent(lothlorien).count((0x80, 103)), 1)
+
+    def test_without_a_window(self):
+        self.server.presence_window = 0
+        self.register(ClientRegistrationMessage.bytes(102, 0, "samwisegamgee", "Gardener"))
+        self.assertEqual(self.sent(self.rivendell), [(0x80, 102)])
+        self.assertIsNone(self.server.presence.timer)
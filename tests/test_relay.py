@@ -0,0 +1,51 @@
+from unittest import mock
+from ChatServer import BaseConnectionData
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestRelay(ServerTestCase):
+    def setUp(self):
+        self.server = self.start_server(1, 'theshire', 47090, info='Home of the Hobbits')
+        self.frodo = self.register(101, "frodobaggins")
+        self.sam = self.register(102, "samwisegamgee")
+
+
+    def register(self, client_id, name):
+        self.receive(BaseConnectionData(), ClientRegistrationMessage.bytes(client_id, 0, name, "Test info"))
+        connection = self.server.hosts_db[client_id]
+        connection.write_queue.clear()
+        connection.pending_bytes = 0
+        return connection
+
+
+    def test_index_frames(self):
+        data = (ClientChatMessage.bytes(101, 102, "hi") + StatusUpdateMessage.bytes(1, 101, 0x00, "yo") +
+                ClientQuitMessage.bytes(101, "Bye"))
+        frames, consumed = MessageParser.index_frames(data + data[:5])
+        self.assertEqual(frames, [(0x81, 101, 102, 0, 15), (0x01, 1, 101, 15, 17), (0x82, 101, 3, 32, 12)])
+        self.assertEqual(consumed, len(data))
+
+    def test_forwarded_messages_are_not_parsed(self):
+        chat = ClientChatMessage.bytes(101, 102, "Hello Sam")
+        status = StatusUpdateMessage.bytes(101, 102, 0x00, "Status for Sam")
+        with mock.patch.object(MessageParser, 'parse_message', side_effect=AssertionError):
+            self.receive(self.frodo, chat + status)
+
+        # Both messages are queued as views of the chunk they were received in
+        self.assertEqual([type(chunk) for chunk in self.sam.write_queue], [memoryview, memoryview])
+        self.assertIs(self.sam.write_queue[0].obj, self.sam.write_queue[1].obj)
+        self.assertEqual(b''.join(self.sam.write_queue), chat + status)
+
+    def test_messages_for_this_server_use_the_handlers(self):
+        self.frodo.write_queue.clear()
+        self.receive(self.frodo, StatusUpdateMessage.bytes(101, 1, 0x00, "For the server") +
+                     ClientChatMessage.bytes(101, 999, "Nobody home"))
+        self.assertEqual(self.server.status_updates_log, ["For the server"])
+
+        replies = MessageParser.parse_messages(b''.join(self.frodo.write_queue))
+        self.assertEqual([(m.status_code, m.content) for m in replies], [(0x01, "Unknown ID 999")])
+
+    def test_backed_up_connections_get_copies(self):
+        self.sam.pending_bytes = self.server.write_low_watermark
+        self.receive(self.frodo, ClientChatMessage.bytes(101, 102, "Hello Sam"))
+        self.assertIsInstance(self.sam.write_queue[-1], bytes)
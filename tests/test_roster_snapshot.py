@@ -0,0 +1,133 @@
+import time
+from ChatServer import BaseConnectionData, MAX_SNAPSHOT_HOSTS
+from ChatMessageParser import *
+from tests import ServerTestCase
+
+class TestRosterSnapshot(ServerTestCase):
+    def setUp(self):
+        self.theshire = self.start_server(1, 'theshire', 47160)
+        self.rivendell = self.start_server(2, 'rivendell', 47161, announce_on_connect=True)
+        # The hobbits are behind a server the Shire does not know, so they are not synced to each other
+        self.hobbits = range(101, 101 + MAX_SNAPSHOT_HOSTS + 100)
+        self.hobbiton = BaseConnectionData()
+        self.deliver(self.theshire, self.hobbiton, b''.join(
+            ClientRegistrationMessage.bytes(client_id, 7, "hobbit%i" % client_id, "Lives in the Shire")
+            for client_id in self.hobbits))
+
+
+    def transfer(self, source, link, destination, destination_link):
+        """ Flushes a link's output into the server at the other end of it, returns the messages sent """
+        data = b''.join(link.write_queue)
+        link.write_queue.clear()
+        link.pending_bytes = 0
+        self.deliver(destination, destination_link, data)
+        return [frame[0] for frame in MessageParser.index_frames(data)[0]]
+
+    def link_up(self):
+        """ Rivendell connects to the Shire, returns the types of the messages the Shire sent """
+        link = BaseConnectionData()
+        self.rivendell.send_registration(link)
+        self.transfer(self.rivendell, link, self.theshire, BaseConnectionData())
+        self.shire_link = self.theshire.hosts_db[2]
+        sent = self.transfer(self.theshire, self.shire_link, self.rivendell, link)
+        self.rivendell_link = self.rivendell.hosts_db[1]
+        return sent
+
+
+    def test_snapshot(self):
+        registrations = [ServerRegistrationMessage.bytes(3, 1, "mordor", "Dark"), 
+                         ClientRegistrationMessage.bytes(101, 1, "frodo", "Ring bearer ü"),
+                         ServerRegistrationMessage.bytes(4, 1, "gondor", "")]
+        message = MessageParser.parse_message(RosterSnapshotMessage.bytes(1, registrations))
+        self.assertEqual((message.source_id, message.server_count, message.client_count), (1, 2, 1))
+        self.assertEqual(message.hosts(), [(0x00, 3, 6, 4, b"mordorDark"), (0x00, 4, 6, 0, b"gondor"),
+                                           (0x80, 101, 5, 14, "frodoRing bearer ü".encode())])
+        self.assertEqual(MessageParser.frame_length(message.bytes), len(message.bytes))
+
+        broken = bytearray(message.bytes)
+        broken[17 + 12] += 1
+        with self.assertRaises(Exception):
+            RosterSnapshotMessage(bytes(broken)).hosts()
+
+    def test_full_state_is_sent_as_snapshots(self):
+        sent = self.link_up()
+        self.assertEqual(sent, [0x00, 0x01, 0x05, 0x05])
+        self.assertEqual(set(self.rivendell.hosts_db), {1} | set(self.hobbits))
+
+        frodo = self.rivendell.hosts_db[101]
+        self.assertEqual((frodo.client_name, frodo.client_info, frodo.first_link_id), 
+                         ("hobbit101", "Lives in the Shire", 1))
+        self.assertEqual(frodo.registration, 
+                         ClientRegistrationMessage.bytes(101, 2, "hobbit101", "Lives in the Shire"))
+
+    def test_connecting_servers_are_synced_without_waiting(self):
+        # Rivendell announces its capabilities right behind its registration, so the Shire's sync follows its own
+        # registration and announcement right away
+        link = BaseConnectionData()
+        self.rivendell.send_registration(link)
+        self.assertEqual(self.transfer(self.rivendell, link, self.theshire, BaseConnectionData()), [0x00, 0x01])
+        shire_link = self.theshire.hosts_db[2]
+        self.assertIsNone(shire_link.pending_sync)
+        self.assertEqual([chunk[0] for chunk in shire_link.write_queue], [0x00, 0x01, 0x05, 0x05])
+
+    def test_servers_without_snapshots_get_registrations(self):
+        self.rivendell.roster_snapshots = False
+        del self.rivendell.capabilities['snapshot']
+        self.assertEqual(set(self.link_up()), {0x00, 0x01, 0x80})
+        self.assertEqual(set(self.rivendell.hosts_db), {1} | set(self.hobbits))
+
+    def test_servers_that_do_not_announce_are_synced_after_a_timeout(self):
+        self.deliver(self.theshire, BaseConnectionData(), ServerRegistrationMessage.bytes(2, 0, "old", "Old"))
+        link = self.theshire.hosts_db[2]
+        self.assertEqual(len(link.write_queue), 2)
+
+        # Hosts that register or quit in the meantime are forwarded as usual and left out of the sync
+        self.deliver(self.theshire, self.hobbiton, ClientQuitMessage.bytes(101, "Bye"))
+        self.deliver(self.theshire, BaseConnectionData(), ClientRegistrationMessage.bytes(99, 0, "bilbo", "Old"))
+        hosts, timer = link.pending_sync
+        timer.callback(*timer.args)
+        self.assertIsNone(link.pending_sync)
+        self.assertTrue(timer.cancelled)
+
+        registration, announcement, quit, bilbo, sync = link.write_queue
+        self.assertEqual(len(MessageParser.parse_messages(sync)), len(self.hobbits) - 1)
+        self.assertEqual(bilbo, ClientRegistrationMessage.bytes(99, 1, "bilbo", "Old"))
+
+    def test_servers_that_send_something_else_behind_their_registration_are_synced_right_away(self):
+        self.deliver(self.theshire, BaseConnectionData(), ServerRegistrationMessage.bytes(2, 0, "old", "Old") + 
+                     ClientRegistrationMessage.bytes(99, 2, "bilbo", "Old"))
+        link = self.theshire.hosts_db[2]
+        self.assertIsNone(link.pending_sync)
+        self.assertEqual(len(MessageParser.parse_messages(b''.join(link.write_queue))), 2 + len(self.hobbits))
+
+    def test_capability_timeout_is_configurable(self):
+        bree = self.start_server(3, 'bree', 47162, capability_timeout=0.25)
+        start = time.monotonic()
+        self.deliver(bree, BaseConnectionData(), ServerRegistrationMessage.bytes(2, 0, "old", "Old"))
+        hosts, timer = bree.hosts_db[2].pending_sync
+        self.assertAlmostEqual(timer.deadline - start, 0.25, delta=0.1)
+
+    def test_snapshots_are_forwarded(self):
+        mordor = BaseConnectionData()
+        self.deliver(self.rivendell, mordor, ServerRegistrationMessage.bytes(3, 0, "mordor", "Dark"))
+        self.deliver(self.rivendell, self.rivendell.hosts_db[3], CapabilityAnnouncement.bytes(3, {}))
+        self.deliver(self.rivendell, BaseConnectionData(), 
+                     ClientRegistrationMessage.bytes(60001, 0, "elrond", "Elf"))
+        for host_id in (3, 60001):
+            self.rivendell.hosts_db[host_id].write_queue.clear()
+
+        self.link_up()
+        mordor, elrond = self.rivendell.hosts_db[3], self.rivendell.hosts_db[60001]
+        messages = MessageParser.parse_messages(b''.join(mordor.write_queue))
+        self.assertEqual({message.source_id for message in messages}, {1} | set(self.hobbits))
+        self.assertEqual({message.last_hop_id for message in messages}, {2})
+        messages = MessageParser.parse_messages(b''.join(elrond.write_queue))
+        self.assertEqual({message.source_id for message in messages}, set(self.hobbits))
+
+    def test_duplicates_are_reported(self):
+        self.deliver(self.rivendell, BaseConnectionData(), ClientRegistrationMessage.bytes(101, 0, "frodo", "Ring"))
+        self.link_up()
+        self.assertEqual(self.rivendell.hosts_db[101].client_name, "frodo")
+        error, = [message for message in MessageParser.parse_messages(b''.join(self.rivendell_link.write_queue))
+                  if message.message_type == 0x01]
+        self.assertEqual((error.status_code, error.content), (0x02, "Someone has already registered with ID 101"))
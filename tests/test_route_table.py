@@ -0,0 +1,68 @@
+import unittest
+from RouteTable import RouteTable
+
+class TestRouteTable(unittest.TestCase):
+    def setUp(self):
+        # Rivendell (2) and Gondor (3) are adjacent servers, Frodo (101) an adjacent client; Elrond (201) is
+        # behind Rivendell, and Aragorn (301) and Rohan (4) with Eomer (401) are behind Gondor
+        self.table = RouteTable()
+        for link_id in (2, 3, 101):
+            self.table.add_link(link_id, "connection%i" % link_id)
+        for destination_id, link_id in ((201, 2), (301, 3), (4, 3), (401, 3)):
+            self.table.add(destination_id, link_id)
+
+
+    def test_lookup(self):
+        self.assertEqual(len(self.table), 7)
+        self.assertEqual(self.table.lookup(101), "connection101")
+        self.assertEqual(self.table.lookup(401), "connection3")
+        self.assertEqual(self.table.next_hop(401), 3)
+        self.assertIsNone(self.table.lookup(999))
+        self.assertEqual(self.table.routed_through(3), {301, 4, 401})
+        self.assertEqual(self.table.routed_through(101), set())
+
+        # Routes through a link whose connection is gone lead nowhere until they are moved or removed
+        self.table.remove_link(3)
+        self.assertIsNone(self.table.lookup(401))
+        self.assertIn(401, self.table)
+
+    def test_add_move_and_remove(self):
+        self.table.add(401, 2)
+        self.assertEqual(self.table.routed_through(2), {201, 401})
+        self.assertEqual(self.table.routed_through(3), {301, 4})
+        self.table.move((301, 4), 2)
+        self.assertEqual(self.table.routed_through(2), {201, 301, 4, 401})
+        self.assertEqual(self.table.routed_through(3), set())
+
+        self.assertEqual(self.table.remove(401), 2)
+        self.assertIsNone(self.table.remove(401))
+        self.assertNotIn(401, self.table.routed_through(2))
+        self.assertEqual(self.table.remove(101), 101)
+        self.assertEqual(len(self.table), 5)
+
+    def test_move_link(self):
+        self.assertEqual(self.table.move_link(3, 2), {301, 4, 401})
+        self.assertEqual(self.table.routed_through(2), {201, 301, 4, 401})
+        self.assertEqual(self.table.routed_through(3), set())
+        self.assertEqual(self.table.next_hop(3), 3)
+        self.assertEqual(self.table.move_link(3, 2), set())
+
+    def test_move_link_to_a_host_behind_it(self):
+        # Gondor leaves and hands its links over to Rohan, which was behind it
+        self.table.add_link(4, "connection4")
+        self.assertEqual(self.table.move_link(3, 4), {301, 401})
+        self.assertEqual(self.table.next_hop(4), 4)
+        self.assertEqual(self.table.routed_through(4), {301, 401})
+        self.assertEqual(self.table.lookup(301), "connection4")
+
+    def test_pop_link_routes(self):
+        self.assertEqual(self.table.pop_link_routes(3), {301, 4, 401})
+        self.assertEqual(set(self.table.next_hops), {2, 3, 101, 201})
+        self.assertEqual(self.table.pop_link_routes(3), set())
+
+    def test_rebuild(self):
+        self.table.rebuild([(2, 2), (3, 3), (201, 3), (301, 2), (4, 2)])
+        self.assertEqual(self.table.routed_through(2), {301, 4})
+        self.assertEqual(self.table.routed_through(3), {201})
+        self.assertNotIn(401, self.table)
+        self.assertEqual(self.table.lookup(4), "connection2")
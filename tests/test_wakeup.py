@@ -0,0 +1,82 @@
+import unittest, threading, time, socket
+from unittest import mock
+from optparse import Values
+from ChatServer import CRCServer
+from AsyncChatServer import AsyncCRCServer
+from ChatMessageParser import *
+
+class TestWakeup(unittest.TestCase):
+    def setUp(self):
+        self.options = Values({'id': 1, 'servername': 'theshire', 'info': 'Home of the Hobbits', 'port': 47050,
+                               'connect_to_host': None, 'connect_to_port': None, 'log_file': None})
+
+    def tearDown(self):
+        pass
+
+
+    def start_server(self, server_class):
+        server = server_class(self.options, run_on_localhost=True)
+        thread = threading.Thread(target=server.run)
+        thread.start()
+        time.sleep(0.2)
+        return server, thread
+
+    def count_selects(self, selector_class):
+        # Records every select() call made through selector_class from now on, i.e. every time an event loop 
+        # using it goes back to waiting for events
+        calls = []
+        select = selector_class.select
+        def counting_select(selector, timeout=None):
+            calls.append(timeout)
+            return select(selector, timeout)
+        patcher = mock.patch.object(selector_class, 'select', counting_select)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return calls
+
+    def check_terminates_immediately(self, server_class):
+        server, thread = self.start_server(server_class)
+        # Nothing is due, so the loop stays blocked in select() until something wakes it up (a loop polling 
+        # every 100 ms would go back to select() several times)
+        try:
+            selects = self.count_selects(type(server.sel))
+            time.sleep(0.35)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(selects, [])
+        finally:
+            server.request_terminate = True
+            thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+
+    def check_submit(self, server_class):
+        server, thread = self.start_server(server_class)
+        try:
+            sock = socket.create_connection(('127.0.0.1', self.options.port))
+            sock.settimeout(5)
+            sock.sendall(ClientRegistrationMessage.bytes(101, 0, "frodobaggins", "Test info"))
+            decoder = MessageFrameDecoder()
+            self.assertEqual(decoder.feed(sock.recv(65536))[0].message_type, 0x01)
+
+            # Inject a message from this (non event loop) thread
+            server.submit(101, StatusUpdateMessage.bytes(1, 101, 0x00, "Submitted from another thread"))
+            messages = []
+            while not messages:
+                messages = decoder.feed(sock.recv(65536))
+            self.assertEqual(messages[0].content, "Submitted from another thread")
+            sock.close()
+        finally:
+            server.request_terminate = True
+            thread.join()
+
+
+    def test_selector_terminates_immediately(self):
+        self.check_terminates_immediately(CRCServer)
+
+    def test_asyncio_terminates_immediately(self):
+        self.check_terminates_immediately(AsyncCRCServer)
+
+    def test_selector_submit(self):
+        self.check_submit(CRCServer)
+
+    def test_asyncio_submit(self):
+        self.check_submit(AsyncCRCServer)
@@ -0,0 +1,54 @@
+import unittest, threading, time, socket
+from optparse import Values
+from ChatServer import CRCServer
+from ChatMessageParser import *
+
+class TestWriteCoalescing(unittest.TestCase):
+    def setUp(self):
+        options = Values({'id': 1, 'servername': 'theshire', 'info': 'Home of the Hobbits', 'port': 47070,
+                          'connect_to_host': None, 'connect_to_port': None, 'log_file': None})
+        self.server = CRCServer(options, run_on_localhost=True)
+        self.thread = threading.Thread(target=self.server.run)
+        self.thread.start()
+        time.sleep(0.2)
+
+        self.sock = socket.create_connection(('127.0.0.1', 47070))
+        self.sock.settimeout(5)
+        self.sock.sendall(ClientRegistrationMessage.bytes(101, 0, "frodobaggins", "Test info"))
+        self.decoder = MessageFrameDecoder()
+        self.assertEqual(len(self.receive(1)), 1)
+        # The server updates its write counters after the send call returns
+        time.sleep(0.1)
+
+    def tearDown(self):
+        self.sock.close()
+        self.server.request_terminate = True
+        self.thread.join()
+
+
+    def receive(self, count):
+        messages = []
+        while len(messages) < count:
+            messages += self.decoder.feed(self.sock.recv(65536))
+        return messages
+
+    def send_burst(self, count):
+        for index in range(count):
+            self.server.send_message_to_host(101, StatusUpdateMessage.bytes(1, 101, 0x00, "Status %i" % index))
+
+
+    def test_burst_is_sent_with_one_send_call(self):
+        before = self.server.write_counters.copy()
+        self.server.call_soon_threadsafe(self.send_burst, 100)
+        messages = self.receive(100)
+        self.assertEqual([m.content for m in messages], ["Status %i" % index for index in range(100)])
+        time.sleep(0.1)
+
+        self.assertEqual(self.server.write_counters['send_calls'] - before['send_calls'], 1)
+        self.assertEqual(self.server.write_counters['messages_sent'] - before['messages_sent'], 100)
+        # The socket drained right away, so it never had to be registered for EVENT_WRITE
+        self.assertEqual(self.server.write_counters['selector_updates'], before['selector_updates'])
+
+    def test_nagle_is_disabled(self):
+        connection = self.server.adjacent_connections[101]
+        self.assertTrue(connection.sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY))